@@ -0,0 +1,213 @@
+"""
+End-to-end latency benchmark.
+
+Runs the whole app (vibrator.main) against a local fake MAC event stream and a fake Intiface server, fires
+scripted bursts of kill events through it, and measures how long each takes to turn into a device command.
+
+    python -m benchmarks.latency --bursts 10 --burst-size 5 --output results.json
+
+Results are written as JSON so runs can be compared between releases.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import bisect
+import json
+import platform
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import toml
+
+from mac_toys.config import Config
+from mac_toys.metrics import PipelineMetrics
+from mac_toys.sim.intiface import FakeIntifaceServer, VirtualDevice, CommandRecord
+from mac_toys.sim.mac_server import FakeMACServer, kill_event
+from mac_toys.vibrator import main, __version__
+
+PLAYER: tuple[str, str] = ("bench player", "76561197960287930")
+ENEMY: tuple[str, str] = ("bench enemy", "76561197960287931")
+
+
+def write_bench_config(directory: Path) -> Path:
+    """
+    Write a copy of the repo config with the benchmark player, and the ambient vibration switched off so
+    every command the devices see is caused by an event. The virtual devices are remembered alongside it,
+    rather than in the user's own device registry.
+    """
+    _config = toml.load(Path(__file__).parent.parent / "config.toml")
+    _config['in_game_name'] = PLAYER[0]
+    _config['steamid_64'] = PLAYER[1]
+    for _table in ('intensity', 'intensity_variance'):
+        for _key in _config['ambience'][_table]:
+            _config['ambience'][_table][_key] = 0.0
+    _config.setdefault('devices', {})['registry'] = str(directory / "bench_devices.json")
+
+    _path = directory / "bench_config.toml"
+    with open(_path, "w") as _file:
+        toml.dump(_config, _file)
+    return _path
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return float('nan')
+    _sorted = sorted(values)
+    return _sorted[min(len(_sorted) - 1, round(fraction * (len(_sorted) - 1)))]
+
+
+def event_latencies(sent: list[tuple[float, float]], commands: list[CommandRecord]) -> list[float]:
+    """
+    Match each event to the first command after it that raised the intensity, and was not dropped on the
+    device link. The event lands when the device applies that command.
+    Events are only matched up to their horizon (the start of the next burst), as events arriving close
+    together can land in the same command.
+
+    :param sent: (send time, horizon) of each event
+    :return: latency of each event that landed, in ms
+    """
+    _times = [x.received_at for x in commands]
+    _latencies = []
+    for _sent_at, _horizon in sent:
+        _index = bisect.bisect_left(_times, _sent_at)
+        while _index < len(commands) and _times[_index] < _horizon:
+            _previous = commands[_index - 1].scalar if _index > 0 else 0.0
+            if commands[_index].scalar > _previous and not commands[_index].dropped:
+                _latencies.append((commands[_index].applied_at - _sent_at) * 1000)
+                break
+            _index += 1
+    return _latencies
+
+
+async def run_benchmark(
+        bursts: int,
+        burst_size: int,
+        burst_gap: float,
+        pause: float,
+        devices: int,
+        link: dict = None
+) -> dict:
+    """
+    :param link: settings for each device's simulated link, as VirtualDevice fields
+    """
+    link = link or {}
+    _mac = FakeMACServer()
+    _intiface = FakeIntifaceServer(
+        [VirtualDevice(f"Bench Vibrator {i}", **link) for i in range(devices)], seed=0
+    )
+    await _mac.start()
+    await _intiface.start()
+
+    _stop = asyncio.Event()
+    _app = asyncio.create_task(main(
+        Config(),
+        sse_endpoint=_mac.url,
+        ws_host=_intiface.host,
+        ws_port=_intiface.port,
+        stop_event=_stop,
+    ))
+    await _mac.wait_for_client()
+    # Let the controllers settle before measuring anything
+    await asyncio.sleep(1.0)
+    _intiface.commands.clear()
+
+    _sent = []
+    _cpu_start = time.process_time()
+    _wall_start = time.monotonic()
+    for _burst in range(bursts):
+        _burst_sent = []
+        for _kill in range(burst_size):
+            _burst_sent.append(_mac.send(kill_event(PLAYER, ENEMY, crit=_kill % 2 == 1)))
+            await asyncio.sleep(burst_gap)
+        await asyncio.sleep(pause)
+        _horizon = time.monotonic()
+        _sent.extend((_sent_at, _horizon) for _sent_at in _burst_sent)
+    _wall = time.monotonic() - _wall_start
+    _cpu = time.process_time() - _cpu_start
+
+    _stop.set()
+    await _app
+    await _mac.stop()
+    await _intiface.stop()
+
+    _latencies = event_latencies(_sent, _intiface.commands)
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scenario': {
+            'bursts': bursts,
+            'burst_size': burst_size,
+            'burst_gap_ms': burst_gap * 1000,
+            'pause_s': pause,
+            'devices': devices,
+            'link': link,
+        },
+        'events_sent': len(_sent),
+        # Events that arrive close together can share a command, so this can be lower than events_sent
+        'events_landed': len(_latencies),
+        'latency_ms': {
+            'p50': percentile(_latencies, 0.50),
+            'p99': percentile(_latencies, 0.99),
+            'max': max(_latencies, default=float('nan')),
+            'mean': sum(_latencies) / len(_latencies) if _latencies else float('nan'),
+        },
+        # The app's own view of where the time goes, per stage
+        'stages_ms': PipelineMetrics().snapshot(),
+        'commands': len(_intiface.commands),
+        'commands_dropped': sum(x.dropped for x in _intiface.commands),
+        'commands_per_sec': len(_intiface.commands) / _wall,
+        # Includes the fake servers, which run in the same process
+        'cpu_time_s': _cpu,
+        'wall_time_s': _wall,
+    }
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument("--bursts", type=int, default=10, help="number of bursts of kills (default: 10)")
+    _parser.add_argument("--burst-size", type=int, default=5, help="kills per burst (default: 5)")
+    _parser.add_argument("--burst-gap", type=float, default=50, help="ms between kills in a burst (default: 50)")
+    _parser.add_argument("--pause", type=float, default=2.5, help="seconds between bursts (default: 2.5)")
+    _parser.add_argument("--devices", type=int, default=1, help="number of virtual devices (default: 1)")
+    _parser.add_argument("--latency", type=float, default=0.0, help="device link latency in ms (default: 0)")
+    _parser.add_argument("--jitter", type=float, default=0.0, help="device link jitter in ms (default: 0)")
+    _parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of commands lost (default: 0)")
+    _parser.add_argument(
+        "--max-rate", type=float, default=0.0, help="device commands per second, 0 is no limit (default: 0)"
+    )
+    _parser.add_argument("--output", type=Path, help="write the results here rather than to stdout")
+    return _parser.parse_args(argv)
+
+
+def run(argv: list[str] = None) -> None:
+    _args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as _directory:
+        # The first Config made is the one everything uses
+        Config(write_bench_config(Path(_directory)))
+        # Keep the app's own output off stdout, so the results there stay machine readable
+        with redirect_stdout(sys.stderr):
+            _results = asyncio.run(run_benchmark(
+                _args.bursts, _args.burst_size, _args.burst_gap / 1000, _args.pause, _args.devices,
+                {
+                    'latency_ms': _args.latency,
+                    'jitter_ms': _args.jitter,
+                    'drop_rate': _args.drop_rate,
+                    'max_rate': _args.max_rate,
+                }
+            ))
+
+    if _args.output is not None:
+        with open(_args.output, "w") as _file:
+            json.dump(_results, _file, indent=2)
+    else:
+        json.dump(_results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    run()
@@ -1,13 +1,51 @@
 __all__ = ['run_app']
 __name__ = "MAC Toys"
 __author__ = "Lilith"
-from asyncio import run
-from .config import Config
-from .vibrator import main, __version__
+import time
+from argparse import ArgumentParser
+from pathlib import Path
 
 
-def run_app():
+def _parse_args(argv: list[str] = None):
+    _parser = ArgumentParser(description="Buttplug.io integration for MAC")
+    _parser.add_argument(
+        "--record", type=Path, metavar="FILE",
+        help="Append every raw MAC event received to this file, for replaying later"
+    )
+    _parser.add_argument(
+        "--replay", type=Path, metavar="FILE",
+        help="Take events from a recording made with --record instead of the MAC backend"
+    )
+    _parser.add_argument(
+        "--replay-speed", type=float, default=1.0, metavar="N",
+        help="Replay at N times the recorded speed, 0 replays as fast as possible (default: 1)"
+    )
+    _parser.add_argument(
+        "--profile-startup", action="store_true",
+        help="Print how long each part of starting up took, once the first command reaches a toy"
+    )
+    return _parser.parse_args(argv)
+
+
+def run_app(argv: list[str] = None):
+    _started_at = time.monotonic()
+    _args = _parse_args(argv)
+    # The app itself is only imported once it's going to run, so --help (and importing any of the standalone
+    # tools under mac_toys) doesn't have to load it all
+    from .metrics import StartupProfile
+    if _args.profile_startup:
+        StartupProfile().start(_started_at)
+    from asyncio import run
+    from .config import Config, ConfigError
+    from .vibrator import main, __version__
+    StartupProfile().mark("imports")
+
     print("Loading configuration file...")
-    _config = Config()
+    try:
+        _config = Config()
+    except ConfigError as e:
+        print(e)
+        return
+    StartupProfile().mark("config")
     print(f"Running {__author__}'s {__name__} app version {__version__}...")
-    run(main(_config))
+    run(main(_config, record=_args.record, replay=_args.replay, replay_speed=_args.replay_speed))
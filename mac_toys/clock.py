@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from random import Random
+
+
+class Clock:
+    """
+    The time the vibration controls run on, the monotonic clock unless a simulation swaps in a VirtualClock.
+    """
+
+    def now(self) -> float:
+        """
+        :return: the current monotonic time (s)
+        """
+        return time.monotonic()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        """
+        Sleep until the event is set, or for at most the timeout (s).
+
+        :return: whether the event was set
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                await event.wait()
+        except TimeoutError:
+            return False
+        return True
+
+
+class VirtualClock(Clock):
+    """
+    A clock that only moves when told to, so a simulation can skip straight to whatever is due next.
+    """
+    _now: float = None
+
+    def __init__(self, start: float = 0.0) -> None:
+        self._now = start
+
+    def now(self) -> float:
+        return self._now
+
+    async def sleep(self, seconds: float) -> None:
+        raise RuntimeError("Nothing can sleep on a virtual clock, the simulation moves it forwards instead.")
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        raise RuntimeError("Nothing can sleep on a virtual clock, the simulation moves it forwards instead.")
+
+    def advance_to(self, when: float) -> None:
+        """
+        Move the clock forwards to the given time. Never moves it backwards.
+        """
+        if when > self._now:
+            self._now = when
+
+
+_clock: Clock = Clock()
+_rng: Random = Random()
+
+
+def clock() -> Clock:
+    return _clock
+
+
+def rng() -> Random:
+    """
+    :return: where the vibration controls get their randomness (i.e. the ambience's variance) from
+    """
+    return _rng
+
+
+def use(clock: Clock = None, rng: Random = None) -> None:
+    """
+    Swap in the clock and/or random number generator the vibration controls use from now on. Do so before
+    creating them, as they take the time they start at from the clock.
+    """
+    global _clock, _rng
+    if clock is not None:
+        _clock = clock
+    if rng is not None:
+        _rng = rng
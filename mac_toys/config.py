@@ -1,22 +1,224 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Literal
+from types import MappingProxyType
+from typing import Any, Callable, Literal, Mapping
 
 import toml
 
-from mac_toys.sse_listener import Singleton
+from mac_toys.curves import Curve, CurveRegistry
+from mac_toys.helpers import SingletonABCMeta, prnt
 from mac_toys.tracker import UpdateTypes
+from mac_toys.vibration.mixer import BlendMode
 
+# The keys every [instant] table may have, and the keys every streak-scaled [ambience] table must have
+INSTANT_KEYS: tuple[str, ...] = (
+    'on_death', 'on_kill', 'on_crit_kill', 'on_crit_death', 'on_you_chat_msg', 'on_any_chat_msg',
+    'on_domination', 'on_undominated', 'on_lost_domination', 'on_dominated',
+)
+STREAK_KEYS: tuple[str, ...] = (
+    'killstreak_minimum', 'killstreak_maximum', 'deathstreak_minimum', 'deathstreak_maximum'
+)
 
-class Config(metaclass=Singleton):
-    CONFIG_PATH: Path = None
-    _configs: dict = None
 
-    def __init__(self, path: Path = Path("./config.toml")) -> None:
-        self.CONFIG_PATH = path
-        self._configs = toml.load(self.CONFIG_PATH)
+class ConfigError(ValueError):
+    """
+    The config file can't be read, or is missing something or has a value of the wrong type.
+    """
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({_key: _freeze(_value) for _key, _value in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(x) for x in value)
+    return value
+
+
+def _table(values: Mapping, *path: str, required: bool = True) -> Mapping:
+    _current = values
+    for _depth, _key in enumerate(path):
+        _current = _current.get(_key)
+        if _current is None and not required:
+            return {}
+        if not isinstance(_current, Mapping):
+            raise ConfigError(f"[{'.'.join(path[:_depth + 1])}] is missing.")
+    return _current
+
+
+def _require_numbers(table: Mapping, name: str, keys: tuple[str, ...] = None) -> None:
+    """
+    Check the given keys (or every key if None) of a table are numbers.
+    """
+    for _key in keys if keys is not None else tuple(table):
+        _value = table.get(_key)
+        if isinstance(_value, bool) or not isinstance(_value, (int, float)):
+            raise ConfigError(f"'{_key}' in [{name}] needs to be a number, not {_value!r}.")
+
+
+def _merge(base: Mapping, override: Mapping) -> dict:
+    """
+    :return: the base with everything the override sets replaced, table by table
+    """
+    _merged = dict(base)
+    for _key, _value in override.items():
+        if isinstance(_value, Mapping) and isinstance(_merged.get(_key), Mapping):
+            _merged[_key] = _merge(_merged[_key], _value)
+        else:
+            _merged[_key] = _value
+    return _merged
+
+
+def profile_values(values: Mapping) -> list[dict]:
+    """
+    :return: the settings each player profile ends up with, or just the config itself if it has no profiles
+    """
+    _base = {_key: _value for _key, _value in values.items() if _key != 'profiles'}
+    return [_merge(_base, x) for x in values.get('profiles', ())] or [_base]
+
+
+def validate(values: Mapping) -> None:
+    """
+    Check a loaded config has everything the app looks up, with the right types.
+
+    :raises ConfigError: on the first problem found
+    """
+    _profiles = values.get('profiles', [])
+    if not isinstance(_profiles, list) or not all(isinstance(x, Mapping) for x in _profiles):
+        raise ConfigError("[[profiles]] need to be tables.")
+    _listed = set()
+    _unlisted = 0
+    for _index, _profile in enumerate(profile_values(values)):
+        try:
+            _validate_profile(_profile)
+        except ConfigError as e:
+            if not _profiles:
+                raise
+            raise ConfigError(f"In profile {_index + 1}: {e}") from e
+        for _toy in _profile.get('toys', ()):
+            if _toy in _listed:
+                raise ConfigError(f"The toy '{_toy}' is listed by more than one profile.")
+            _listed.add(_toy)
+        _unlisted += 'toys' not in _profile
+    # Every toy no profile lists goes to the one that leaves 'toys' out, two would both drive the same toys
+    if _unlisted > 1:
+        raise ConfigError("Only one profile can leave out 'toys', the rest need to list their toys.")
+
+    _devices = _table(values, 'devices', required=False)
+    _require_numbers(_devices, 'devices', tuple(x for x in _devices if x != 'registry'))
+    if not isinstance(_devices.get('registry', ''), str):
+        raise ConfigError("'registry' in [devices] needs to be a file name.")
+    _dispatch = _table(values, 'dispatch', required=False)
+    _require_numbers(_dispatch, 'dispatch', tuple(x for x in _dispatch if x != 'separate_process'))
+    if not isinstance(_dispatch.get('separate_process', False), bool):
+        raise ConfigError("'separate_process' in [dispatch] needs to be true or false.")
+    _require_numbers(_table(values, 'display', required=False), 'display')
+
+
+def _validate_profile(values: Mapping) -> None:
+    if not isinstance(values.get('name', ''), str):
+        raise ConfigError("'name' needs to be text.")
+    _toys = values.get('toys', [])
+    if not isinstance(_toys, (list, tuple)) or not all(isinstance(x, str) for x in _toys):
+        raise ConfigError("'toys' needs to be a list of toy names.")
+    if not isinstance(values.get('in_game_name'), str):
+        raise ConfigError("'in_game_name' needs to be set to your name in game.")
+    if not isinstance(values.get('steamid_64'), (str, int)):
+        raise ConfigError("'steamid_64' needs to be set to your SteamID64.")
+
+    _require_numbers(_table(values, 'instant', 'times'), 'instant.times', INSTANT_KEYS)
+    _require_numbers(_table(values, 'instant', 'intensity'), 'instant.intensity', INSTANT_KEYS)
+    _require_numbers(
+        _table(values, 'instant', 'chat_trigger_intensity', required=False), 'instant.chat_trigger_intensity'
+    )
+    for _key, _blend in _table(values, 'instant', 'blend', required=False).items():
+        if not isinstance(_blend, str) or _blend.upper() not in BlendMode.__members__:
+            raise ConfigError(f"'{_key}' in [instant.blend] needs to be one of \"add\", \"max\" or \"duck\".")
+    _require_numbers(_table(values, 'instant', 'priority', required=False), 'instant.priority')
+    _chat_messages = _table(values, 'instant', 'chat_messages')
+    for _key in ('trigger_on_you_say', 'trigger_on_any_say'):
+        _messages = _chat_messages.get(_key)
+        if not isinstance(_messages, (list, tuple)) or not all(isinstance(x, str) for x in _messages):
+            raise ConfigError(f"'{_key}' in [instant.chat_messages] needs to be a list of text.")
+
+    _require_numbers(_table(values, 'ambience'), 'ambience', ('transition_time',))
+    _require_numbers(
+        _table(values, 'ambience', 'max_at_value'), 'ambience.max_at_value', ('killstreak', 'deathstreak')
+    )
+    for _name in ('intensity', 'intensity_variance', 'change_rate', 'change_rate_variance'):
+        _require_numbers(_table(values, 'ambience', _name), f'ambience.{_name}', STREAK_KEYS)
+
+    _require_numbers(_table(values, 'tracking', required=False), 'tracking')
+
+
+@dataclass(frozen=True, slots=True)
+class ConfigSnapshot:
+    """
+    One validated, read-only version of the config file. A reload swaps in a whole new snapshot, so nothing
+    ever sees half of one version and half of another.
+    """
+    values: Mapping[str, Any]
+    # Curves are precomputed here once, rather than every time a slide needs one
+    curves: CurveRegistry
+    instant_curves: Mapping[str, Curve]
+    ambience_curve: Curve
+    # The settings of each player profile, as snapshots of their own (with no profiles of their own)
+    profiles: tuple[ConfigSnapshot, ...] = ()
 
-    def config(self) -> dict:
-        return self._configs
+    @classmethod
+    def load(cls, path: Path) -> ConfigSnapshot:
+        """
+        :raises ConfigError: if the file can't be read, or doesn't validate
+        """
+        try:
+            _values = toml.load(path)
+        except (OSError, toml.TomlDecodeError) as e:
+            raise ConfigError(f"Could not read {path}: {e}") from e
+        validate(_values)
+
+        _profiles = tuple(cls._build(x) for x in profile_values(_values))
+        return cls._build(_values, _profiles)
+
+    @classmethod
+    def _build(cls, values: Mapping, profiles: tuple[ConfigSnapshot, ...] = ()) -> ConfigSnapshot:
+        try:
+            _curves = CurveRegistry.from_config(values.get('curves', {}))
+            _instant_curves = {
+                _key: _curves.get(_name) for _key, _name in values.get('instant', {}).get('curves', {}).items()
+            }
+            _ambience_curve = _curves.get(values.get('ambience', {}).get('curve', 'linear'))
+        except (KeyError, ValueError, TypeError) as e:
+            raise ConfigError(str(e)) from e
+        return cls(_freeze(values), _curves, MappingProxyType(_instant_curves), _ambience_curve, profiles)
+
+
+class ConfigView(ABC):
+    """
+    Looks settings up in a config snapshot. The config file as a whole is one, and so is each player profile
+    in it, with the profile's own settings in place of the file's.
+    """
+    _snapshot: ConfigSnapshot = None
+
+    @property
+    def _configs(self) -> Mapping[str, Any]:
+        return self._snapshot.values
+
+    def config(self) -> Mapping[str, Any]:
+        return self._snapshot.values
+
+    def snapshot(self) -> ConfigSnapshot:
+        return self._snapshot
+
+    @abstractmethod
+    def add_listener(self, listener: Callable[[ConfigView], None]) -> None:
+        """
+        Have the listener called with the view after every reload, to pick up the new values.
+        """
+        pass
 
     @staticmethod
     def _parse_update_types(update_type_enum: UpdateTypes) -> str:
@@ -51,7 +253,7 @@ class Config(metaclass=Singleton):
                 'on_domination', 'on_undominated', 'on_lost_domination', 'on_dominated',
             ] | UpdateTypes
     ) -> float:
-        _key = Config._parse_update_types(key) if isinstance(key, UpdateTypes) else key
+        _key = ConfigView._parse_update_types(key) if isinstance(key, UpdateTypes) else key
 
         return self._configs['instant']['intensity'][_key]
 
@@ -62,21 +264,73 @@ class Config(metaclass=Singleton):
                 'on_domination', 'on_undominated', 'on_lost_domination', 'on_dominated',
             ] | UpdateTypes
     ) -> int:
-        _key = Config._parse_update_types(key) if isinstance(key, UpdateTypes) else key
+        _key = ConfigView._parse_update_types(key) if isinstance(key, UpdateTypes) else key
 
         return self._configs['instant']['times'][_key]
 
+    def instant_curve(
+            self,
+            key: Literal[
+                'on_death', 'on_kill', 'on_crit_kill', 'on_crit_death', 'on_you_chat_msg', 'on_any_chat_msg',
+                'on_domination', 'on_undominated', 'on_lost_domination', 'on_dominated',
+            ] | UpdateTypes
+    ) -> Curve:
+        _key = ConfigView._parse_update_types(key) if isinstance(key, UpdateTypes) else key
+
+        _snapshot = self._snapshot
+        return _snapshot.instant_curves.get(_key) or _snapshot.curves.get('linear')
+
+    def instant_blend(
+            self,
+            key: Literal[
+                'on_death', 'on_kill', 'on_crit_kill', 'on_crit_death', 'on_you_chat_msg', 'on_any_chat_msg',
+                'on_domination', 'on_undominated', 'on_lost_domination', 'on_dominated',
+            ] | UpdateTypes
+    ) -> BlendMode:
+        _key = ConfigView._parse_update_types(key) if isinstance(key, UpdateTypes) else key
+
+        return BlendMode[self._configs['instant'].get('blend', {}).get(_key, 'add').upper()]
+
+    def instant_priority(
+            self,
+            key: Literal[
+                'on_death', 'on_kill', 'on_crit_kill', 'on_crit_death', 'on_you_chat_msg', 'on_any_chat_msg',
+                'on_domination', 'on_undominated', 'on_lost_domination', 'on_dominated',
+            ] | UpdateTypes
+    ) -> int:
+        _key = ConfigView._parse_update_types(key) if isinstance(key, UpdateTypes) else key
+
+        return int(self._configs['instant'].get('priority', {}).get(_key, 0))
+
     def instant_chat_messages(
             self,
             key: Literal[
                 'trigger_on_you_say', 'trigger_on_any_say'
             ]
     ) -> list[str]:
-        return self._configs['instant']['chat_messages'][key]
+        return list(self._configs['instant']['chat_messages'][key])
+
+    def instant_chat_matching(
+            self,
+            key: Literal[
+                'word_boundary', 'case_fold'
+            ]
+    ) -> bool:
+        _defaults = {'word_boundary': False, 'case_fold': True}
+        return bool(self._configs['instant'].get('chat_matching', {}).get(key, _defaults[key]))
+
+    def instant_chat_trigger_intensity(self, trigger: str) -> float | None:
+        """
+        :return: The intensity configured for this specific chat trigger, or None to use the event's intensity
+        """
+        return self._configs['instant'].get('chat_trigger_intensity', {}).get(trigger)
 
     def ambience_transition_time(self) -> int:
         return self._configs['ambience']['transition_time']
 
+    def ambience_curve(self) -> Curve:
+        return self._snapshot.ambience_curve
+
     def ambience_max_at_value(
             self,
             key: Literal[
@@ -117,6 +371,160 @@ class Config(metaclass=Singleton):
     ) -> float:
         return self._configs['ambience']['change_rate_variance'][key]
 
+    def tracking_max_opponents(self) -> int:
+        return int(self._configs.get('tracking', {}).get('max_opponents', 256))
+
+    def tracking_opponent_idle_minutes(self) -> float:
+        return float(self._configs.get('tracking', {}).get('opponent_idle_minutes', 30.0))
+
+    def devices_registry_path(self) -> Path:
+        return Path(self._configs.get('devices', {}).get('registry', 'devices.json'))
+
+    def devices_scan_timeout(self) -> float:
+        return float(self._configs.get('devices', {}).get('scan_timeout', 10.0))
+
+    def devices_scan_settle(self) -> float:
+        return float(self._configs.get('devices', {}).get('scan_settle', 1.0))
+
+    def dispatch_keepalive(self) -> float:
+        return float(self._configs.get('dispatch', {}).get('keepalive', 0.0))
+
+    def dispatch_controller_frequency(self) -> float:
+        return float(self._configs.get('dispatch', {}).get('controller_frequency', 5.0))
+
+    def dispatch_initial_rate(self) -> float:
+        return float(self._configs.get('dispatch', {}).get('initial_rate', 5.0))
+
+    def dispatch_min_rate(self) -> float:
+        return float(self._configs.get('dispatch', {}).get('min_rate', 1.0))
+
+    def dispatch_max_rate(self) -> float:
+        return float(self._configs.get('dispatch', {}).get('max_rate', 20.0))
+
+    def dispatch_command_timeout(self) -> float:
+        return float(self._configs.get('dispatch', {}).get('command_timeout', 0.5))
+
+    def dispatch_separate_process(self) -> bool:
+        return bool(self._configs.get('dispatch', {}).get('separate_process', False))
+
+    def display_fps(self) -> float:
+        return float(self._configs.get('display', {}).get('fps', 10.0))
+
+    def display_events(self) -> int:
+        return int(self._configs.get('display', {}).get('events', 12))
+
+
+class Config(ConfigView, metaclass=SingletonABCMeta):
+    CONFIG_PATH: Path = None
+    _snapshot: ConfigSnapshot = None
+    # Called with the config after every successful reload
+    _listeners: list[Callable[[Config], None]] = None
+    # (modification time, size) of the file when last loaded
+    _file_stamp: tuple[int, int] = None
+
+    def __init__(self, path: Path = Path("./config.toml")) -> None:
+        self.CONFIG_PATH = path
+        self._listeners = []
+        self._file_stamp = self._stat()
+        self._snapshot = ConfigSnapshot.load(self.CONFIG_PATH)
+
+    def add_listener(self, listener: Callable[[Config], None]) -> None:
+        """
+        Have the listener called (on the event loop) after every reload, to pick up the new values.
+        """
+        self._listeners.append(listener)
+
+    def _stat(self) -> tuple[int, int] | None:
+        try:
+            _stat = os.stat(self.CONFIG_PATH)
+        except OSError:
+            return None
+        return _stat.st_mtime_ns, _stat.st_size
+
+    def reload(self) -> bool:
+        """
+        Load the config file again, and if it validates swap it in and tell every listener. If it doesn't,
+        the current config stays as it is.
+
+        :return: whether the new config was swapped in
+        """
+        try:
+            _snapshot = ConfigSnapshot.load(self.CONFIG_PATH)
+        except ConfigError as e:
+            prnt(f"Not reloading {self.CONFIG_PATH.name}, keeping the current settings: {e}")
+            return False
+        if len(_snapshot.profiles) != len(self._snapshot.profiles):
+            prnt(f"Not reloading {self.CONFIG_PATH.name}, profiles can only be added or removed on restart")
+            return False
+
+        self._snapshot = _snapshot
+        for _listener in self._listeners:
+            _listener(self)
+        prnt(f"Reloaded {self.CONFIG_PATH.name}")
+        return True
+
+    async def watch(self, interval: float = 1.0) -> None:
+        """
+        Reload the config whenever the file changes, checking every interval (s).
+        """
+        while True:
+            await asyncio.sleep(interval)
+            _stamp = self._stat()
+            if _stamp is None or _stamp == self._file_stamp:
+                continue
+            # Only try each version once, a broken one waits for the next save
+            self._file_stamp = _stamp
+            self.reload()
+
+    def profiles(self) -> list[ProfileConfig]:
+        """
+        :return: a view of the settings of each player profile, or of the whole config if it has no profiles
+        """
+        return [ProfileConfig(self, x) for x in range(len(self._snapshot.profiles))]
+
+
+class ProfileConfig(ConfigView):
+    """
+    The settings of one player profile, following the config file through reloads.
+    """
+    parent: Config = None
+    index: int = None
+
+    def __init__(self, parent: Config, index: int) -> None:
+        self.parent = parent
+        self.index = index
+
+    @property
+    def _snapshot(self) -> ConfigSnapshot:
+        return self.parent.snapshot().profiles[self.index]
+
+    def add_listener(self, listener: Callable[[ProfileConfig], None]) -> None:
+        self.parent.add_listener(lambda _: listener(self))
+
+    def name(self) -> str:
+        return self._configs.get('name', self._configs['in_game_name'])
+
+    def toys(self) -> tuple[str, ...] | None:
+        """
+        :return: the names of the toys this profile drives, or None for every toy no other profile lists
+        """
+        return self._configs.get('toys')
+
+
+def toy_filters(profiles: list[ProfileConfig]) -> list[Callable[[str], bool]]:
+    """
+    :return: for each profile, whether a toy (by name) is one of its toys
+    """
+    _listed = {x for _profile in profiles for x in _profile.toys() or ()}
+    _filters = []
+    for _profile in profiles:
+        _toys = _profile.toys()
+        if _toys is None:
+            _filters.append(lambda x: x not in _listed)
+        else:
+            _filters.append(set(_toys).__contains__)
+    return _filters
+
 
 if __name__ == "__main__":
     _conf = Config(Path("../config.toml"))
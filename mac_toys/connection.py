@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+from buttplug import Client, WebsocketConnector, ProtocolSpec, Device
+
+from mac_toys.config import Config
+from mac_toys.device_registry import DeviceRegistry
+from mac_toys.dispatch import ActuatorDispatcher
+from mac_toys.helpers import prnt, Singleton
+from mac_toys.metrics import StartupProfile
+
+
+class DeviceConnection(metaclass=Singleton):
+    """
+    The one connection to Intiface, shared by every player profile. Finds the devices at startup, and
+    reconnects if the connection drops.
+    """
+    client: Client = None
+    config: Config = None
+    connector: WebsocketConnector = None
+    # Decides which actuators need a command for an intensity, for every device whichever profile drives it
+    dispatcher: ActuatorDispatcher = None
+    # Counts the connections made, so whoever holds on to the devices can tell when to take them again
+    generation: int = None
+    _connecting: asyncio.Lock = None
+
+    def __init__(self, config: Config, ws_host: str = "127.0.0.1", port: int = 12345) -> None:
+        self.client = Client("MAC Toys Client", ProtocolSpec.v3)
+        self.connector = WebsocketConnector(f"ws://{ws_host}:{port}")
+        self.config = config
+        self.dispatcher = ActuatorDispatcher(config.dispatch_keepalive())
+        self.generation = 0
+        self._connecting = asyncio.Lock()
+
+    def devices(self) -> list[Device]:
+        return list(self.client.devices.values())
+
+    async def connect_and_scan(self) -> None:
+        assert self.connector is not None
+
+        # If this succeeds, we'll be connected. If not, we'll probably have some
+        # sort of exception thrown of type ButtplugError.
+        try:
+            await self.client.connect(self.connector)
+        except Exception as e:
+            prnt(f"Could not connect to server, exiting: {e}")
+            return
+        self.generation += 1
+        StartupProfile().mark("intiface_connect")
+
+        _registry = DeviceRegistry(self.config.devices_registry_path())
+        _missing = _registry.missing(x.name for x in self.client.devices.values())
+        if len(self.client.devices) > 0 and not _missing:
+            prnt(f"Found devices connected, assuming no scan needed.")
+        else:
+            await self._scan(_registry)
+
+        for _name in _registry.missed(x.name for x in self.client.devices.values()):
+            prnt(f"Forgetting {_name}, it hasn't been found in the last {_registry.forget_after} scans")
+        _registry.remember(self.client.devices.values())
+        _registry.save()
+        StartupProfile().mark("scan")
+
+        if len(self.client.devices) > 0:
+            prnt(f"Found {len(self.client.devices)} devices!")
+        else:
+            prnt(f"Found no devices :(")
+
+    async def _scan(self, registry: DeviceRegistry) -> None:
+        """
+        Scan until every device seen before has shown up, or (with none known yet) until devices have
+        stopped showing up for a moment. Gives up after the scan timeout either way.
+        """
+        _timeout = self.config.devices_scan_timeout()
+        _settle = self.config.devices_scan_settle()
+        _missing = registry.missing(x.name for x in self.client.devices.values())
+        if _missing:
+            prnt(f"Scanning for {', '.join(sorted(_missing))}, giving up after {_timeout:.0f}s...")
+        else:
+            prnt(f"Scanning for devices now, see you in {_timeout:.0f}s at most!")
+
+        await self.client.start_scanning()
+        _started = time.monotonic()
+        _count = len(self.client.devices)
+        _last_found = _started
+        # The client has no callback for new devices, so check on them often enough not to notice
+        while (_now := time.monotonic()) - _started < _timeout:
+            await asyncio.sleep(0.05)
+            _devices = self.client.devices
+            if len(_devices) != _count:
+                _count = len(_devices)
+                _last_found = _now
+            if registry.known():
+                if not registry.missing(x.name for x in _devices.values()):
+                    break
+            elif _count > 0 and _now - _last_found >= _settle:
+                break
+        await self.client.stop_scanning()
+
+        _missing = registry.missing(x.name for x in self.client.devices.values())
+        if _missing:
+            prnt(f"Didn't find {', '.join(sorted(_missing))}, carrying on without")
+        prnt(f"Done after {time.monotonic() - _started:.1f}s.")
+
+    async def check_connection(self) -> None:
+        # Every profile checks, but only the first to find it down reconnects
+        async with self._connecting:
+            if not self.client.connected:
+                await self.client.connect(self.connector)
+                # The devices have no idea what we last told them
+                self.dispatcher.forget()
+                self.generation += 1
+
+    async def disconnect(self) -> None:
+        await self.client.disconnect()
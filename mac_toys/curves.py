@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import math
+from array import array
+from typing import Callable
+
+# Number of samples each curve is precomputed into
+CURVE_RESOLUTION: int = 256
+
+
+class Curve:
+    """
+    An easing curve, precomputed into a fixed-size table.
+
+    A curve maps the progress of a slide (0 -> 1) to how far along the value should be between its start and
+    target (0 -> 1). Sampling is a single table lookup with linear interpolation between neighbouring samples.
+    """
+    __slots__ = ('name', '_table', '_last_index')
+
+    def __init__(self, name: str, table: array) -> None:
+        if len(table) < 2:
+            raise ValueError(f"Curve '{name}' needs at least 2 samples.")
+        self.name = name
+        self._table = table
+        self._last_index = len(table) - 1
+
+    def __repr__(self) -> str:
+        return f"Curve({self.name})"
+
+    @classmethod
+    def from_function(
+            cls,
+            name: str,
+            function: Callable[[float], float],
+            resolution: int = CURVE_RESOLUTION
+    ) -> Curve:
+        _last = resolution - 1
+        return cls(name, array('d', (function(i / _last) for i in range(resolution))))
+
+    @classmethod
+    def from_points(cls, name: str, points: list[float], resolution: int = CURVE_RESOLUTION) -> Curve:
+        """
+        Build a curve from a list of points evenly spaced across the slide, linearly joined.
+        """
+        if len(points) < 2:
+            raise ValueError(f"Curve '{name}' needs at least 2 points.")
+        _points = Curve(name, array('d', (float(x) for x in points)))
+        return cls.from_function(name, _points.sample, resolution)
+
+    def sample(self, progress: float) -> float:
+        if progress <= 0.0:
+            return self._table[0]
+        if progress >= 1.0:
+            return self._table[self._last_index]
+
+        _position = progress * self._last_index
+        _index = int(_position)
+        _low = self._table[_index]
+        return _low + (self._table[_index + 1] - _low) * (_position - _index)
+
+
+def _ease_in_out(t: float) -> float:
+    return 4 * t ** 3 if t < 0.5 else 1 - (-2 * t + 2) ** 3 / 2
+
+
+def _exp_decay(t: float) -> float:
+    # Drops most of the way quickly, then tails off
+    return (1 - math.exp(-5 * t)) / (1 - math.exp(-5))
+
+
+BUILTIN_CURVES: dict[str, Callable[[float], float]] = {
+    'linear': lambda t: t,
+    'ease_in': lambda t: t * t,
+    'ease_out': lambda t: 1 - (1 - t) ** 2,
+    'ease_in_out': _ease_in_out,
+    'exp_decay': _exp_decay,
+}
+
+
+class CurveRegistry:
+    """
+    Named curves available to slides, i.e. the built-in ones plus any defined in the config file.
+    """
+    _curves: dict[str, Curve] = None
+
+    def __init__(self) -> None:
+        self._curves = {
+            _name: Curve.from_function(_name, _function) for _name, _function in BUILTIN_CURVES.items()
+        }
+
+    @classmethod
+    def from_config(cls, custom_curves: dict[str, list[float]]) -> CurveRegistry:
+        _registry = cls()
+        for _name, _points in custom_curves.items():
+            _registry.register(Curve.from_points(_name, _points))
+        return _registry
+
+    def register(self, curve: Curve) -> None:
+        self._curves[curve.name] = curve
+
+    def get(self, name: str) -> Curve:
+        try:
+            return self._curves[name]
+        except KeyError:
+            raise KeyError(f"No curve named '{name}', known curves are: {', '.join(self._curves)}")
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._curves
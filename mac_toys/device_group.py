@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Callable, Iterable
+
+from buttplug import Device
+
+from mac_toys.config import ConfigView
+from mac_toys.connection import DeviceConnection
+from mac_toys.device_worker import DeviceWorker
+from mac_toys.metrics import EventTrace
+from mac_toys.rate_control import AdaptiveRate
+from mac_toys.status import DeviceStatus
+
+
+class DeviceOutput(ABC):
+    """
+    Where a profile's intensity goes to reach its toys.
+    """
+    # Called with every trace posted, once it is known whether the intensity it went with reached a device
+    release: Callable[[EventTrace], None] = None
+
+    @property
+    @abstractmethod
+    def connected(self) -> bool:
+        pass
+
+    @abstractmethod
+    def sync(self) -> None:
+        """
+        Take the toys that are there now.
+        """
+        pass
+
+    @abstractmethod
+    def post(self, value: float, traces: Iterable[EventTrace] = ()) -> None:
+        """
+        Send the toys the latest intensity, along with the traces of the events behind it.
+        """
+        pass
+
+    @abstractmethod
+    async def check_connection(self) -> None:
+        pass
+
+    @abstractmethod
+    def status(self) -> tuple[DeviceStatus, ...]:
+        """
+        Called from the status display thread, so only reads and copies.
+        """
+        pass
+
+    @abstractmethod
+    async def stop(self) -> None:
+        pass
+
+
+class DeviceGroup(DeviceOutput):
+    """
+    A worker for each of a profile's toys, on the connection in this process.
+    """
+    config: ConfigView = None
+    connection: DeviceConnection = None
+    # Whether a device (by name) is one of this group's
+    owns: Callable[[str], bool] = None
+    # Cache the devices one layer up rather than having to reach into the client every time
+    devices: list[Device] = None
+    # The task sending each device (by index) its commands, and how many workers each trace posted is
+    # still with
+    workers: dict[int, DeviceWorker] = None
+    _holds: dict[EventTrace, int] = None
+    # Workers of devices that have gone, still stopping
+    _retiring: set[asyncio.Task] = None
+    # The connection generation the devices were taken from
+    _generation: int = None
+
+    def __init__(
+            self,
+            config: ConfigView,
+            connection: DeviceConnection,
+            release: Callable[[EventTrace], None],
+            owns: Callable[[str], bool] = None
+    ) -> None:
+        self.config = config
+        self.connection = connection
+        self.release = release
+        self.owns = owns if owns is not None else (lambda _: True)
+        self.devices = []
+        self.workers = {}
+        self._holds = {}
+        self._retiring = set()
+
+    @property
+    def connected(self) -> bool:
+        return self.connection.client.connected
+
+    def sync(self) -> None:
+        """
+        Take the group's toys from the connection's current devices, and give each one a worker to send it
+        commands. Workers of devices no longer there are stopped.
+        """
+        self._generation = self.connection.generation
+        self.devices = [x for x in self.connection.devices() if self.owns(x.name)]
+        _indexes = {x.index for x in self.devices}
+        for _index in [x for x in self.workers if x not in _indexes]:
+            _retiring = asyncio.create_task(self.workers.pop(_index).stop())
+            self._retiring.add(_retiring)
+            _retiring.add_done_callback(self._retiring.discard)
+        for _device in self.devices:
+            _worker = self.workers.get(_device.index)
+            if _worker is not None:
+                # Same device after a reconnect, keep what was learnt about its command rate
+                _worker.device = _device
+                continue
+            _worker = DeviceWorker(
+                _device,
+                AdaptiveRate(
+                    self.config.dispatch_initial_rate(),
+                    self.config.dispatch_min_rate(),
+                    self.config.dispatch_max_rate(),
+                    self.config.dispatch_command_timeout(),
+                ),
+                self.connection.dispatcher,
+                self._release,
+            )
+            _worker.start()
+            self.workers[_device.index] = _worker
+
+    def post(self, value: float, traces: Iterable[EventTrace] = ()) -> None:
+        _traces = list(traces)
+        _workers = list(self.workers.values())
+        for _trace in _traces:
+            if _workers:
+                self._holds[_trace] = len(_workers)
+            else:
+                self.release(_trace)
+        for _worker in _workers:
+            _worker.post(value, _traces)
+
+    def _release(self, trace: EventTrace) -> None:
+        # Released once every worker it was posted to is done with it
+        self._holds[trace] -= 1
+        if self._holds[trace] <= 0:
+            del self._holds[trace]
+            self.release(trace)
+
+    async def check_connection(self) -> None:
+        await self.connection.check_connection()
+        # Devices can also come and go while the connection stays up
+        if self._generation != self.connection.generation or self._indexes() != self.workers.keys():
+            self.sync()
+
+    def _indexes(self) -> set[int]:
+        """
+        :return: the indexes of the group's toys among the connection's current devices
+        """
+        return {x.index for x in self.connection.devices() if self.owns(x.name)}
+
+    def status(self) -> tuple[DeviceStatus, ...]:
+        return tuple(
+            DeviceStatus(x.device.name, x.sent, x.rate.rate, x.rate.srtt) for x in list(self.workers.values())
+        )
+
+    async def stop(self) -> None:
+        await asyncio.gather(*(x.stop() for x in self.workers.values()), *self._retiring)
+        self.workers = {}
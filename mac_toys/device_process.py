@@ -0,0 +1,428 @@
+from __future__ import annotations
+
+import asyncio
+import struct
+import time
+from functools import partial
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.synchronize import Event as ProcessEvent
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from buttplug import ButtplugError
+
+from mac_toys.config import Config, toy_filters
+from mac_toys.connection import DeviceConnection
+from mac_toys.device_group import DeviceGroup, DeviceOutput
+from mac_toys.helpers import prnt
+from mac_toys.metrics import EventTrace, Stage, StartupProfile
+from mac_toys.status import DeviceStatus
+
+
+class IntensityChannel:
+    """
+    A small block of shared memory the app writes each profile's intensity to (one slot per profile) for the
+    device process to read, and the device process writes back when each intensity was sent and acknowledged.
+
+    Each half has a single writer and is guarded by a sequence count (a seqlock): the writer makes the count
+    odd before writing and even again after, and a read only counts if it saw the same even count before and
+    after. A read that catches the writer mid-write is simply tried again later, so neither process ever
+    waits on the other.
+
+    Layout (little endian): the target count (u64), then each slot's target (f64). Then the acknowledgement
+    count (u64), then for each slot the target count it last acknowledged (u64), and the monotonic times (s)
+    it was sent (f64) and acknowledged (f64).
+    """
+    _COUNT = struct.Struct('<Q')
+    _TARGET = struct.Struct('<d')
+    _ACK = struct.Struct('<Qdd')
+
+    slots: int = None
+    memory: SharedMemory = None
+    _targets: struct.Struct = None
+    # Where the acknowledgement half starts
+    _acks_at: int = None
+
+    def __init__(self, slots: int, name: str = None) -> None:
+        """
+        :param name: of the block to attach to, or None to create one
+        """
+        self.slots = slots
+        self._targets = struct.Struct(f'<{slots}d')
+        self._acks_at = self._COUNT.size + self._targets.size
+        if name is None:
+            # Created zeroed, so every count starts even
+            self.memory = SharedMemory(create=True, size=self._acks_at + self._COUNT.size + self._ACK.size * slots)
+        else:
+            self.memory = SharedMemory(name=name)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def write_target(self, slot: int, value: float) -> int:
+        """
+        :return: the target count the value was written under
+        """
+        _buffer = self.memory.buf
+        _count = self._COUNT.unpack_from(_buffer, 0)[0]
+        self._COUNT.pack_into(_buffer, 0, _count + 1)
+        self._TARGET.pack_into(_buffer, self._COUNT.size + self._TARGET.size * slot, value)
+        self._COUNT.pack_into(_buffer, 0, _count + 2)
+        return _count + 2
+
+    def read_targets(self) -> Optional[tuple[int, tuple[float, ...]]]:
+        """
+        :return: the target count and every slot's target, or None if caught mid-write
+        """
+        _buffer = self.memory.buf
+        _before = self._COUNT.unpack_from(_buffer, 0)[0]
+        if _before % 2:
+            return None
+        _targets = self._targets.unpack_from(_buffer, self._COUNT.size)
+        if self._COUNT.unpack_from(_buffer, 0)[0] != _before:
+            return None
+        return _before, _targets
+
+    def write_ack(self, slot: int, count: int, sent_at: float, acknowledged_at: float) -> None:
+        _buffer = self.memory.buf
+        _count = self._COUNT.unpack_from(_buffer, self._acks_at)[0]
+        self._COUNT.pack_into(_buffer, self._acks_at, _count + 1)
+        self._ACK.pack_into(
+            _buffer, self._acks_at + self._COUNT.size + self._ACK.size * slot, count, sent_at, acknowledged_at
+        )
+        self._COUNT.pack_into(_buffer, self._acks_at, _count + 2)
+
+    def read_ack(self, slot: int) -> Optional[tuple[int, float, float]]:
+        """
+        :return: the target count the slot last had acknowledged and when it was sent and acknowledged, or
+            None if caught mid-write
+        """
+        _buffer = self.memory.buf
+        _before = self._COUNT.unpack_from(_buffer, self._acks_at)[0]
+        if _before % 2:
+            return None
+        _ack = self._ACK.unpack_from(_buffer, self._acks_at + self._COUNT.size + self._ACK.size * slot)
+        if self._COUNT.unpack_from(_buffer, self._acks_at)[0] != _before:
+            return None
+        return _ack
+
+    def close(self) -> None:
+        self.memory.close()
+
+    def unlink(self) -> None:
+        self.memory.unlink()
+
+
+class ChannelSlot(DeviceOutput):
+    """
+    A profile's toys, reached through its slot in the channel to the device process.
+    """
+    process: DeviceProcess = None
+    slot: int = None
+    # The profile's toys, as found by the device process
+    names: list[str] = None
+    # Traces handed over with the target count they went with, and how long they may wait (s) for it to be
+    # acknowledged before being written off
+    _handed: list[tuple[int, EventTrace]] = None
+    _trace_timeout: float = 5.0
+    # The last target written and its count, and the last target the device process acknowledged
+    _last: tuple[int, float] = None
+    _sent: Optional[float] = None
+    _acknowledged: int = 0
+
+    def __init__(
+            self,
+            process: DeviceProcess,
+            slot: int,
+            names: list[str],
+            release: Callable[[EventTrace], None]
+    ) -> None:
+        self.process = process
+        self.slot = slot
+        self.names = names
+        self.release = release
+        self._handed = []
+
+    @property
+    def connected(self) -> bool:
+        return self.process.alive
+
+    def sync(self) -> None:
+        # The device process finds the toys itself
+        pass
+
+    def post(self, value: float, traces: Iterable[EventTrace] = ()) -> None:
+        if not self.process.alive:
+            # Nothing will ever acknowledge them
+            self.process.lost()
+            for _trace in traces:
+                self.release(_trace)
+            return
+        _count = self.process.channel.write_target(self.slot, value)
+        self._last = (_count, value)
+        self._handed.extend((_count, x) for x in traces)
+        self.process.wake()
+        self._collect()
+
+    async def check_connection(self) -> None:
+        """
+        The device process looks after the connection, this only picks up what it has acknowledged.
+
+        :raises ConnectionError: once the device process has died, releasing every trace still handed over
+        """
+        if not self.process.alive:
+            self.process.lost()
+            for _, _trace in self._handed:
+                self.release(_trace)
+            self._handed = []
+            raise ConnectionError("the device process has stopped")
+        self._collect()
+
+    def _collect(self) -> None:
+        """
+        Release every trace handed over with a target the device process has since acknowledged, stamped
+        with when it was sent and acknowledged.
+        """
+        _ack = self.process.channel.read_ack(self.slot)
+        if _ack is None:
+            return
+        _count, _sent_at, _acknowledged_at = _ack
+        if _count > self._acknowledged:
+            self._acknowledged = _count
+            StartupProfile().mark("first_command", last=True, at=_acknowledged_at)
+            if self._last is not None and _count >= self._last[0]:
+                self._sent = self._last[1]
+
+        _now = time.monotonic()
+        _waiting = []
+        for _handed in self._handed:
+            _handed_count, _trace = _handed
+            if _handed_count <= self._acknowledged:
+                _trace.stamp(Stage.COMMAND, _sent_at)
+                _trace.stamp(Stage.ACK, _acknowledged_at)
+                self.release(_trace)
+            elif _now - _trace.at(Stage.RECEIVE) > self._trace_timeout:
+                self.release(_trace)
+            else:
+                _waiting.append(_handed)
+        self._handed = _waiting
+
+    def status(self) -> tuple[DeviceStatus, ...]:
+        return tuple(DeviceStatus(x, self._sent, None, None) for x in self.names)
+
+    async def stop(self) -> None:
+        self._collect()
+        for _, _trace in self._handed:
+            self.release(_trace)
+        self._handed = []
+
+
+class DeviceProcess:
+    """
+    Runs the connection to Intiface and every toy's dispatch in a process of its own, so that the timing of
+    commands to the toys doesn't suffer for the app's other threads holding the GIL (i.e. while a burst of
+    events starts a lot of slides at once). The app hands over each profile's intensity through an
+    IntensityChannel.
+    """
+    channel: IntensityChannel = None
+    process: BaseProcess = None
+    _stopping: ProcessEvent = None
+    # Set whenever a new target is written, so the device process needn't poll the channel for them
+    _written: ProcessEvent = None
+    # Whether the device process has been found dead, so it is only reported once
+    _lost: bool = False
+
+    def __init__(self, slots: int) -> None:
+        self.channel = IntensityChannel(slots)
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def wake(self) -> None:
+        """
+        Let the device process know there is a new target in the channel.
+        """
+        self._written.set()
+
+    def lost(self) -> None:
+        """
+        Report the device process having died, the first time it is found to have.
+        """
+        if not self._lost and self.process is not None:
+            self._lost = True
+            prnt(f"The device process has stopped (exit code {self.process.exitcode}), the toys won't be sent "
+                 f"anything more")
+
+    async def start(self, config: Config, ws_host: str, ws_port: int) -> list[list[str]]:
+        """
+        Start the device process, and wait for it to connect and find the toys.
+
+        :return: the names of each profile's toys
+        """
+        _context = get_context("spawn")
+        _receiving, _sending = _context.Pipe(duplex=False)
+        self._stopping = _context.Event()
+        self._written = _context.Event()
+        self.process = _context.Process(
+            target=run_device_process,
+            args=(
+                self.channel.name, self.channel.slots, str(config.CONFIG_PATH.resolve()), ws_host, ws_port,
+                _sending, self._stopping, self._written
+            ),
+            name="MAC Toys devices",
+            daemon=True,
+        )
+        self.process.start()
+        _sending.close()
+        try:
+            _names = await asyncio.to_thread(_receiving.recv)
+        except EOFError:
+            prnt("The device process stopped before finding any toys")
+            _names = [[] for _ in range(self.channel.slots)]
+        finally:
+            _receiving.close()
+        StartupProfile().mark("scan")
+        return _names
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        if self.process is not None:
+            self._stopping.set()
+            self._written.set()
+            await asyncio.to_thread(self.process.join, timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.channel.close()
+        self.channel.unlink()
+
+
+class _DeviceServer:
+    """
+    The device process' side of the channel: sends each profile's toys the intensity in its slot, and writes
+    back when each one was acknowledged.
+    """
+    channel: IntensityChannel = None
+    connection: DeviceConnection = None
+    groups: list[DeviceGroup] = None
+    # How often to check on the connection (s)
+    _connection_check_interval: float = 1.0
+    # How long to hold off before trying again after failing to reach Intiface, doubling per failure up to the
+    # cap (s), None while connected
+    _reconnect_cap: float = 30.0
+    _reconnect_delay: Optional[float] = None
+    # The target count each trace handed to a group stands for, and the last count acknowledged for each slot
+    _tokens: dict[EventTrace, int] = None
+    _acknowledged: list[int] = None
+
+    def __init__(self, channel: IntensityChannel, config: Config, connection: DeviceConnection) -> None:
+        self.channel = channel
+        self.connection = connection
+        _profiles = config.profiles()[:channel.slots]
+        self.groups = [
+            DeviceGroup(_profile, connection, partial(self._acknowledge, _slot), owns=_owns)
+            for _slot, (_profile, _owns) in enumerate(zip(_profiles, toy_filters(_profiles)))
+        ]
+        self._tokens = {}
+        self._acknowledged = [0] * channel.slots
+        for _group in self.groups:
+            _group.sync()
+
+    def _acknowledge(self, slot: int, trace: EventTrace) -> None:
+        _count = self._tokens.pop(trace)
+        # A slower device can finish with an older target after a newer one has been acknowledged
+        if trace.reached(Stage.ACK) and _count > self._acknowledged[slot]:
+            self._acknowledged[slot] = _count
+            self.channel.write_ack(slot, _count, trace.at(Stage.COMMAND), trace.at(Stage.ACK))
+
+    async def run(self, stopping: ProcessEvent, written: ProcessEvent) -> None:
+        """
+        :param written: set by the app whenever it writes a new target (and as it stops), slept on in between
+        """
+        _seen = 0
+        _next_check = time.monotonic() + self._connection_check_interval
+        while not stopping.is_set():
+            if time.monotonic() >= _next_check:
+                _next_check = time.monotonic() + await self._check_connection()
+
+            # Cleared before reading, so a target written during or after the read sets it again for the next
+            written.clear()
+            _read = self.channel.read_targets()
+            if _read is not None and _read[0] != _seen:
+                _seen, _targets = _read
+                for _group, _target in zip(self.groups, _targets):
+                    # A stand-in trace per target, for the group to say when it was sent and acknowledged
+                    _token = EventTrace()
+                    self._tokens[_token] = _seen
+                    _group.post(_target, [_token])
+            await asyncio.to_thread(written.wait, max(0.0, _next_check - time.monotonic()))
+
+    async def _check_connection(self) -> float:
+        """
+        Check on the connection, reconnecting if need be, and backing off the longer it stays down.
+
+        :return: how long until the next check (s)
+        """
+        try:
+            for _group in self.groups:
+                await _group.check_connection()
+        except (ButtplugError, OSError) as e:
+            if self._reconnect_delay is None:
+                prnt(f"Lost the connection to Intiface ({e}), retrying...")
+                self._reconnect_delay = self._connection_check_interval
+            else:
+                self._reconnect_delay = min(self._reconnect_cap, self._reconnect_delay * 2)
+            return self._reconnect_delay
+
+        if self._reconnect_delay is not None:
+            prnt("Reconnected to Intiface.")
+            self._reconnect_delay = None
+        return self._connection_check_interval
+
+    async def stop(self) -> None:
+        await asyncio.gather(*(x.stop() for x in self.groups))
+
+
+def run_device_process(
+        channel_name: str,
+        slots: int,
+        config_path: str,
+        ws_host: str,
+        ws_port: int,
+        report: Connection,
+        stopping: ProcessEvent,
+        written: ProcessEvent
+) -> None:
+    """
+    The device process: connects to Intiface, reports the toys found for each profile, then sends them the
+    intensities from the channel until told to stop.
+    """
+    asyncio.run(_serve(channel_name, slots, Path(config_path), ws_host, ws_port, report, stopping, written))
+
+
+async def _serve(
+        channel_name: str,
+        slots: int,
+        config_path: Path,
+        ws_host: str,
+        ws_port: int,
+        report: Connection,
+        stopping: ProcessEvent,
+        written: ProcessEvent
+) -> None:
+    _channel = IntensityChannel(slots, channel_name)
+    _config = Config(config_path)
+    _connection = DeviceConnection(_config, ws_host=ws_host, port=ws_port)
+    await _connection.connect_and_scan()
+    _server = _DeviceServer(_channel, _config, _connection)
+    report.send([[x.name for x in _group.devices] for _group in _server.groups])
+    report.close()
+    try:
+        await _server.run(stopping, written)
+    finally:
+        await _server.stop()
+        await _connection.disconnect()
+        _channel.close()
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Iterable, TYPE_CHECKING
+
+from mac_toys.helpers import prnt
+
+if TYPE_CHECKING:
+    from buttplug import Device
+
+
+class DeviceRegistry:
+    """
+    Remembers the devices seen in previous sessions, by name (the buttplug protocol doesn't give out
+    addresses), so the startup scan knows what it is waiting for and can stop as soon as it has them.
+
+    Stored as JSON, mapping each device name to when it was last seen, how many actuators it had, and how many
+    startup scans in a row it has been missing from.
+    """
+    path: Path = None
+    devices: dict[str, dict] = None
+    # How many startup scans in a row a device may be missing from before it is forgotten, so one that's gone
+    # for good doesn't hold up every scan after it
+    forget_after: int = 3
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.devices = {}
+        try:
+            with open(self.path, encoding="utf-8") as _file:
+                self.devices = dict(json.load(_file).get('devices', {}))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            prnt(f"Ignoring unreadable device registry {self.path}: {e}")
+
+    def known(self) -> set[str]:
+        return set(self.devices)
+
+    def missing(self, present: Iterable[str]) -> set[str]:
+        """
+        :return: the known devices that aren't among those present
+        """
+        return self.known() - set(present)
+
+    def remember(self, devices: Iterable[Device]) -> None:
+        _now = time.time()
+        for _device in devices:
+            self.devices[_device.name] = {'last_seen': _now, 'actuators': len(_device.actuators)}
+
+    def forget(self, name: str) -> None:
+        self.devices.pop(name, None)
+
+    def missed(self, present: Iterable[str]) -> list[str]:
+        """
+        Count a missed scan against every known device that isn't among those present, forgetting any that
+        have now missed forget_after in a row.
+
+        :return: the names of the devices forgotten
+        """
+        _forgotten = []
+        for _name in sorted(self.missing(present)):
+            _missed = self.devices[_name].get('missed', 0) + 1
+            if _missed >= self.forget_after:
+                self.forget(_name)
+                _forgotten.append(_name)
+            else:
+                self.devices[_name]['missed'] = _missed
+        return _forgotten
+
+    def save(self) -> None:
+        # Written aside and swapped in, so an interrupted save never leaves a half written file
+        _temporary = self.path.with_name(f"{self.path.name}.tmp")
+        try:
+            with open(_temporary, "w", encoding="utf-8") as _file:
+                json.dump({'devices': self.devices}, _file, indent=2)
+            os.replace(_temporary, self.path)
+        except OSError as e:
+            prnt(f"Could not save the device registry to {self.path}: {e}")
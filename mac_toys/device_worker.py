@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Callable, Iterable
+
+from buttplug import Device, DisconnectedError
+
+from mac_toys.dispatch import ActuatorDispatcher
+from mac_toys.helpers import prnt
+from mac_toys.metrics import EventTrace, Stage, StartupProfile
+from mac_toys.rate_control import AdaptiveRate
+
+
+class DeviceWorker:
+    """
+    Sends one device its commands from its own long-lived task, so a slow or stuck device only ever holds
+    itself up.
+
+    Intensities are posted to a single-slot mailbox. A new value overwrites one that hasn't been sent yet
+    rather than queueing behind it, so once the device is ready again it is always sent the latest value.
+    """
+    device: Device = None
+    rate: AdaptiveRate = None
+    dispatcher: ActuatorDispatcher = None
+    # Called with every trace posted, once this worker is done with it
+    release: Callable[[EventTrace], None] = None
+    # The last intensity the device acknowledged, None until it has acknowledged one
+    sent: float = None
+    # How many times in a row a value may fail to send before giving up on it until the next is posted
+    max_attempts: int = 3
+    # Whether the device has said it is disconnected, so it is only reported once
+    disconnected: bool = False
+    # The mailbox: the latest intensity, the traces of the events behind it, and whether it is unsent
+    _value: float = None
+    _traces: list[EventTrace] = None
+    _posted: asyncio.Event = None
+    _task: asyncio.Task = None
+    # Commands given up on but still waiting for their answer
+    _abandoned: set[asyncio.Future] = None
+
+    def __init__(
+            self,
+            device: Device,
+            rate: AdaptiveRate,
+            dispatcher: ActuatorDispatcher,
+            release: Callable[[EventTrace], None]
+    ) -> None:
+        self.device = device
+        self.rate = rate
+        self.dispatcher = dispatcher
+        self.release = release
+        self._traces = []
+        self._posted = asyncio.Event()
+        self._abandoned = set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run(), name=f"Dispatch to {self.device.name}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for _task in self._abandoned:
+            _task.cancel()
+        await asyncio.gather(*self._abandoned, return_exceptions=True)
+        for _trace in self._traces:
+            self.release(_trace)
+        self._traces = []
+
+    def post(self, value: float, traces: Iterable[EventTrace] = ()) -> None:
+        """
+        Leave the latest intensity for the device, replacing any that hasn't been sent yet.
+        """
+        self._value = value
+        self._traces.extend(traces)
+        self._posted.set()
+
+    async def run(self) -> None:
+        _attempts = 0
+        while True:
+            await self._posted.wait()
+            _wait = self.rate.ready_at() - time.monotonic()
+            if _wait > 0:
+                await asyncio.sleep(_wait)
+
+            # Only empty the mailbox once ready, so anything posted while waiting is what gets sent
+            self._posted.clear()
+            _value, _traces = self._value, self._traces
+            self._traces = []
+            try:
+                _sent = await self._send(_value, _traces)
+            except BaseException:
+                # Back in the mailbox, for stop() to release
+                self._traces[:0] = _traces
+                raise
+
+            _attempts += 1
+            if _sent or self._posted.is_set() or self.disconnected or _attempts >= self.max_attempts:
+                # Landed, or there's already something newer to send in its place, or there's nothing to gain
+                # from trying again (the group retires the worker if its device has gone)
+                for _trace in _traces:
+                    self.release(_trace)
+                _attempts = 0
+            else:
+                # Try again once the device is ready, the traces waiting on it until it lands
+                self._traces[:0] = _traces
+                self._posted.set()
+
+    async def _send(self, value: float, traces: list[EventTrace]) -> bool:
+        """
+        :return: False if the device needs sending the value again
+        """
+        _commands = self.dispatcher.commands_for([self.device], value)
+        if not _commands:
+            # Already at the nearest step the device has
+            self.sent = value
+            return True
+
+        for _trace in traces:
+            _trace.stamp(Stage.COMMAND)
+        if not await self._command(_commands):
+            return False
+        self.sent = value
+        StartupProfile().mark("first_command", last=True)
+        for _trace in traces:
+            _trace.stamp(Stage.ACK)
+        return True
+
+    async def _command(self, commands: list) -> bool:
+        """
+        Send the device its commands, timing out at what its round-trip times suggest, and feed back how
+        long it took.
+
+        :return: whether every command was answered
+        """
+        _old_rate = self.rate.rate
+        _started = time.monotonic()
+        self.rate.sent(_started)
+        _sending = asyncio.ensure_future(asyncio.gather(
+            *(r_act.command(_scalar) for _, r_act, _scalar in commands), return_exceptions=True
+        ))
+        try:
+            async with asyncio.timeout(self.rate.timeout):
+                # Shielded, as cancelling a command leaves the client choking on its answer if one turns up
+                _results = await asyncio.shield(_sending)
+        except TimeoutError:
+            self._abandoned.add(_sending)
+            _sending.add_done_callback(self._abandoned.discard)
+            self.rate.timed_out()
+            for _key, _, _ in commands:
+                self.dispatcher.forget(_key)
+            if self.rate.rate != _old_rate:
+                prnt(f"{self.device.name} timed out, slowing to {self.rate.rate:.1f} commands/s")
+            return False
+
+        _answered = True
+        _disconnected = False
+        # Anything that failed gets resent next time, even if the step hasn't changed
+        for (_key, _, _), _result in zip(commands, _results):
+            if isinstance(_result, BaseException):
+                _disconnected |= isinstance(_result, DisconnectedError)
+                self.dispatcher.forget(_key)
+                _answered = False
+
+        if not _answered:
+            # An error back (i.e. the device has gone) comes fast and says nothing about the link, so it counts
+            # as a timeout rather than as a round trip
+            self.rate.timed_out()
+            if _disconnected and not self.disconnected:
+                self.disconnected = True
+                prnt(f"{self.device.name} disconnected")
+        else:
+            self.disconnected = False
+            self.rate.answered(time.monotonic() - _started)
+        return _answered
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import time
+from typing import Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from buttplug import Device
+
+# Used for actuators that don't report how many discrete steps they have
+DEFAULT_STEP_COUNT: int = 100
+
+
+class ActuatorDispatcher:
+    """
+    Works out which actuators actually need a new command for a given intensity.
+
+    Each value is quantized to the step count the actuator reports, and a command is only produced when
+    that step differs from the last one sent to the actuator. An unchanged step can optionally be resent
+    every `keepalive` seconds.
+    """
+    # Last step sent per (device index, actuator index)
+    _last_steps: dict[tuple[int, int], int] = None
+    # monotonic time of the last command per (device index, actuator index)
+    _last_sent_at: dict[tuple[int, int], float] = None
+    # Seconds after which an unchanged step is sent again, 0 disables this
+    keepalive: float = None
+
+    def __init__(self, keepalive: float = 0.0) -> None:
+        self._last_steps = {}
+        self._last_sent_at = {}
+        self.keepalive = keepalive
+
+    @staticmethod
+    def step_count(actuator: Any) -> int:
+        _steps = getattr(actuator, 'step_count', None)
+        return _steps if _steps else DEFAULT_STEP_COUNT
+
+    @staticmethod
+    def quantize(value: float, step_count: int) -> int:
+        return round(min(1.0, max(0.0, value)) * step_count)
+
+    def commands_for(self, devices: list[Device], value: float) -> list[tuple[tuple[int, int], Any, float]]:
+        """
+        Get the actuators that need commanding to reach the given intensity, and mark them as sent.
+
+        :return: a list of (key, actuator, quantized scalar) to send
+        """
+        _now = time.monotonic()
+        _commands = []
+        for dev in devices:
+            for r_act in dev.actuators:
+                _key = (dev.index, r_act.index)
+                _steps = self.step_count(r_act)
+                _step = self.quantize(value, _steps)
+                if self._last_steps.get(_key) == _step:
+                    if self.keepalive <= 0 or _now - self._last_sent_at[_key] < self.keepalive:
+                        continue
+
+                self._last_steps[_key] = _step
+                self._last_sent_at[_key] = _now
+                _commands.append((_key, r_act, _step / _steps))
+
+        return _commands
+
+    def forget(self, key: tuple[int, int] = None) -> None:
+        """
+        Forget what was sent, so the next command goes out regardless of its value.
+
+        :param key: the (device index, actuator index) to forget, or None to forget every actuator
+        """
+        if key is None:
+            self._last_steps.clear()
+            self._last_sent_at.clear()
+        else:
+            self._last_steps.pop(key, None)
+            self._last_sent_at.pop(key, None)
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from enum import Enum, auto
+from typing import Generic, Optional, TypeVar
+
+from mac_toys.helpers import prnt
+
+T = TypeVar('T')
+
+
+class Overflow(Enum):
+    """
+    What a subscription does with a new event when its buffer is already full.
+    """
+    # Make room by throwing away the oldest event waiting, for subscribers that only care about what's recent
+    DROP_OLDEST = auto()
+    # Throw the new event away, for subscribers that would rather have a gap at the end than in the middle
+    DROP_NEWEST = auto()
+    # Give up on the subscriber entirely, for ones that are useless once they have missed anything
+    UNSUBSCRIBE = auto()
+
+
+class SubscriptionClosed(Exception):
+    """
+    The subscription was closed, or dropped by the bus for falling behind, and has no events left.
+    """
+
+
+class Subscription(Generic[T]):
+    """
+    One subscriber's buffer of events. Events are only ever added by the bus and taken by the subscriber, so
+    a subscriber can only fall behind on its own events and never hold anyone else up.
+    """
+    name: str = None
+    types: tuple[type[T], ...] = None
+    # None for no limit, for subscribers that must see every event
+    maxsize: Optional[int] = None
+    overflow: Overflow = None
+    # How many events this subscriber has lost to overflowing
+    dropped: int = None
+    closed: bool = False
+    _bus: EventBus = None
+    _buffer: deque[T] = None
+    _ready: asyncio.Event = None
+
+    def __init__(
+            self,
+            bus: EventBus,
+            name: str,
+            types: tuple[type[T], ...],
+            maxsize: Optional[int],
+            overflow: Overflow
+    ) -> None:
+        if maxsize is not None and maxsize < 1:
+            raise ValueError("A subscription needs room for at least one event.")
+        self._bus = bus
+        self.name = name
+        self.types = types
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self._buffer = deque()
+        self._ready = asyncio.Event()
+
+    def offer(self, event: T) -> None:
+        if self.maxsize is not None and len(self._buffer) >= self.maxsize:
+            self.dropped += 1
+            match self.overflow:
+                case Overflow.DROP_OLDEST:
+                    if self.dropped == 1:
+                        prnt(f"{self.name} is falling behind on events, dropping the oldest")
+                    self._buffer.popleft()
+                case Overflow.DROP_NEWEST:
+                    if self.dropped == 1:
+                        prnt(f"{self.name} is falling behind on events, dropping new ones")
+                    return
+                case Overflow.UNSUBSCRIBE:
+                    prnt(f"{self.name} fell behind on events, unsubscribing it")
+                    self.close()
+                    return
+        self._buffer.append(event)
+        self._ready.set()
+
+    def close(self) -> None:
+        """
+        Stop receiving events. Anything already buffered can still be taken.
+        """
+        if not self.closed:
+            self.closed = True
+            self._bus.unsubscribe(self)
+            self._ready.set()
+
+    def get_nowait(self) -> T | None:
+        """
+        :return: the oldest event waiting, or None if there isn't one
+        """
+        return self._buffer.popleft() if self._buffer else None
+
+    async def get(self) -> T:
+        """
+        :raises SubscriptionClosed: once closed with nothing left to take
+        """
+        while not self._buffer:
+            if self.closed:
+                raise SubscriptionClosed(self.name)
+            self._ready.clear()
+            await self._ready.wait()
+        return self._buffer.popleft()
+
+    def __aiter__(self) -> Subscription[T]:
+        return self
+
+    async def __anext__(self) -> T:
+        try:
+            return await self.get()
+        except SubscriptionClosed:
+            raise StopAsyncIteration
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+
+class EventBus:
+    """
+    Hands every event published to each subscriber of its type, through each subscriber's own buffer.
+    Publishing never waits on a subscriber: a full buffer is dealt with by that subscription's overflow policy,
+    and one without a limit just keeps growing until its subscriber catches up.
+
+    Lives on the event loop, so events must be published and taken from the loop's thread.
+    """
+    _subscriptions: list[Subscription] = None
+    # The subscriptions for each type of event seen, worked out once per type rather than per event
+    _routes: dict[type, tuple[Subscription, ...]] = None
+
+    def __init__(self) -> None:
+        self._subscriptions = []
+        self._routes = {}
+
+    def subscribe(
+            self,
+            *types: type[T],
+            name: str = "Subscriber",
+            maxsize: Optional[int] = 256,
+            overflow: Overflow = Overflow.DROP_OLDEST
+    ) -> Subscription[T]:
+        """
+        :param types: the event types wanted, including their subclasses
+        :param name: what to call the subscriber when telling the user it is falling behind
+        :param maxsize: how many events may wait before the overflow policy kicks in, or None for no limit
+        :return: the subscription to take the events from, receiving everything published from now on
+        """
+        _subscription = Subscription(self, name, types, maxsize, overflow)
+        self._subscriptions.append(_subscription)
+        self._routes = {}
+        return _subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+            self._routes = {}
+
+    def publish(self, event: object) -> None:
+        _type = type(event)
+        _route = self._routes.get(_type)
+        if _route is None:
+            _route = tuple(x for x in self._subscriptions if issubclass(_type, x.types))
+            self._routes[_type] = _route
+        for _subscription in _route:
+            _subscription.offer(event)
@@ -1,27 +1,29 @@
-from typing import Union, cast
+from asyncio import run
 from signal import signal, SIGINT
+from mac_toys.event_bus import Overflow
 from mac_toys.sse_listener import SSEListener, KillEvent, ChatEvent
 
 
 def abort(signum, frame):
     print("Received exit signal, ending...")
-    _inst = SSEListener(event_endpoint=None)
-    if _inst.t_subscriber is not None:
-        _inst.shutdown_flag = True
-        _inst.t_subscriber.join()
+    SSEListener(event_endpoint=None).stop()
     exit(0)
 
 
+async def listen() -> None:
+    instance = SSEListener.with_mac()
+    # Its own subscription, so this can run alongside anything else listening without taking their events
+    events = instance.start().subscribe(KillEvent, ChatEvent, name="Event printer", overflow=Overflow.DROP_NEWEST)
+    async for event in events:
+        if isinstance(event, ChatEvent):
+            print(f"Chat: {event}")
+        elif isinstance(event, KillEvent):
+            print(f"Kill: {event}")
+
+
 def main() -> None:
     print("INFO: Starting")
-    instance = SSEListener.with_mac()
-    while True:
-        if not instance.q_subscriber.empty():
-            event = cast(Union[KillEvent | ChatEvent], instance.q_subscriber.get())
-            if isinstance(event, ChatEvent):
-                print(f"Chat: {event}")
-            elif isinstance(event, KillEvent):
-                print(f"Kill: {event}")
+    run(listen())
 
 
 if __name__ == "__main__":
@@ -1,4 +1,9 @@
-from tqdm import tqdm
+from abc import ABCMeta
+from threading import Lock
+from typing import Callable, Optional
+
+# Where prnt sends its output instead of the terminal, while something (i.e. the status display) wants it
+_output: Optional[Callable[[str], None]] = None
 
 
 def interpolate_value_unbounded(
@@ -23,5 +28,34 @@ def interpolate_value_bounded(
     )))
 
 
+def redirect_output(output: Optional[Callable[[str], None]]) -> None:
+    """
+    Send everything printed with prnt to the given callable, or back to the terminal if None.
+    """
+    global _output
+    _output = output
+
+
 def prnt(message: str) -> None:
-    tqdm.write(message)
+    _sink = _output
+    if _sink is None:
+        print(message, flush=True)
+    else:
+        _sink(message)
+
+
+class Singleton(type):
+    _instances = {}
+    _lock = Lock()
+
+    def __call__(cls, *args, **kwargs):
+        with cls._lock:
+            if cls not in cls._instances:
+                cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+        return cls._instances[cls]
+
+
+class SingletonABCMeta(Singleton, ABCMeta):
+    """
+    For a singleton implementing an abstract base class.
+    """
@@ -1,8 +1,14 @@
 from __future__ import annotations
 
-import time
-from typing import Callable
-from threading import Thread, Lock, get_native_id
+import heapq
+from itertools import count
+from typing import Callable, Optional
+from threading import Thread, Lock, Condition, Event
+
+from mac_toys.clock import clock
+from mac_toys.curves import Curve
+from mac_toys.metrics import EventTrace, Stage
+from mac_toys.helpers import Singleton
 
 
 class ValueSlider:
@@ -15,13 +21,20 @@ class ValueSlider:
     slide_time: float = None
     # Function to call to apply the interim value to.
     applicator: Callable[[float], None] = None
-    _worker_thread: Thread = None
+    # Easing curve to follow, a straight line if not given
+    curve: Curve = None
+    # Trace of the event that caused this slide, if any, stamped when the slide starts
+    trace: EventTrace = None
     _cancel_flag: bool = None
     _running: bool = None
+    # Set once the slide has completed or been cancelled
+    _finished: Event = None
+    # The value the slide interpolates from, and the monotonic time (s) it started at
+    _origin_value: float = None
+    _started_at: float = None
 
-    # Make a modification every 50ms
+    # Make a modification every 5ms
     _application_rate: float = 5.0
-    _application_step: float = None
 
     # Tracking value lock to avoid race conditions (not overally necessary since other threads will be RO)
     _write_lock: Lock = None
@@ -31,7 +44,9 @@ class ValueSlider:
             current_value: float,
             target_value: float,
             slide_time: float,
-            value_applicator: Callable[[float], None]
+            value_applicator: Callable[[float], None],
+            curve: Curve = None,
+            trace: EventTrace = None
     ) -> None:
         self.starting_value = current_value
         self._current_value = self.starting_value
@@ -39,38 +54,41 @@ class ValueSlider:
         self._time_remaining = self.slide_time
         self.target_value = target_value
         self.applicator = value_applicator
+        self.curve = curve
+        self.trace = trace
         self.complete = False
-        self.cancel_flag = False
+        self._cancel_flag = False
         self._running = False
-        self._application_step = ((self.target_value - self.starting_value) / self.slide_time) * self._application_rate
+        self._finished = Event()
         self._write_lock = Lock()
 
-        self._worker_thread = Thread(
-            target=self.slide,
-            name=f"Threaded Value Interpolator {get_native_id()}",
-            daemon=True,
-        )
-
     def __str__(self) -> str:
         return (f"ValueSlider({self.starting_value:.2}->{self.target_value:.2}@{self.slide_time})"
                 f"::{self._current_value:.2}@{self._time_remaining:.2}")
 
     def cancel(self) -> None:
+        """
+        Stop the slide where it is. Never blocks, the scheduler drops the slide on its next pass.
+        """
         self._cancel_flag = True
-        if self._worker_thread.ident:
-            self._worker_thread.join()
         self._running = False
+        self._finished.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_flag
 
     @property
     def has_started(self) -> bool:
         return self._running
 
-    def join(self) -> None:
-        self._worker_thread.join()
+    def join(self, timeout: float = None) -> None:
+        if self._started_at is None:
+            return
+        self._finished.wait(timeout)
 
     def start(self) -> None:
-        self._worker_thread.start()
-        self._running = True
+        SlideScheduler().schedule(self)
 
     def matches_direction(self, other_slide: ValueSlider) -> bool:
         return self.slide_direction == other_slide.slide_direction
@@ -119,19 +137,146 @@ class ValueSlider:
 
             return self._current_value
 
-    def slide(self) -> None:
-        if self.target_value == self._current_value:
+    def begin(self, now: float) -> Optional[float]:
+        """
+        Mark the slide as started at the given monotonic time.
+
+        :return: The time the slide should next be advanced at, or None if there is nothing to slide.
+        """
+        self._started_at = now
+        self._origin_value = self._current_value
+        if self.trace is not None:
+            self.trace.stamp(Stage.SLIDER, now)
+        if self.target_value == self._current_value or self.slide_time <= 0:
+            self.complete = True
+            self._finished.set()
+            return None
+
+        self._running = True
+        return now + self._application_rate / 1000
+
+    def advance(self, now: float) -> Optional[float]:
+        """
+        Move the slide to where it should be at the given monotonic time, and apply the value.
+
+        :return: The time the slide should next be advanced at, or None if it is complete or cancelled.
+        """
+        if self._cancel_flag or self.complete:
+            return None
+
+        _elapsed = (now - self._started_at) * 1000
+        _progress = min(1.0, _elapsed / self.slide_time)
+        _eased = self.curve.sample(_progress) if self.curve is not None else _progress
+        with self._write_lock:
+            self._current_value = self._origin_value + (self.target_value - self._origin_value) * _eased
+            self._time_remaining = self.slide_time - _elapsed
+        self.applicator(self._current_value)
+
+        if _progress >= 1.0:
             self.complete = True
             self._running = False
+            self._finished.set()
+            return None
 
-        while not (self._cancel_flag or self.complete):
-            time.sleep(self._application_rate / 1000)
-            with self._write_lock:
-                self._current_value += self._application_step
-                self._time_remaining -= self._application_rate
-            self.applicator(self._current_value)
-
-            # Floating point 'close enough' check
-            if abs(self.target_value - self._current_value) < 0.001 or self._time_remaining < 0:
-                self.complete = True
-                self._running = False
+        return now + self._application_rate / 1000
+
+
+class SlideScheduler(metaclass=Singleton):
+    """
+    Advances every active ValueSlider from a single daemon thread.
+
+    Sliders are kept in a heap keyed by when they next need advancing, so the thread only ever sleeps until
+    the earliest one is due. Cancelling a slider just flags it, and it falls out of the heap when it comes
+    up, so nothing on the caller's side ever waits on the scheduler.
+
+    Time comes from the vibration controls' clock. A simulation sets `threaded` to False and calls advance
+    itself instead.
+    """
+    # Whether to start the thread advancing the sliders
+    threaded: bool = True
+    _heap: list[tuple[float, int, ValueSlider]] = None
+    _condition: Condition = None
+    _thread: Thread = None
+    # Tie-breaker so sliders with the same deadline never get compared
+    _sequence: count = None
+
+    def __init__(self) -> None:
+        self._heap = []
+        self._condition = Condition()
+        self._sequence = count()
+
+    def schedule(self, slider: ValueSlider) -> None:
+        _deadline = slider.begin(clock().now())
+        if _deadline is None:
+            return
+
+        with self._condition:
+            # Only wake the thread if this slider is now the earliest thing to do
+            _earliest = not self._heap or _deadline < self._heap[0][0]
+            heapq.heappush(self._heap, (_deadline, next(self._sequence), slider))
+            if self._thread is None and self.threaded:
+                self._thread = Thread(
+                    target=self.run,
+                    name="Value Slider Scheduler",
+                    daemon=True,
+                )
+                self._thread.start()
+            elif _earliest:
+                self._condition.notify()
+
+    @staticmethod
+    def cancel(slider: Optional[ValueSlider]) -> None:
+        if slider is not None and not slider.complete:
+            slider.cancel()
+
+    def replace(self, old: Optional[ValueSlider], new: ValueSlider) -> ValueSlider:
+        """
+        Cancel the old slider (if any, and if still running) and start the new one in its place.
+
+        :return: the new slider
+        """
+        self.cancel(old)
+        self.schedule(new)
+        return new
+
+    def next_due(self) -> Optional[float]:
+        """
+        :return: the time the next slider is due, or None if there are none
+        """
+        with self._condition:
+            return self._heap[0][0] if self._heap else None
+
+    def advance(self, now: float) -> Optional[float]:
+        """
+        Advance every slider that is due at the given monotonic time.
+
+        :return: The time the next slider is due, or None if there are no sliders left.
+        """
+        with self._condition:
+            _due = []
+            while self._heap and self._heap[0][0] <= now:
+                _due.append(heapq.heappop(self._heap)[2])
+
+        _rescheduled = []
+        for _slider in _due:
+            _next = _slider.advance(now)
+            if _next is not None:
+                _rescheduled.append((_next, next(self._sequence), _slider))
+
+        with self._condition:
+            for _entry in _rescheduled:
+                heapq.heappush(self._heap, _entry)
+            return self._heap[0][0] if self._heap else None
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                _wait = self._heap[0][0] - clock().now()
+                if _wait > 0:
+                    # Woken early if a sooner slider is scheduled
+                    self._condition.wait(_wait)
+                    continue
+
+            self.advance(clock().now())
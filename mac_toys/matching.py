@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import re
+from typing import Optional
+
+
+class TriggerMatcher:
+    """
+    Matches a message against a whole list of trigger phrases in a single pass.
+
+    The triggers are compiled once into one alternation regex (longest first, so the most specific trigger
+    wins where several start at the same place), and the matcher reports which trigger fired.
+    """
+    triggers: tuple[str, ...] = None
+    word_boundary: bool = None
+    case_fold: bool = None
+    _pattern: Optional[re.Pattern] = None
+    # Maps the (possibly case-folded) matched text back to the trigger as written in the config
+    _originals: dict[str, str] = None
+
+    def __init__(self, triggers: list[str], *, word_boundary: bool = False, case_fold: bool = True) -> None:
+        self.triggers = tuple(triggers)
+        self.word_boundary = word_boundary
+        self.case_fold = case_fold
+        self._originals = {}
+        for trigger in self.triggers:
+            self._originals.setdefault(self._fold(trigger), trigger)
+
+        _keys = sorted((x for x in self._originals if x), key=len, reverse=True)
+        if not _keys:
+            self._pattern = None
+            return
+
+        _alternation = "|".join(re.escape(x) for x in _keys)
+        if self.word_boundary:
+            # Lookarounds rather than \b, so triggers that start or end in punctuation (like *pets you*)
+            # still only match as whole words
+            _alternation = rf"(?<!\w)(?:{_alternation})(?!\w)"
+        self._pattern = re.compile(_alternation)
+
+    def _fold(self, text: str) -> str:
+        return text.casefold() if self.case_fold else text
+
+    def find(self, message: str) -> Optional[str]:
+        """
+        :return: The first trigger found in the message, or None if there are none
+        """
+        if self._pattern is None:
+            return None
+
+        _match = self._pattern.search(self._fold(message))
+        return self._originals[_match.group(0)] if _match else None
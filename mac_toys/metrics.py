@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import math
+import time
+from array import array
+from enum import IntEnum
+from threading import Lock
+from typing import Optional
+
+from mac_toys.helpers import Singleton, prnt
+
+
+class Stage(IntEnum):
+    """
+    The stages an event passes through, in order, from arriving on the SSE stream to a device acting on it.
+    """
+    RECEIVE = 0
+    PARSE = 1
+    DEQUEUE = 2
+    TRACKER = 3
+    SLIDER = 4
+    COMMAND = 5
+    ACK = 6
+
+
+class EventTrace:
+    """
+    The monotonic times (s) an event reached each stage. Events are frozen, but the trace they carry isn't,
+    so later stages can stamp it as the event goes by.
+    """
+    __slots__ = ('_stamps',)
+
+    def __init__(self) -> None:
+        self._stamps = array('d', [math.nan] * len(Stage))
+
+    def stamp(self, stage: Stage, now: float = None) -> None:
+        # Only the first time counts, later updates from the same event go unrecorded
+        if math.isnan(self._stamps[stage]):
+            self._stamps[stage] = time.monotonic() if now is None else now
+
+    def reached(self, stage: Stage) -> bool:
+        return not math.isnan(self._stamps[stage])
+
+    def at(self, stage: Stage) -> Optional[float]:
+        _stamp = self._stamps[stage]
+        return None if math.isnan(_stamp) else _stamp
+
+
+class LatencyHistogram:
+    """
+    A fixed-size histogram of durations with logarithmic buckets, from 1 µs up to about 2 minutes, each
+    about 9% wider than the last. Recording is O(1) and the memory used never grows.
+    """
+    # Bucket i holds durations up to _LOWEST * _GROWTH ** i (s)
+    _LOWEST: float = 1e-6
+    _GROWTH: float = 2 ** 0.125
+    _BUCKETS: int = 216
+
+    counts: array = None
+    count: int = None
+    total: float = None
+    minimum: float = None
+    maximum: float = None
+
+    def __init__(self) -> None:
+        self.counts = array('L', [0] * self._BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+
+    def record(self, duration: float) -> None:
+        duration = max(0.0, duration)
+        if duration <= self._LOWEST:
+            _bucket = 0
+        else:
+            _bucket = min(self._BUCKETS - 1, math.ceil(math.log(duration / self._LOWEST, self._GROWTH)))
+        self.counts[_bucket] += 1
+        self.count += 1
+        self.total += duration
+        self.minimum = min(self.minimum, duration)
+        self.maximum = max(self.maximum, duration)
+
+    def percentile(self, fraction: float) -> float:
+        """
+        :return: the duration (s) that the given fraction of recordings were at or under, to within a bucket
+        """
+        if self.count == 0:
+            return math.nan
+        _rank = max(1, math.ceil(fraction * self.count))
+        _seen = 0
+        for _bucket, _count in enumerate(self.counts):
+            _seen += _count
+            if _seen >= _rank:
+                _upper = self._LOWEST * self._GROWTH ** _bucket
+                return min(max(_upper, self.minimum), self.maximum)
+        return self.maximum
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else math.nan
+
+
+class PipelineMetrics(metaclass=Singleton):
+    """
+    Latency histograms for each stage of the event pipeline, each measuring the time since the stage before,
+    plus one for the whole trip. Traces are recorded from several threads, so everything goes through a lock.
+    """
+    stages: dict[Stage, LatencyHistogram] = None
+    end_to_end: LatencyHistogram = None
+    # Events that never made it to a device (i.e. nothing to act on, or the intensity didn't change)
+    unfinished: int = None
+    _write_lock: Lock = None
+
+    def __init__(self) -> None:
+        self.stages = {x: LatencyHistogram() for x in Stage if x is not Stage.RECEIVE}
+        self.end_to_end = LatencyHistogram()
+        self.unfinished = 0
+        self._write_lock = Lock()
+
+    def complete(self, trace: EventTrace) -> None:
+        """
+        Record a finished trace. Each stage reached is measured from the last stage reached before it.
+        """
+        with self._write_lock:
+            _previous = trace.at(Stage.RECEIVE)
+            if _previous is None:
+                return
+            for _stage, _histogram in self.stages.items():
+                _at = trace.at(_stage)
+                if _at is not None:
+                    _histogram.record(_at - _previous)
+                    _previous = _at
+
+            if trace.reached(Stage.ACK):
+                self.end_to_end.record(_previous - trace.at(Stage.RECEIVE))
+            else:
+                self.unfinished += 1
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        """
+        :return: count, p50, p99, max and mean (ms) of every stage, by stage name
+        """
+        with self._write_lock:
+            _histograms = {x.name.lower(): y for x, y in self.stages.items()}
+            _histograms['end_to_end'] = self.end_to_end
+            return {
+                _name: {
+                    'count': _histogram.count,
+                    'p50': _histogram.percentile(0.50) * 1000,
+                    'p99': _histogram.percentile(0.99) * 1000,
+                    'max': _histogram.maximum * 1000,
+                    'mean': _histogram.mean() * 1000,
+                }
+                for _name, _histogram in _histograms.items()
+            }
+
+    def summary(self) -> str:
+        _lines = [f"{'Stage':<12}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'mean ms':>10}"]
+        for _name, _stats in self.snapshot().items():
+            if _stats['count'] == 0:
+                _lines.append(f"{_name:<12}{0:>8}")
+                continue
+            _lines.append(
+                f"{_name:<12}{_stats['count']:>8}{_stats['p50']:>10.2f}{_stats['p99']:>10.2f}"
+                f"{_stats['max']:>10.2f}{_stats['mean']:>10.2f}"
+            )
+        _lines.append(f"{self.unfinished} events never reached a device")
+        return "\n".join(_lines)
+
+
+class StartupProfile(metaclass=Singleton):
+    """
+    Times the milestones of starting up, to show where the time goes between launching and the first
+    vibration. Does nothing unless enabled, so the milestones can be marked unconditionally.
+    """
+    enabled: bool = False
+    # Milestones in the order they were reached, with the monotonic time (s) they were reached at
+    milestones: dict[str, float] = None
+    _started_at: float = None
+    _write_lock: Lock = None
+
+    def __init__(self) -> None:
+        self.milestones = {}
+        self._started_at = time.monotonic()
+        self._write_lock = Lock()
+
+    def start(self, started_at: float = None) -> None:
+        """
+        Enable profiling, timing from the given monotonic time or from now.
+        """
+        self.enabled = True
+        self._started_at = time.monotonic() if started_at is None else started_at
+
+    def mark(self, milestone: str, *, last: bool = False, at: float = None) -> None:
+        """
+        Note a milestone being reached, if it hasn't been already.
+
+        :param last: the end of startup, print the breakdown
+        :param at: the monotonic time (s) it was reached, if not now
+        """
+        if not self.enabled:
+            return
+        with self._write_lock:
+            if milestone in self.milestones:
+                return
+            self.milestones[milestone] = time.monotonic() if at is None else at
+        if last:
+            prnt(self.summary())
+
+    def summary(self) -> str:
+        _lines = [f"{'Startup phase':<20}{'took ms':>10}{'at ms':>10}"]
+        _previous = self._started_at
+        for _milestone, _at in self.milestones.items():
+            _lines.append(
+                f"{_milestone:<20}{(_at - _previous) * 1000:>10.1f}{(_at - self._started_at) * 1000:>10.1f}"
+            )
+            _previous = _at
+        return "\n".join(_lines)
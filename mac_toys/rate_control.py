@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import time
+
+
+class AdaptiveRate:
+    """
+    Decides how often one device may be sent commands, from how quickly it answers them.
+
+    Round-trip times are smoothed the way TCP does it, and give both the command timeout and a sense of
+    whether the device is keeping up. The rate follows AIMD: it creeps up by `increase` Hz for every command
+    answered well within the current interval, and is cut by `decrease` on a timeout or a reply slower than
+    the interval, so a slow device settles just under what it can take without a backlog building up.
+    """
+    # Commands per second allowed, kept between the bounds
+    rate: float = None
+    min_rate: float = None
+    max_rate: float = None
+    increase: float = 1.0
+    decrease: float = 0.5
+    # Smoothed round-trip time and its variation (s), None until the first reply
+    srtt: float = None
+    rttvar: float = None
+    # Bounds on the command timeout (s)
+    min_timeout: float = 0.1
+    max_timeout: float = None
+    # monotonic time the device may next be sent a command
+    _next_at: float = None
+
+    def __init__(self, initial_rate: float, min_rate: float, max_rate: float, max_timeout: float = 0.5) -> None:
+        if not 0 < min_rate <= max_rate:
+            raise ValueError("The command rate bounds must be positive, with the minimum no more than the maximum.")
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max_rate, max(min_rate, initial_rate))
+        self.max_timeout = max_timeout
+        self._next_at = 0.0
+
+    @property
+    def interval(self) -> float:
+        return 1 / self.rate
+
+    @property
+    def timeout(self) -> float:
+        """
+        How long to wait for a reply before giving up on a command (s).
+        """
+        if self.srtt is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, self.srtt + 4 * self.rttvar))
+
+    def ready_at(self) -> float:
+        """
+        :return: the monotonic time the device may next be sent a command
+        """
+        return self._next_at
+
+    def sent(self, now: float = None) -> None:
+        """
+        Mark a command as sent, so the next one waits out the interval.
+        """
+        _now = time.monotonic() if now is None else now
+        self._next_at = _now + self.interval
+
+    def answered(self, rtt: float) -> None:
+        """
+        Feed back the round-trip time of a command that was answered.
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+        if rtt > self.interval:
+            self._set_rate(self.rate * self.decrease)
+        elif rtt < self.interval / 2:
+            self._set_rate(self.rate + self.increase)
+
+    def timed_out(self) -> None:
+        """
+        Feed back a command that was never answered.
+        """
+        # Assume the link is at least as slow as the timeout, so the next timeout doesn't come too soon
+        self.srtt = max(self.srtt or 0.0, self.timeout)
+        self.rttvar = self.rttvar or self.srtt / 2
+        self._set_rate(self.rate * self.decrease)
+
+    def _set_rate(self, rate: float) -> None:
+        self.rate = min(self.max_rate, max(self.min_rate, rate))
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from pathlib import Path
+from typing import AsyncIterator, TextIO
+
+from mac_toys.sse_listener import SSEMessage
+
+# Starts every recording session. A file can hold several sessions, each one's times start again from 0.
+RECORDING_HEADER: str = "# mac-toys event recording v1"
+
+
+class EventRecorder:
+    """
+    Appends every raw message from the MAC event stream to a file, one per line, as:
+
+        <microseconds since recording started>\\t<event name>\\t<data>
+
+    Times come from the monotonic clock. Data spanning several lines (which the MAC backend doesn't send)
+    is joined with spaces.
+    """
+    path: Path = None
+    _file: TextIO = None
+    _started_at: int = None
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = open(self.path, "a", encoding="utf-8", newline="\n", buffering=1)
+        self._file.write(f"{RECORDING_HEADER}\n")
+        self._started_at = time.monotonic_ns()
+
+    def record(self, message: SSEMessage) -> None:
+        _elapsed = (time.monotonic_ns() - self._started_at) // 1000
+        _data = message.data.replace("\n", " ")
+        self._file.write(f"{_elapsed}\t{message.event}\t{_data}\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def read_recording(path: Path) -> list[tuple[float, SSEMessage]]:
+    """
+    Read a recording made by EventRecorder.
+
+    :return: every message with its receive time in seconds. Sessions are laid end to end, so times only
+             ever go forwards.
+    """
+    _messages = []
+    _session_offset = 0.0
+    _last = 0.0
+    with open(path, encoding="utf-8") as _file:
+        for _line in _file:
+            _line = _line.rstrip("\n")
+            if not _line:
+                continue
+            if _line.startswith("#"):
+                _session_offset = _last
+                continue
+
+            _elapsed, _event, _data = _line.split("\t", 2)
+            _last = _session_offset + int(_elapsed) / 1_000_000
+            _messages.append((_last, SSEMessage(_data, _event)))
+    return _messages
+
+
+class ReplaySource:
+    """
+    Plays a recording back with its original timing, scaled by `speed` (i.e. 4.0 replays at 4x). A speed of
+    0 replays as fast as possible.
+    """
+    path: Path = None
+    speed: float = None
+
+    def __init__(self, path: Path, speed: float = 1.0) -> None:
+        if speed < 0:
+            raise ValueError("Replay speed can't be negative.")
+        self.path = path
+        self.speed = speed
+
+    async def messages(self) -> AsyncIterator[SSEMessage]:
+        _loop = asyncio.get_running_loop()
+        _started_at = _loop.time()
+        for _elapsed, _message in read_recording(self.path):
+            if self.speed > 0:
+                _delay = _started_at + _elapsed / self.speed - _loop.time()
+                if _delay > 0:
+                    await asyncio.sleep(_delay)
+            else:
+                # Still give everything else a chance to run between messages
+                await asyncio.sleep(0)
+            yield _message
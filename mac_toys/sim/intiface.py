@@ -0,0 +1,314 @@
+"""
+A stand-in for Intiface Central, serving virtual devices over the buttplug protocol v3.
+
+Each virtual device sits behind a simulated Bluetooth link with its own latency, jitter, drop rate and command
+rate ceiling. Commands to a device queue up behind each other like writes to a BLE characteristic, so a
+client sending faster than the ceiling sees its replies back up. Run it on its own with:
+
+    python -m mac_toys.sim.intiface --port 12345 --devices 2 --latency 40 --jitter 15 --max-rate 10
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import time
+from argparse import ArgumentParser, Namespace
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, TextIO
+
+import websockets
+
+# Error codes from the buttplug spec
+ERROR_MESSAGE: int = 3
+ERROR_DEVICE: int = 4
+
+
+@dataclass
+class VirtualDevice:
+    name: str = "Virtual Vibrator"
+    actuators: int = 1
+    step_count: int = 20
+    # Time for a command to go over the link and be acknowledged, plus up to this much either way at random (ms)
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # Fraction of commands lost on the link, which are never acknowledged
+    drop_rate: float = 0.0
+    # Most commands the link carries per second, anything faster waits its turn. 0 is no limit.
+    max_rate: float = 0.0
+    # If set, the device isn't connected to start with, and turns up this long after a scan starts (ms)
+    scan_delay_ms: float = None
+
+    def device_messages(self) -> dict[str, Any]:
+        return {
+            'ScalarCmd': [
+                {'FeatureDescriptor': f"Motor {i}", 'StepCount': self.step_count, 'ActuatorType': 'Vibrate'}
+                for i in range(self.actuators)
+            ],
+            'StopDeviceCmd': {},
+        }
+
+
+@dataclass(slots=True)
+class CommandRecord:
+    # monotonic time the command arrived at the server
+    received_at: float
+    device_index: int
+    actuator_index: int
+    scalar: float
+    # monotonic time the device acted on it, None if it was dropped
+    applied_at: float = None
+
+    @property
+    def dropped(self) -> bool:
+        return self.applied_at is None
+
+
+class _Link:
+    """
+    The simulated link to one device. Commands go over it one at a time, no faster than the rate ceiling.
+    """
+    device: VirtualDevice = None
+    _rng: random.Random = None
+    _lock: asyncio.Lock = None
+    # monotonic time the link can next start sending
+    _free_at: float = None
+
+    def __init__(self, device: VirtualDevice, rng: random.Random) -> None:
+        self.device = device
+        self._rng = rng
+        self._lock = asyncio.Lock()
+        self._free_at = 0.0
+
+    async def send(self) -> bool:
+        """
+        Carry one command to the device.
+
+        :return: whether it got there
+        """
+        async with self._lock:
+            _wait = self._free_at - time.monotonic()
+            if _wait > 0:
+                await asyncio.sleep(_wait)
+            if self.device.max_rate > 0:
+                self._free_at = time.monotonic() + 1 / self.device.max_rate
+
+            _latency = self.device.latency_ms + self._rng.uniform(-self.device.jitter_ms, self.device.jitter_ms)
+            if _latency > 0:
+                await asyncio.sleep(_latency / 1000)
+            return self._rng.random() >= self.device.drop_rate
+
+
+class FakeIntifaceServer:
+    """
+    A buttplug protocol v3 websocket server exposing virtual devices in place of Intiface Central.
+    Every device command it receives is recorded with the monotonic times it arrived and was applied, and
+    optionally written to a log file as it is applied.
+    """
+    devices: list[VirtualDevice] = None
+    host: str = None
+    port: int = None
+    commands: list[CommandRecord] = None
+    # Indexes of the devices connected so far
+    connected: set[int] = None
+    _links: list[_Link] = None
+    _log: TextIO = None
+    _server: Any = None
+
+    def __init__(
+            self,
+            devices: list[VirtualDevice] = None,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            seed: int = None,
+            log_path: Path = None
+    ) -> None:
+        self.devices = devices if devices is not None else [VirtualDevice()]
+        self.host = host
+        self.port = port
+        self.commands = []
+        self.connected = {i for i, x in enumerate(self.devices) if x.scan_delay_ms is None}
+        _rng = random.Random(seed)
+        self._links = [_Link(x, _rng) for x in self.devices]
+        if log_path is not None:
+            self._log = open(log_path, "a", encoding="utf-8", newline="\n", buffering=1)
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        self._server = await websockets.serve(self._handle, self.host, self.port)
+        self.port = next(iter(self._server.sockets)).getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+        if self._log is not None:
+            self._log.close()
+
+    def _device_info(self, index: int) -> dict[str, Any]:
+        return {
+            'DeviceName': self.devices[index].name,
+            'DeviceIndex': index,
+            'DeviceMessages': self.devices[index].device_messages(),
+        }
+
+    async def _handle(self, connection) -> None:
+        # Each message is answered on its own, so a slow device doesn't hold up the rest of the connection
+        _pending: set[asyncio.Task] = set()
+        try:
+            async for _raw in connection:
+                for _message in json.loads(_raw):
+                    for _type, _body in _message.items():
+                        _tasks = [asyncio.create_task(self._answer(connection, _type, _body))]
+                        if _type == 'StartScanning':
+                            _tasks.extend(
+                                asyncio.create_task(self._turn_up(connection, i))
+                                for i in range(len(self.devices)) if i not in self.connected
+                            )
+                        for _task in _tasks:
+                            _pending.add(_task)
+                            _task.add_done_callback(_pending.discard)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for _task in _pending:
+                _task.cancel()
+
+    async def _answer(self, connection, message_type: str, body: dict) -> None:
+        _replies = await self._reply(message_type, body)
+        try:
+            for _reply in _replies:
+                await connection.send(json.dumps([_reply]))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _turn_up(self, connection, index: int) -> None:
+        await asyncio.sleep(self.devices[index].scan_delay_ms / 1000)
+        if index in self.connected:
+            return
+        self.connected.add(index)
+        try:
+            await connection.send(json.dumps([{'DeviceAdded': {'Id': 0, **self._device_info(index)}}]))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _reply(self, message_type: str, body: dict) -> list[dict]:
+        _id = body.get('Id', 0)
+        match message_type:
+            case 'RequestServerInfo':
+                return [{'ServerInfo': {
+                    'Id': _id, 'ServerName': "mac-toys fake Intiface", 'MessageVersion': 3, 'MaxPingTime': 0,
+                }}]
+            case 'RequestDeviceList':
+                return [{'DeviceList': {
+                    'Id': _id, 'Devices': [self._device_info(i) for i in sorted(self.connected)],
+                }}]
+            case 'ScalarCmd' | 'StopDeviceCmd':
+                _index = body['DeviceIndex']
+                if _index not in self.connected:
+                    return [self._error(_id, f"No device at index {_index}", ERROR_DEVICE)]
+                if message_type == 'ScalarCmd':
+                    _scalars = [(x['Index'], x['Scalar']) for x in body['Scalars']]
+                else:
+                    _scalars = [(i, 0.0) for i in range(self.devices[_index].actuators)]
+                if not await self._command(_index, _scalars):
+                    # Lost on the way, the client only finds out by timing out
+                    return []
+                return [{'Ok': {'Id': _id}}]
+            case 'StopAllDevices':
+                await asyncio.gather(*(
+                    self._command(i, [(j, 0.0) for j in range(self.devices[i].actuators)]) for i in self.connected
+                ))
+                return [{'Ok': {'Id': _id}}]
+            case 'StopScanning':
+                # Nothing new turns up, so the scan is over straight away
+                return [{'Ok': {'Id': _id}}, {'ScanningFinished': {'Id': 0}}]
+            case 'StartScanning' | 'Ping':
+                return [{'Ok': {'Id': _id}}]
+            case _:
+                return [self._error(_id, f"Unsupported message: {message_type}", ERROR_MESSAGE)]
+
+    async def _command(self, device_index: int, scalars: list[tuple[int, float]]) -> bool:
+        """
+        Send a command over a device's link, recording what it did to each actuator.
+
+        :return: whether the command got to the device
+        """
+        _records = [CommandRecord(time.monotonic(), device_index, i, x) for i, x in scalars]
+        self.commands.extend(_records)
+        if not await self._links[device_index].send():
+            return False
+
+        _applied_at = time.monotonic()
+        for _record in _records:
+            _record.applied_at = _applied_at
+            if self._log is not None:
+                self._log.write(
+                    f"{_record.received_at:.6f}\t{_applied_at:.6f}\t"
+                    f"{device_index}\t{_record.actuator_index}\t{_record.scalar}\n"
+                )
+        return True
+
+    @staticmethod
+    def _error(message_id: int, message: str, code: int) -> dict:
+        return {'Error': {'Id': message_id, 'ErrorMessage': message, 'ErrorCode': code}}
+
+
+def parse_args(argv: list[str] = None) -> Namespace:
+    _parser = ArgumentParser(description="Serve virtual buttplug devices in place of Intiface Central")
+    _parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    _parser.add_argument("--port", type=int, default=12345, help="port to listen on (default: 12345)")
+    _parser.add_argument("--devices", type=int, default=1, help="number of virtual devices (default: 1)")
+    _parser.add_argument("--actuators", type=int, default=1, help="vibrators per device (default: 1)")
+    _parser.add_argument("--step-count", type=int, default=20, help="steps per vibrator (default: 20)")
+    _parser.add_argument("--latency", type=float, default=0.0, help="link latency per command in ms (default: 0)")
+    _parser.add_argument("--jitter", type=float, default=0.0, help="random latency either way in ms (default: 0)")
+    _parser.add_argument(
+        "--drop-rate", type=float, default=0.0, help="fraction of commands lost, between 0 and 1 (default: 0)"
+    )
+    _parser.add_argument(
+        "--max-rate", type=float, default=0.0, help="most commands per second per device, 0 is no limit (default: 0)"
+    )
+    _parser.add_argument(
+        "--scan-delay", type=float, metavar="MS",
+        help="start with no devices connected, and have them turn up this long after a scan starts"
+    )
+    _parser.add_argument("--seed", type=int, help="seed for the latency and drop randomness")
+    _parser.add_argument(
+        "--log", type=Path, metavar="FILE",
+        help="append every applied command to this file as: received, applied, device, actuator, scalar"
+    )
+    return _parser.parse_args(argv)
+
+
+async def serve(args: Namespace) -> None:
+    _devices = [
+        VirtualDevice(
+            f"Virtual Vibrator {i}", args.actuators, args.step_count,
+            args.latency, args.jitter, args.drop_rate, args.max_rate, args.scan_delay
+        )
+        for i in range(args.devices)
+    ]
+    _server = FakeIntifaceServer(_devices, args.host, args.port, args.seed, args.log)
+    await _server.start()
+    print(f"Serving {len(_devices)} virtual devices on {_server.url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await _server.stop()
+        _dropped = sum(x.dropped for x in _server.commands)
+        print(f"Received {len(_server.commands)} actuator commands, {_dropped} dropped")
+
+
+def run(argv: list[str] = None) -> None:
+    try:
+        asyncio.run(serve(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from asyncio import StreamReader, StreamWriter, Server
+
+
+def kill_event(
+        killer: tuple[str, str],
+        victim: tuple[str, str],
+        weapon: str = "scattergun",
+        crit: bool = False
+) -> dict:
+    return {
+        'type': 'PlayerKill',
+        'event': {
+            'killer_name': killer[0],
+            'killer_steamid': killer[1],
+            'victim_name': victim[0],
+            'victim_steamid': victim[1],
+            'weapon': weapon,
+            'crit': crit,
+        }
+    }
+
+
+def chat_event(author: tuple[str, str], message: str) -> dict:
+    return {
+        'type': 'ChatMessage',
+        'event': {
+            'player_name': author[0],
+            'steamid': author[1],
+            'message': message,
+        }
+    }
+
+
+class FakeMACServer:
+    """
+    Serves an SSE event stream shaped like the MAC client-backend's, carrying whatever events it is given.
+    Every event sent is recorded with the monotonic time it was written to the clients.
+    """
+    host: str = None
+    port: int = None
+    endpoint: str = "/mac/game/events/v1"
+    # (monotonic send time, payload) of every event sent
+    sent: list[tuple[float, str]] = None
+    _server: Server = None
+    _clients: list[StreamWriter] = None
+    _client_connected: asyncio.Event = None
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.host = host
+        self.port = port
+        self.sent = []
+        self._clients = []
+        self._client_connected = asyncio.Event()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}{self.endpoint}"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        for _writer in self._clients:
+            _writer.close()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def wait_for_client(self, timeout: float = 10.0) -> None:
+        async with asyncio.timeout(timeout):
+            await self._client_connected.wait()
+
+    async def _handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        # Don't care what was asked for, there's only the one stream
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        await writer.drain()
+        self._clients.append(writer)
+        self._client_connected.set()
+
+    def send(self, event: dict | str) -> float:
+        """
+        Send an event to every connected client.
+
+        :return: the monotonic time it was sent at
+        """
+        _payload = event if isinstance(event, str) else json.dumps(event, separators=(",", ":"))
+        _frame = f"data: {_payload}\n\n".encode()
+        for _writer in self._clients:
+            if not _writer.is_closing():
+                _writer.write(_frame)
+        _sent_at = time.monotonic()
+        self.sent.append((_sent_at, _payload))
+        return _sent_at
@@ -0,0 +1,196 @@
+"""
+Plays a recording of MAC events through every profile's vibration controls on a virtual clock, skipping
+straight from one thing due to the next instead of waiting for it. The result is the intensity each profile
+would have sent its toys, to the millisecond and the same every run for the same seed, so a whole match can
+be checked in seconds. Run it with:
+
+    python -m mac_toys.sim.timeline match.rec --seed 1 --output timeline.csv
+
+The timeline is written as: time since the recording started (s), profile, intensity. Only changes are
+written. It stops short of the toys themselves, so each toy's rate limiting isn't included.
+"""
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from random import Random
+from typing import Callable, Iterable, cast
+
+from mac_toys.clock import Clock, VirtualClock, clock, rng, use
+from mac_toys.config import Config
+from mac_toys.device_group import DeviceOutput
+from mac_toys.helpers import prnt, redirect_output
+from mac_toys.interpolation import SlideScheduler
+from mac_toys.metrics import EventTrace
+from mac_toys.recording import read_recording
+from mac_toys.sse_listener import SSEMessage, process_event
+from mac_toys.status import DeviceStatus
+from mac_toys.tracker import PlayerTracker
+from mac_toys.vibration.ambience import AmbienceController
+from mac_toys.vibration.intensity import IntensityController
+from mac_toys.vibrator import Vibrator, handle_event
+
+
+class TimelineOutput(DeviceOutput):
+    """
+    Stands in for a profile's toys, noting down every intensity sent to them and when.
+    """
+    clock: Clock = None
+    # (time, intensity) of every intensity sent
+    points: list[tuple[float, float]] = None
+
+    def __init__(self, clock: Clock, release: Callable[[EventTrace], None]) -> None:
+        self.clock = clock
+        self.release = release
+        self.points = []
+
+    @property
+    def connected(self) -> bool:
+        return True
+
+    def sync(self) -> None:
+        pass
+
+    def post(self, value: float, traces: Iterable[EventTrace] = ()) -> None:
+        self.points.append((self.clock.now(), value))
+        for _trace in traces:
+            self.release(_trace)
+
+    async def check_connection(self) -> None:
+        pass
+
+    def status(self) -> tuple[DeviceStatus, ...]:
+        return ()
+
+    async def stop(self) -> None:
+        pass
+
+
+async def simulate(
+        config: Config,
+        messages: list[tuple[float, SSEMessage]],
+        *,
+        seed: int = 0,
+        settle: float = 5.0
+) -> list[list[tuple[float, float]]]:
+    """
+    Run the messages through the vibration controls of every profile in the config, on a virtual clock.
+
+    Whatever is due next goes first: the next message, slide step, ambient change or controller tick. At the
+    same moment they go in that order, as near as can be to how they interleave when run for real.
+
+    :param messages: with their receive time (s), as read from a recording
+    :param seed: for the ambience's randomness
+    :param settle: how long to keep going after the last message (s)
+    :return: the intensities each profile sent, as (time, intensity)
+    """
+    _clock = VirtualClock()
+    _previous_clock, _previous_rng = clock(), rng()
+    _scheduler = SlideScheduler()
+    _threaded = _scheduler.threaded
+    use(_clock, Random(seed))
+    _scheduler.threaded = False
+    try:
+        _profiles = config.profiles()
+        _outputs = [TimelineOutput(_clock, lambda _: None) for _ in _profiles]
+        _players = [
+            (
+                Vibrator(_profile, _output, name=_profile.name() if len(_profiles) > 1 else None),
+                PlayerTracker(_profile.config()['in_game_name'], _profile.config()['steamid_64'], _profile)
+            )
+            for _profile, _output in zip(_profiles, _outputs)
+        ]
+        _intensities = [cast(IntensityController, x.agent.get_agent('INTCON')) for x, _ in _players]
+        _ambiences = [cast(AmbienceController, x.agent.get_agent('AMBINTCON')) for x, _ in _players]
+        _next_tick = [0.0] * len(_players)
+        _until = (messages[-1][0] if messages else 0.0) + settle
+        _next_message = 0
+
+        try:
+            while True:
+                _due = [min(_next_tick), *(x.next_due(_clock.now()) for x in _ambiences)]
+                if _next_message < len(messages):
+                    _due.append(messages[_next_message][0])
+                _slider_due = _scheduler.next_due()
+                if _slider_due is not None:
+                    _due.append(_slider_due)
+                _now = min(_due)
+                if _now > _until:
+                    break
+                _clock.advance_to(_now)
+
+                while _next_message < len(messages) and messages[_next_message][0] <= _now:
+                    _message = messages[_next_message][1]
+                    _next_message += 1
+                    try:
+                        _event = process_event(_message)
+                    except (ValueError, KeyError, TypeError) as e:
+                        prnt(f"Ignoring malformed MAC event: {e}")
+                        continue
+                    for _vibe, _player_tracker in _players:
+                        handle_event(_event, _vibe, _player_tracker, _vibe.config)
+
+                if _slider_due is not None and _slider_due <= _now:
+                    _scheduler.advance(_now)
+
+                for _ambience in _ambiences:
+                    _ambience.step(_now)
+
+                for _index, (_vibe, _) in enumerate(_players):
+                    if _next_tick[_index] <= _now:
+                        _sent = _vibe.current_vibration
+                        _intensities[_index].tick()
+                        if _vibe.current_vibration != _sent:
+                            await _vibe.issue_command()
+                        _next_tick[_index] += _intensities[_index].interval
+        finally:
+            for _intensity in _intensities:
+                SlideScheduler.cancel(_intensity.ambient_intensity_slider)
+                _intensity.mixer.clear()
+    finally:
+        use(_previous_clock, _previous_rng)
+        _scheduler.threaded = _threaded
+
+    return [x.points for x in _outputs]
+
+
+def parse_args(argv: list[str] = None) -> Namespace:
+    _parser = ArgumentParser(description="Work out the intensities a recording of MAC events sets off, fast")
+    _parser.add_argument("recording", type=Path, help="a recording made with --record")
+    _parser.add_argument("--config", type=Path, default=Path("config.toml"), help="(default: config.toml)")
+    _parser.add_argument("--seed", type=int, default=0, help="seed for the ambience's randomness (default: 0)")
+    _parser.add_argument(
+        "--settle", type=float, default=5.0, help="seconds to keep going after the last event (default: 5)"
+    )
+    _parser.add_argument("--output", type=Path, help="write the timeline here rather than to stdout")
+    return _parser.parse_args(argv)
+
+
+def run(args: Namespace) -> None:
+    # Keep stdout for the timeline
+    redirect_output(lambda x: print(x, file=sys.stderr))
+    _config = Config(args.config)
+    _messages = read_recording(args.recording)
+    _started = time.perf_counter()
+    _timelines = asyncio.run(simulate(_config, _messages, seed=args.seed, settle=args.settle))
+    _wall = time.perf_counter() - _started
+
+    _names = [x.name() for x in _config.profiles()]
+    _points = sorted(
+        (_at, _profile, _intensity) for _profile, _timeline in enumerate(_timelines) for _at, _intensity in _timeline
+    )
+    _lines = [f"{_at:.3f},{_names[_profile]},{_intensity:.4f}\n" for _at, _profile, _intensity in _points]
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8", newline="\n") as _file:
+            _file.writelines(_lines)
+    else:
+        sys.stdout.writelines(_lines)
+    _simulated = (_messages[-1][0] if _messages else 0.0) + args.settle
+    prnt(f"Simulated {_simulated:.1f}s of play in {_wall:.2f}s")
+
+
+if __name__ == "__main__":
+    run(parse_args())
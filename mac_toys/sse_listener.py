@@ -1,74 +1,168 @@
 from __future__ import annotations
 
-import time
-from json import loads
-from dataclasses import dataclass
-from threading import Thread, Lock
-from queue import Queue
-from requests import RequestException, ConnectionError
-from urllib3.exceptions import ReadTimeoutError
-from requests_sse import EventSource, InvalidStatusCodeError, InvalidContentTypeError, MessageEvent
+import asyncio
+import re
+from asyncio import StreamReader, StreamWriter, Task
+from dataclasses import dataclass, field
+from random import uniform
+from typing import AsyncIterator, Optional, TYPE_CHECKING
+from urllib.parse import urlsplit
 
+from mac_toys.event_bus import EventBus
+from mac_toys.helpers import prnt, Singleton
+from mac_toys.metrics import EventTrace, Stage, StartupProfile
 
-class Singleton(type):
-    _instances = {}
-    _lock = Lock()
+if TYPE_CHECKING:
+    from mac_toys.recording import EventRecorder, ReplaySource
 
-    def __call__(cls, *args, **kwargs):
-        with cls._lock:
-            if cls not in cls._instances:
-                cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
+try:
+    # Optional, but a lot quicker at decoding than the standard library
+    from orjson import loads
+except ImportError:
+    from json import loads
 
+# Splits a byte stream into SSE lines, which may end in CRLF, LF or a lone CR
+_LINE_ENDING = re.compile(rb'\r\n|\r|\n')
+# Picks the event type out of a raw payload, provided it is the first key (as the MAC backend sends it)
+_LEADING_TYPE = re.compile(r'\{\s*"type"\s*:\s*"([^"\\]*)"')
 
-@dataclass
+# The MAC event types we act on, anything else is dropped without being decoded
+HANDLED_EVENT_TYPES: frozenset[str] = frozenset({'ChatMessage', 'PlayerKill', 'Map'})
+
+
+def _steamid(value: str | int | None) -> str | None:
+    # SteamIDs are compared as strings, however they were sent
+    return str(value) if value is not None else None
+
+
+@dataclass(frozen=True, slots=True)
 class KillEvent:
     killer: tuple[str, str] = None
     victim: tuple[str, str] = None
     weapon: str = None
     crit: bool = None
+    trace: EventTrace = field(default=None, compare=False, repr=False)
 
     @classmethod
-    def from_sse(cls, sse_json: dict) -> KillEvent:
+    def from_sse(cls, sse_json: dict, trace: EventTrace = None) -> KillEvent:
         _event: dict = sse_json['event']
-        _killer = (_event.get('killer_name'), _event.get('killer_steamid'))
-        _victim = (_event.get('victim_name'), _event.get('victim_steamid'))
+        _killer = (_event.get('killer_name'), _steamid(_event.get('killer_steamid')))
+        _victim = (_event.get('victim_name'), _steamid(_event.get('victim_steamid')))
         _weapon = _event.get('weapon')
         _crit = _event.get('crit')
-        return cls(_killer, _victim, _weapon, _crit)
+        return cls(_killer, _victim, _weapon, _crit, trace)
+
+    def describe(self) -> str:
+        return f"{self.killer[0]} killed {self.victim[0]} with {self.weapon}{' (crit)' if self.crit else ''}"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ChatEvent:
     author: tuple[str, str] = None
     message: str = None
+    trace: EventTrace = field(default=None, compare=False, repr=False)
 
     @classmethod
-    def from_sse(cls, sse_json: dict) -> ChatEvent:
+    def from_sse(cls, sse_json: dict, trace: EventTrace = None) -> ChatEvent:
         _event: dict = sse_json['event']
-        _author = (_event.get('player_name'), _event.get('steamid'))
+        _author = (_event.get('player_name'), _steamid(_event.get('steamid')))
         _message = _event.get('message')
-        return cls(_author, _message)
+        return cls(_author, _message, trace)
+
+    def describe(self) -> str:
+        return f"{self.author[0]}: {self.message}"
+
+
+@dataclass(frozen=True, slots=True)
+class MapChangeEvent:
+    map_name: str = None
+    trace: EventTrace = field(default=None, compare=False, repr=False)
+
+    @classmethod
+    def from_sse(cls, sse_json: dict, trace: EventTrace = None) -> MapChangeEvent:
+        # Either just the map name, or an object holding it
+        _event = sse_json['event']
+        if isinstance(_event, dict):
+            _event = _event.get('map') or _event.get('name')
+        return cls(str(_event), trace)
+
+    def describe(self) -> str:
+        return f"Map changed to {self.map_name}"
 
 
-def process_event(sse_event_message: MessageEvent) -> ChatEvent | KillEvent | None:
+@dataclass(slots=True)
+class SSEMessage:
+    data: str = None
+    event: str = "message"
+    id: str = None
+
+
+class SSEError(Exception):
+    """
+    The MAC event stream responded with something that isn't an event stream.
+    """
+
+
+def peek_event_type(payload: str) -> str | None:
+    """
+    Get the event type from a raw payload without decoding it.
+
+    :return: the type, or None if it can't be found cheaply (i.e. the payload needs decoding to know)
+    """
+    _match = _LEADING_TYPE.match(payload)
+    return _match.group(1) if _match else None
+
+
+def process_event(
+        sse_event_message: SSEMessage,
+        trace: EventTrace = None
+) -> ChatEvent | KillEvent | MapChangeEvent | None:
+    """
+    :param trace: carried by the event for latency tracking, stamped once the event is parsed
+    """
+    _type = peek_event_type(sse_event_message.data)
+    if _type is not None and _type not in HANDLED_EVENT_TYPES:
+        return None
+
     sse_event = loads(sse_event_message.data)
     match sse_event['type']:
         case 'ChatMessage':
-            return ChatEvent.from_sse(sse_event)
+            _event = ChatEvent.from_sse(sse_event, trace)
         case 'PlayerKill':
-            return KillEvent.from_sse(sse_event)
+            _event = KillEvent.from_sse(sse_event, trace)
+        case 'Map':
+            _event = MapChangeEvent.from_sse(sse_event, trace)
         case _:
             return None
+    if trace is not None:
+        trace.stamp(Stage.PARSE)
+    return _event
 
 
 class SSEListener(metaclass=Singleton):
     event_endpoint: str = None
-    q_subscriber: Queue = None
-    t_subscriber: Thread = None
+    # Every event parsed is published here, for whoever subscribes to it
+    bus: EventBus = None
+    t_subscriber: Task = None
 
     shutdown_flag: bool = False
 
+    # The last event id the server gave us, sent back as Last-Event-ID when reconnecting
+    last_event_id: Optional[str] = None
+    # Reconnect backoff in seconds, doubling per failed attempt up to the cap (the server may set the base)
+    reconnect_base: float = 0.5
+    reconnect_cap: float = 15.0
+    # The least the server may set the base to, so a 'retry: 0' can't have us hammering it
+    reconnect_floor: float = 0.1
+    # Seconds to wait for a connection to open and the response headers to arrive, and for any data at all
+    # on an open stream before assuming it has stalled and reconnecting
+    connect_timeout: float = 5.0
+    idle_timeout: float = 30.0
+    # Tees every raw message to a file when set
+    recorder: EventRecorder = None
+    # Takes messages from a recording instead of the MAC backend when set
+    replay: ReplaySource = None
+
     @classmethod
     def with_mac(
             cls,
@@ -82,35 +176,199 @@ class SSEListener(metaclass=Singleton):
     def __init__(self, event_endpoint: str | None) -> None:
         if self.event_endpoint is None:
             self.event_endpoint = event_endpoint
-        if self.q_subscriber is None:
-            self.q_subscriber = Queue()
+        if self.bus is None:
+            self.bus = EventBus()
+
+    def start(self) -> EventBus:
+        """
+        Start listening on the running event loop.
+
+        :return: The bus events will be published to, subscribe before the loop next gets a chance to run so
+            as not to miss any
+        """
+        if self.t_subscriber is None:
+            self.shutdown_flag = False
+            _source = self.replay_subscribe() if self.replay is not None else self.mac_subscribe()
+            self.t_subscriber = asyncio.create_task(_source, name="mac-sse-listener")
+        return self.bus
+
+    def stop(self) -> None:
+        self.shutdown_flag = True
+        if self.t_subscriber is not None:
+            self.t_subscriber.cancel()
 
+    async def wait_stopped(self, timeout: float = 2.0) -> None:
         if self.t_subscriber is None:
-            _thread = Thread(
-                target=self.mac_subscribe,
-                name="mac-sse-listener-thread",
-                daemon=True
-            )
-
-            self.t_subscriber = _thread
-            self.t_subscriber.start()
-
-    def mac_subscribe(self):
-        # TODO: implement onError
-        print(f"Starting MAC SSE Subscriber, -> {self.event_endpoint}")
-        with EventSource(self.event_endpoint) as event_source:
+            return
+        await asyncio.wait([self.t_subscriber], timeout=timeout)
+        self.t_subscriber = None
+
+    def publish(self, event: ChatEvent | KillEvent | MapChangeEvent) -> None:
+        self.bus.publish(event)
+
+    def handle_message(self, message: SSEMessage) -> None:
+        _trace = EventTrace()
+        _trace.stamp(Stage.RECEIVE)
+        if self.recorder is not None:
+            self.recorder.record(message)
+
+        try:
+            _event = process_event(message, _trace)
+        except (ValueError, KeyError, TypeError) as e:
+            prnt(f"Ignoring malformed MAC event: {e}")
+            return
+        if _event is not None:
+            self.publish(_event)
+
+    def _backoff(self, attempt: int) -> float:
+        # 'Full jitter', so a backend restart doesn't get every client reconnecting in lockstep
+        return uniform(0, min(self.reconnect_cap, self.reconnect_base * 2 ** attempt))
+
+    async def mac_subscribe(self) -> None:
+        prnt(f"Starting MAC SSE Subscriber, -> {self.event_endpoint}")
+        _attempt = 0
+        while not self.shutdown_flag:
+            try:
+                async for event in self._stream():
+                    # Only reset the backoff once the stream is actually delivering
+                    _attempt = 0
+                    self.handle_message(event)
+                prnt("MAC event stream closed, reconnecting...")
+            except asyncio.CancelledError:
+                break
+            except TimeoutError:
+                prnt("MAC event stream stalled, reconnecting...")
+            except (OSError, SSEError, asyncio.IncompleteReadError, ValueError) as e:
+                if _attempt == 0:
+                    prnt(f"Lost the MAC event stream ({e}), reconnecting...")
+
             try:
-                if self.shutdown_flag:
-                    raise GeneratorExit
-                for event in event_source:
-                    # print("++ New event")
-                    _event = process_event(event)
-                    self.q_subscriber.put(_event)
-            except (InvalidStatusCodeError, InvalidContentTypeError):
-                # Ignore these errors for now
-                print("Invalid status code or content type, ignoring message.")
-            except RequestException:
-                # Ignore this one too, but im inclined to always ignore it, unlike the above
-                print("Some sort of request exception!")
-
-        print("Exiting MAC SSE subscriber")
+                await asyncio.sleep(self._backoff(_attempt))
+            except asyncio.CancelledError:
+                break
+            _attempt += 1
+
+        prnt("Exiting MAC SSE subscriber")
+        if self.recorder is not None:
+            self.recorder.close()
+
+    async def replay_subscribe(self) -> None:
+        _speed = f"{self.replay.speed}x" if self.replay.speed > 0 else "full speed"
+        prnt(f"Replaying MAC events from {self.replay.path} at {_speed}")
+        StartupProfile().mark("sse_connect")
+        try:
+            async for event in self.replay.messages():
+                self.handle_message(event)
+        except asyncio.CancelledError:
+            pass
+        else:
+            prnt("Replay finished.")
+        if self.recorder is not None:
+            self.recorder.close()
+
+    async def _connect(self) -> tuple[StreamReader, StreamWriter]:
+        _url = urlsplit(self.event_endpoint)
+        _tls = _url.scheme == "https"
+        _port = _url.port or (443 if _tls else 80)
+        _path = _url.path or "/"
+        if _url.query:
+            _path += f"?{_url.query}"
+
+        async with asyncio.timeout(self.connect_timeout):
+            reader, writer = await asyncio.open_connection(_url.hostname, _port, ssl=_tls or None)
+
+        _headers = [
+            f"GET {_path} HTTP/1.1",
+            f"Host: {_url.netloc}",
+            "Accept: text/event-stream",
+            "Cache-Control: no-cache",
+        ]
+        if self.last_event_id is not None:
+            _headers.append(f"Last-Event-ID: {self.last_event_id}")
+        writer.write(("\r\n".join(_headers) + "\r\n\r\n").encode())
+        await writer.drain()
+        return reader, writer
+
+    @staticmethod
+    async def _read_headers(reader: StreamReader) -> dict[str, str]:
+        _status = (await reader.readline()).decode("latin-1").split(maxsplit=2)
+        if len(_status) < 2 or _status[1] != "200":
+            raise SSEError(f"Unexpected response status: {' '.join(_status).strip()}")
+
+        _headers = {}
+        while (_line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            _name, _, _value = _line.decode("latin-1").partition(":")
+            _headers[_name.strip().lower()] = _value.strip()
+
+        if not _headers.get("content-type", "").startswith("text/event-stream"):
+            raise SSEError(f"Unexpected content type: {_headers.get('content-type')}")
+        return _headers
+
+    async def _body(self, reader: StreamReader, headers: dict[str, str]) -> AsyncIterator[bytes]:
+        """
+        Yields the response body as it arrives, undoing chunked transfer encoding if the server used it.
+        Raises TimeoutError if nothing arrives for idle_timeout seconds.
+        """
+        _chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+        while True:
+            async with asyncio.timeout(self.idle_timeout):
+                if _chunked:
+                    _size = int((await reader.readline()).split(b";")[0], 16)
+                    if _size == 0:
+                        return
+                    _data = await reader.readexactly(_size)
+                    await reader.readexactly(2)
+                else:
+                    _data = await reader.read(65536)
+                    if not _data:
+                        return
+            yield _data
+
+    async def _stream(self) -> AsyncIterator[SSEMessage]:
+        """
+        Open the event stream and yield each message as it completes, parsed per the SSE spec.
+        """
+        reader, writer = await self._connect()
+        try:
+            async with asyncio.timeout(self.connect_timeout):
+                _headers = await self._read_headers(reader)
+            prnt("Connected to the MAC event stream.")
+            StartupProfile().mark("sse_connect")
+
+            _buffer = b""
+            _data: list[str] = []
+            _event_type = ""
+            async for _chunk in self._body(reader, _headers):
+                _buffer += _chunk
+                # A trailing CR may have its LF still to come, so hold it back with the incomplete last line
+                _pending_cr = _buffer.endswith(b"\r")
+                _lines = _LINE_ENDING.split(_buffer[:-1] if _pending_cr else _buffer)
+                _buffer = _lines.pop() + (b"\r" if _pending_cr else b"")
+                for _raw in _lines:
+                    if not _raw:
+                        if _data:
+                            yield SSEMessage("\n".join(_data), _event_type or "message", self.last_event_id)
+                        _data = []
+                        _event_type = ""
+                        continue
+
+                    _line = _raw.decode("utf-8", errors="replace")
+                    if _line.startswith(":"):
+                        continue
+                    _field, _, _value = _line.partition(":")
+                    if _value.startswith(" "):
+                        _value = _value[1:]
+
+                    match _field:
+                        case "data":
+                            _data.append(_value)
+                        case "event":
+                            _event_type = _value
+                        case "id":
+                            if "\0" not in _value:
+                                self.last_event_id = _value
+                        case "retry":
+                            if _value.isdigit():
+                                self.reconnect_base = max(self.reconnect_floor, int(_value) / 1000)
+        finally:
+            writer.close()
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from threading import Thread, Event
+from typing import Callable, Optional, Protocol, Sequence
+
+from rich.console import Console, Group, RenderableType
+from rich.live import Live
+from rich.panel import Panel
+from rich.progress_bar import ProgressBar
+from rich.table import Table
+from rich.text import Text
+
+from mac_toys.config import Config
+from mac_toys.event_bus import Subscription
+from mac_toys.helpers import prnt, redirect_output
+
+
+class Describable(Protocol):
+    def describe(self) -> str: ...
+
+
+@dataclass(frozen=True, slots=True)
+class DeviceStatus:
+    name: str
+    # The last intensity the device acknowledged, None until it has acknowledged one
+    intensity: Optional[float]
+    # Commands per second it is allowed and its smoothed round-trip time (s), None where not known
+    rate: Optional[float]
+    rtt: Optional[float]
+
+
+@dataclass(frozen=True, slots=True)
+class StatusSnapshot:
+    """
+    Everything the status display shows of one player profile, copied out at one moment so drawing it never
+    touches live state.
+    """
+    # The profile's name, None when it is the only one
+    name: Optional[str]
+    intensity: float
+    ambient: float
+    instant: float
+    kill_streak: int
+    death_streak: int
+    current_map: Optional[str]
+    devices: tuple[DeviceStatus, ...]
+
+
+class StatusDisplay:
+    """
+    Draws the current intensities, streaks and recent events in the terminal, from its own thread and at
+    no more than the configured frame rate. Drawing is the only terminal output while it runs: anything
+    printed with prnt is kept for the next frame instead, so a slow terminal only ever holds up the display
+    and never the commands to the devices.
+    """
+    config: Config = None
+    # Called once a frame for what to draw, a snapshot for each player profile
+    snapshot: Callable[[], Sequence[StatusSnapshot]] = None
+    # The most recent lines of output, shown beneath the status
+    lines: deque[str] = None
+    _stopping: Event = None
+    _thread: Thread = None
+    _following: asyncio.Task = None
+    # The last failure to draw a frame, so each is only shown once rather than every frame
+    _last_error: Optional[str] = None
+
+    def __init__(self, config: Config, snapshot: Callable[[], Sequence[StatusSnapshot]]) -> None:
+        self.config = config
+        self.snapshot = snapshot
+        self.lines = deque(maxlen=100)
+        self._stopping = Event()
+
+    def start(self) -> None:
+        redirect_output(self._keep)
+        self._thread = Thread(target=self._run, name="Status display", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Draw the last frame and hand the terminal back to prnt.
+        """
+        self._stopping.set()
+        if self._following is not None:
+            self._following.cancel()
+            self._following = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        redirect_output(None)
+
+    def follow(self, events: Subscription[Describable]) -> None:
+        """
+        Show the events from a subscription among the recent output, from a task on the running loop.
+        """
+        self._following = asyncio.create_task(self._follow(events), name="Status display events")
+
+    async def _follow(self, events: Subscription[Describable]) -> None:
+        async for _event in events:
+            self._keep(_event.describe())
+
+    def _keep(self, message: str) -> None:
+        self.lines.extend(message.splitlines() or [""])
+
+    def _run(self) -> None:
+        try:
+            with Live(
+                    Group(),
+                    console=Console(),
+                    auto_refresh=False,
+                    redirect_stdout=False,
+                    redirect_stderr=False
+            ) as _live:
+                self._draw(_live)
+                while not self._stopping.wait(1 / max(1.0, self.config.display_fps())):
+                    self._draw(_live)
+                self._draw(_live)
+        except Exception as e:
+            # The terminal itself is gone, carry on without the display
+            redirect_output(None)
+            prnt(f"The status display stopped: {e!r}")
+        finally:
+            redirect_output(None)
+
+    def _draw(self, live: Live) -> None:
+        try:
+            live.update(self._frame(), refresh=True)
+        except Exception as e:
+            # Keep trying, one bad frame shouldn't take the display down with it
+            _error = f"Couldn't draw the status: {e!r}"
+            if _error != self._last_error:
+                self._last_error = _error
+                self._keep(_error)
+
+    def _frame(self) -> RenderableType:
+        try:
+            _snapshots = self.snapshot()
+        except RuntimeError:
+            # Caught the devices mid change, there'll be another frame along shortly
+            _snapshots = ()
+        _lines = list(self.lines)[-self.config.display_events():]
+        _events = Panel(Text("\n".join(_lines)), title="Recent events", title_align="left")
+        return Group(*(self.render(x) for x in _snapshots), _events)
+
+    @staticmethod
+    def render(snapshot: StatusSnapshot) -> RenderableType:
+        _overview = Table.grid(padding=(0, 2))
+        _overview.add_row(
+            "Intensity",
+            ProgressBar(total=100, completed=snapshot.intensity * 100, width=40),
+            f"{snapshot.intensity:.0%}",
+            f"ambient {snapshot.ambient:.0%}, instant {snapshot.instant:.0%}"
+        )
+        _overview.add_row(
+            "Streaks",
+            f"{snapshot.kill_streak} kills, {snapshot.death_streak} deaths",
+            "",
+            snapshot.current_map or ""
+        )
+
+        _devices = Table(box=None, padding=(0, 2), header_style="bold")
+        _devices.add_column("Device")
+        _devices.add_column("Intensity")
+        _devices.add_column("", justify="right")
+        _devices.add_column("Commands/s", justify="right")
+        _devices.add_column("Round trip", justify="right")
+        for _device in snapshot.devices:
+            _intensity = _device.intensity or 0.0
+            _devices.add_row(
+                _device.name,
+                ProgressBar(total=100, completed=_intensity * 100, width=30),
+                f"{_intensity:.0%}" if _device.intensity is not None else "-",
+                f"{_device.rate:.1f}" if _device.rate is not None else "-",
+                f"{_device.rtt * 1000:.0f} ms" if _device.rtt is not None else "-"
+            )
+        if not snapshot.devices:
+            _devices.add_row("No devices", "", "", "", "")
+
+        _title = "MAC Toys" if snapshot.name is None else f"MAC Toys - {snapshot.name}"
+        return Panel(Group(_overview, Text(""), _devices), title=_title, title_align="left")
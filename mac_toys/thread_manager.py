@@ -1,11 +1,32 @@
 from __future__ import annotations
 
+import asyncio
 from abc import ABC, abstractmethod
 from enum import Enum, auto
+from functools import partial
 from threading import Thread
 
+from mac_toys.helpers import prnt
 
-class ThreadedActor(ABC):
+
+class Actor(ABC):
+    @abstractmethod
+    def start(self) -> None:
+        pass
+
+    @abstractmethod
+    def stop(self, *, timeout: float = 1.0) -> None:
+        pass
+
+    @abstractmethod
+    def force_stop(self) -> None:
+        pass
+
+
+class ThreadedActor(Actor, ABC):
+    """
+    An actor that runs in a thread of its own.
+    """
     _actor: Thread = None
 
     @property
@@ -16,17 +37,39 @@ class ThreadedActor(ABC):
     def actor(self, actor: Thread) -> None:
         self._actor = actor
 
+
+class TaskActor(Actor, ABC):
+    """
+    An actor that runs as a task on the running event loop, rather than in a thread of its own. Start and stop
+    it from the loop's thread.
+    """
+    # What to call the task
+    task_name: str = "Actor"
+    _task: asyncio.Task = None
+
+    @property
+    def task(self) -> asyncio.Task:
+        return self._task
+
     @abstractmethod
-    def start(self) -> None:
+    async def run(self) -> None:
+        """
+        Runs until cancelled, cleaning up after itself on the way out.
+        """
         pass
 
-    @abstractmethod
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self.run(), name=self.task_name)
+
     def stop(self, *, timeout: float = 1.0) -> None:
-        pass
+        """
+        Cancel the task. Nothing on the loop can wait for it here, use Agent.wait_stopped to.
+        """
+        self.force_stop()
 
-    @abstractmethod
     def force_stop(self) -> None:
-        pass
+        if self._task is not None:
+            self._task.cancel()
 
 
 class ActorState(Enum):
@@ -36,13 +79,13 @@ class ActorState(Enum):
 
 
 class Agent:
-    _last_added: dict[str, ActorState | ThreadedActor] = None
-    actors: dict[str, dict[str, ActorState | ThreadedActor]] = None
+    _last_added: dict[str, ActorState | Actor] = None
+    actors: dict[str, dict[str, ActorState | Actor]] = None
 
     def __init__(self) -> None:
         self.actors = {}
 
-    def add_agent(self, name: str, actor: ThreadedActor) -> Agent:
+    def add_agent(self, name: str, actor: Actor) -> Agent:
         if name in self.actors:
             _state = self.actors[name].get('state')
             _actor = self.actors[name].get('actor')
@@ -60,26 +103,36 @@ class Agent:
     def start(self, actor_name: str = None) -> None:
         if actor_name is None:
             _state = self._last_added.get('state')
-            _actor = self._last_added.get('actor')
             if _state != ActorState.NOT_STARTED:
                 raise ValueError(f"Last added actor is already started.")
 
-            _actor.start()
-            self._last_added['state'] = ActorState.RUNNING
+            self._launch(self._last_added)
         else:
             _actor_d = self.actors.get(actor_name)
             if _actor_d:
                 _state = _actor_d.get('state')
-                _actor = _actor_d.get('actor')
 
                 if _state != ActorState.NOT_STARTED:
                     raise ValueError(f"Actor '{actor_name}' is already started.")
 
-                _actor.start()
-                _actor_d['state'] = ActorState.RUNNING
+                self._launch(_actor_d)
             else:
                 raise KeyError(f"Actor of name '{actor_name}' does not exist.")
 
+    def _launch(self, actor_d: dict[str, ActorState | Actor]) -> None:
+        _actor = actor_d['actor']
+        _actor.start()
+        actor_d['state'] = ActorState.RUNNING
+        if isinstance(_actor, TaskActor) and _actor.task is not None:
+            _actor.task.add_done_callback(partial(self._finished, actor_d))
+
+    @staticmethod
+    def _finished(actor_d: dict[str, ActorState | Actor], task: asyncio.Task) -> None:
+        # However the task ended, so an actor that died on its own isn't taken for a running one
+        actor_d['state'] = ActorState.STOPPED
+        if not task.cancelled() and task.exception() is not None:
+            prnt(f"{task.get_name()} stopped on an error: {task.exception()!r}")
+
     def stop(self, actor_name: str) -> None:
         _actor_d = self.actors.get(actor_name)
         if _actor_d:
@@ -97,11 +150,9 @@ class Agent:
     def start_all(self) -> None:
         for thread_name in self.actors:
             _state = self.actors[thread_name].get('state')
-            _actor = self.actors[thread_name].get('actor')
             match _state:
                 case ActorState.NOT_STARTED:
-                    _actor.start()
-                    self.actors[thread_name]['state'] = ActorState.RUNNING
+                    self._launch(self.actors[thread_name])
                 case _:
                     pass
 
@@ -116,7 +167,19 @@ class Agent:
                 case _:
                     pass
 
-    def get_agent(self, name: str) -> ThreadedActor:
+    async def wait_stopped(self, timeout: float = 1.0) -> None:
+        """
+        Wait for the tasks of the stopped task actors to finish, for at most the timeout (s).
+        """
+        _tasks = [
+            _actor_d['actor'].task for _actor_d in self.actors.values()
+            if _actor_d['state'] == ActorState.STOPPED
+            and isinstance(_actor_d['actor'], TaskActor) and _actor_d['actor'].task is not None
+        ]
+        if _tasks:
+            await asyncio.wait(_tasks, timeout=timeout)
+
+    def get_agent(self, name: str) -> Actor:
         if name not in self.actors:
             raise KeyError("That actor is not in the Agent.")
 
@@ -1,7 +1,11 @@
 from __future__ import annotations
 
+from collections import OrderedDict
+from dataclasses import dataclass
 from enum import Enum, auto
-from mac_toys.sse_listener import Singleton, KillEvent, ChatEvent
+from mac_toys.clock import clock
+from mac_toys.matching import TriggerMatcher
+from mac_toys.sse_listener import KillEvent, ChatEvent, MapChangeEvent
 
 SAFE_WORD_STOP: str = "PLUG STOP"
 
@@ -26,33 +30,56 @@ class UpdateTypes(Enum):
     CHAT_PLAYER_DEMANDED_STOP = auto()
 
 
-class PlayerTracker(metaclass=Singleton):
+@dataclass(slots=True)
+class OpponentState:
+    # Times you have killed them since they last killed you
+    kills_in_a_row: int = 0
+    # Times they have killed you since you last killed them
+    deaths_in_a_row: int = 0
+    # monotonic time of the last kill involving you and them
+    last_seen: float = 0.0
+
+
+class PlayerTracker:
     player: str = None
     player_name: str = None
-    enemy_kill_tracker: dict[str, int] = None
-    dominated_by: list[str] = None
-    deaths_by_tracker: dict[str, int] = None
-    dominating: list[str] = None
+    # Everyone you have killed or been killed by, least recently seen first
+    opponents: OrderedDict[str, OpponentState] = None
+    dominated_by: set[str] = None
+    dominating: set[str] = None
+    # Opponents are forgotten once there are more than this many, or once idle for this long (s)
+    max_opponents: int = None
+    opponent_idle_timeout: float = None
+    current_map: str = None
     kill_streak: int = None
     death_streak: int = None
     forbidden_you_words: list[str] = None
     forbidden_any_words: list[str] = None
+    # The forbidden words compiled for matching
+    you_words_matcher: TriggerMatcher = None
+    any_words_matcher: TriggerMatcher = None
+    # The trigger that caused each chat update from the last chat message handled
+    chat_triggers: dict[UpdateTypes, str] = None
 
     def handle_chat_message(self, event: ChatEvent) -> list[UpdateTypes]:
         _updates: list[UpdateTypes] = []
         _author = event.author[1]
-        _sentence = event.message.lower()
+        self.chat_triggers = {}
 
         if _author == self.player:
-            if any([x in _sentence for x in self.forbidden_you_words]):
+            _trigger = self.you_words_matcher.find(event.message)
+            if _trigger is not None:
                 _updates.append(UpdateTypes.CHAT_YOU_SAY)
+                self.chat_triggers[UpdateTypes.CHAT_YOU_SAY] = _trigger
 
             # Let the player drop a safeword in chat for relief
             if event.message.strip() == SAFE_WORD_STOP:
                 _updates.append(UpdateTypes.CHAT_PLAYER_DEMANDED_STOP)
         else:
-            if any([x in _sentence for x in self.forbidden_any_words]):
+            _trigger = self.any_words_matcher.find(event.message)
+            if _trigger is not None:
                 _updates.append(UpdateTypes.CHAT_ANY_SAY)
+                self.chat_triggers[UpdateTypes.CHAT_ANY_SAY] = _trigger
 
         return _updates
 
@@ -67,21 +94,19 @@ class PlayerTracker(metaclass=Singleton):
             _updates.append(UpdateTypes.GOT_KILLED)
             if _was_crit:
                 _updates.append(UpdateTypes.GOT_CRIT_KILLED)
-            # Increment the number of times killed by this person in a row
-            if _killer_sid not in self.deaths_by_tracker:
-                self.deaths_by_tracker[_killer_sid] = 0
-            self.deaths_by_tracker[_killer_sid] += 1
-
-            # Reset domination status towards the enemy, remove from dominating queue if in it
-            if _killer_sid in self.enemy_kill_tracker:
-                self.enemy_kill_tracker[_victim_sid] = 0
+            _opponent = self._touch_opponent(_killer_sid)
+            # Increment the number of times killed by this person in a row, and reset our run on them
+            _opponent.deaths_in_a_row += 1
+            _opponent.kills_in_a_row = 0
+
+            # Reset domination status towards the enemy
             if _killer_sid in self.dominating:
-                self.dominating.remove(_killer_sid)
+                self.dominating.discard(_killer_sid)
                 _updates.append(UpdateTypes.LOST_DOMINATION)
 
-            # If now getting dominated by this user, add them to the dominated by list
-            if self.deaths_by_tracker[_killer_sid] >= 3:
-                self.dominated_by.append(_killer_sid)
+            # If now getting dominated by this user, add them to the dominated by set
+            if _opponent.deaths_in_a_row >= 3 and _killer_sid not in self.dominated_by:
+                self.dominated_by.add(_killer_sid)
                 _updates.append(UpdateTypes.GOT_DOMINATED)
 
             # If no kills this life, increase death streak
@@ -98,34 +123,85 @@ class PlayerTracker(metaclass=Singleton):
             self.kill_streak += 1
             self.death_streak = 0
 
-            # Increment number of times you have killed this person in a row
-            if _victim_sid not in self.enemy_kill_tracker:
-                self.enemy_kill_tracker[_victim_sid] = 0
-            self.enemy_kill_tracker[_victim_sid] += 1
+            _opponent = self._touch_opponent(_victim_sid)
+            # Increment number of times you have killed this person in a row, and reset their run on you
+            _opponent.kills_in_a_row += 1
+            _opponent.deaths_in_a_row = 0
 
             # Reset domination if you are getting dominated by them
             if _victim_sid in self.dominated_by:
-                self.dominated_by.remove(_victim_sid)
+                self.dominated_by.discard(_victim_sid)
                 _updates.append(UpdateTypes.REMOVED_DOMINATION)
-            # Reset times killed in a row by this person
-            if _victim_sid in self.deaths_by_tracker:
-                self.deaths_by_tracker[_victim_sid] = 0
 
             # Update domination status of the victim
-            if self.enemy_kill_tracker[_victim_sid] >= 3:
-                self.dominating.append(_victim_sid)
+            if _opponent.kills_in_a_row >= 3 and _victim_sid not in self.dominating:
+                self.dominating.add(_victim_sid)
                 _updates.append(UpdateTypes.DOMINATED_ENEMY)
 
         return self.kill_streak, self.death_streak, _updates
 
+    def handle_map_change(self, event: MapChangeEvent) -> list[UpdateTypes]:
+        """
+        Everyone's domination status resets with the map, so forget every opponent.
+        """
+        if event.map_name != self.current_map:
+            self.current_map = event.map_name
+            self.opponents.clear()
+            self.dominating.clear()
+            self.dominated_by.clear()
+        return []
+
+    def _touch_opponent(self, steam_id: str) -> OpponentState:
+        """
+        Get the state for an opponent (creating it if new) and mark them as just seen. Evicts opponents that
+        haven't been seen in a while, or the least recently seen ones if there are too many.
+        """
+        _now = clock().now()
+        _opponent = self.opponents.get(steam_id)
+        if _opponent is None:
+            _opponent = OpponentState()
+            self.opponents[steam_id] = _opponent
+        else:
+            self.opponents.move_to_end(steam_id)
+        _opponent.last_seen = _now
+
+        # Least recently seen are at the front, so only ever look at those
+        _idle_before = _now - self.opponent_idle_timeout
+        while self.opponents:
+            _oldest_sid, _oldest = next(iter(self.opponents.items()))
+            if len(self.opponents) <= self.max_opponents and _oldest.last_seen >= _idle_before:
+                break
+            del self.opponents[_oldest_sid]
+            self.dominating.discard(_oldest_sid)
+            self.dominated_by.discard(_oldest_sid)
+
+        return _opponent
+
     def __init__(self, name: str, steam_id: str, config) -> None:
-        self.player = steam_id
+        self.player = str(steam_id)
         self.player_name = name
         self.kill_streak = 0
         self.death_streak = 0
-        self.enemy_kill_tracker = {}
-        self.dominated_by = []
-        self.deaths_by_tracker = {}
-        self.dominating = []
+        self.opponents = OrderedDict()
+        self.dominated_by = set()
+        self.dominating = set()
+        self.chat_triggers = {}
+        self.load_config(config)
+        config.add_listener(self.load_config)
+
+    def load_config(self, config) -> None:
+        """
+        Take the chat triggers and tracking limits from the config. Called again whenever it is reloaded.
+        """
+        self.max_opponents = config.tracking_max_opponents()
+        self.opponent_idle_timeout = config.tracking_opponent_idle_minutes() * 60.0
         self.forbidden_any_words = config.instant_chat_messages('trigger_on_any_say')
         self.forbidden_you_words = config.instant_chat_messages('trigger_on_you_say')
+        _word_boundary = config.instant_chat_matching('word_boundary')
+        _case_fold = config.instant_chat_matching('case_fold')
+        self.you_words_matcher = TriggerMatcher(
+            self.forbidden_you_words, word_boundary=_word_boundary, case_fold=_case_fold
+        )
+        self.any_words_matcher = TriggerMatcher(
+            self.forbidden_any_words, word_boundary=_word_boundary, case_fold=_case_fold
+        )
@@ -1,16 +1,18 @@
 from __future__ import annotations
 
-import time
-from threading import Lock, Thread
-from random import uniform
+from asyncio import Event
+from threading import Lock
+from mac_toys.clock import clock, rng
 from mac_toys.interpolation import ValueSlider
 from mac_toys.helpers import interpolate_value_bounded, prnt
-from mac_toys.thread_manager import ThreadedActor
+from mac_toys.thread_manager import TaskActor
 from mac_toys.vibration.intensity import IntensityController
-from mac_toys.config import Config
+from mac_toys.config import ConfigView
+from mac_toys.curves import Curve
 
 
-class AmbienceController(ThreadedActor):
+class AmbienceController(TaskActor):
+    task_name: str = "Ambient Vibration Controller"
     # Ambient background vibration
     last_change_time: float = None
     computed_change_rate: float = None
@@ -21,10 +23,11 @@ class AmbienceController(ThreadedActor):
     ambient_vibration_change_rate_variance: float = None
     # application
     intensity_controller: IntensityController = None
-    # control
-    _stop_flag: bool = None
-    _running: bool = None
-    _config: Config = None
+    # control, what wakes the task early when the streak parameters change, and whether they have changed
+    # since the last ambient intensity was picked (to pick a new one now)
+    _wake: Event = None
+    _params_changed: bool = False
+    _config: ConfigView = None
     # update lock
     _param_lock: Lock = None
     # configured values store
@@ -51,13 +54,18 @@ class AmbienceController(ThreadedActor):
     _avcrv_kill_min: float = None
     _avcrv_death_max: float = None
     _avcrv_death_min: float = None
-
-
+    # Slide settings
+    _slide_time: float = None
+    _curve: Curve = None
+    # The streaks the parameters were last worked out from (if they have been yet), to work them out again
+    # on a config reload
+    _kill_streak: int = None
+    _death_streak: int = None
 
     def __init__(
             self,
             intensity_controller: IntensityController,
-            config: Config
+            config: ConfigView
     ) -> None:
         self.current_vibration = 0.0
         self.ambient_vibration = 0.10
@@ -66,19 +74,26 @@ class AmbienceController(ThreadedActor):
         self.ambient_vibration_change_rate_variance = 0.5
         self.computed_change_rate = self.ambient_vibration_change_rate
         self.computed_ambient_vibration = self.ambient_vibration
-        self.last_change_time = time.time()
+        self.last_change_time = clock().now()
 
         self._config = config
         self._param_lock = Lock()
-        self._stop_flag = False
-        self._running = False
+        self._wake = Event()
         self.intensity_controller = intensity_controller
-        self.actor = Thread(
-            target=self.settle_ambience,
-            name="Ambient Vibration Controller Thread",
-            daemon=True,
-        )
+        self._load_config_values()
+        config.add_listener(self.reload_config)
+
+    def reload_config(self, config: ConfigView) -> None:
+        """
+        Take the ambience settings from a reloaded config, and apply them to the current streaks.
+        """
+        with self._param_lock:
+            self._config = config
+            self._load_config_values()
+        if self._kill_streak is not None:
+            self.update_parameters(self._kill_streak, self._death_streak)
 
+    def _load_config_values(self) -> None:
         # I'm lazy so im loading configs this way, #deal
         self._avi_kill_min = self._config.ambience_intensity('killstreak_minimum')
         self._avi_kill_max = self._config.ambience_intensity('killstreak_maximum')
@@ -88,8 +103,8 @@ class AmbienceController(ThreadedActor):
         self._max_ds_value = float(self._config.ambience_max_at_value('deathstreak'))
         self._avv_kill_min = self._config.ambience_intensity_variance('killstreak_minimum')
         self._avv_kill_max = self._config.ambience_intensity_variance('killstreak_maximum')
-        self._avv_death_min = self._config.ambience_intensity('deathstreak_minimum')
-        self._avv_death_max = self._config.ambience_intensity('deathstreak_maximum')
+        self._avv_death_min = self._config.ambience_intensity_variance('deathstreak_minimum')
+        self._avv_death_max = self._config.ambience_intensity_variance('deathstreak_maximum')
         self._avcr_kill_max = self._config.ambience_change_rate('killstreak_maximum')
         self._avcr_kill_min = self._config.ambience_change_rate('killstreak_minimum')
         self._avcr_death_max = self._config.ambience_change_rate('deathstreak_maximum')
@@ -99,31 +114,18 @@ class AmbienceController(ThreadedActor):
         self._avcrv_death_max = self._config.ambience_change_rate_variance('deathstreak_maximum')
         self._avcrv_death_min = self._config.ambience_change_rate_variance('deathstreak_minimum')
         self._slide_time = self._config.ambience_transition_time()
-
-
-    def start(self) -> None:
-        self.actor.start()
-        self._running = True
-
-    def stop(self, *, timeout: float = 1.0) -> None:
-        """
-        Will set the stop flag, and try and join the actor thread.
-        Has a 1s timeout by default.
-
-        :return: None
-        """
-        self._stop_flag = True
-        self.actor.join(timeout)
-
-    def force_stop(self) -> None:
-        """
-        The actor in this class is a Daemon, it is safe to just ignore it.
-        :return: None
-        """
-        self._stop_flag = True
+        self._curve = self._config.ambience_curve()
 
     def update_parameters(self, kill_streak: int, death_streak: int) -> None:
         with (self._param_lock):
+            self._kill_streak = kill_streak
+            self._death_streak = death_streak
+            _previous = (
+                self.ambient_vibration,
+                self.ambient_vibration_variance,
+                self.ambient_vibration_change_rate,
+                self.ambient_vibration_change_rate_variance
+            )
 
             self.ambient_vibration = max(
                 interpolate_value_bounded(
@@ -158,38 +160,77 @@ class AmbienceController(ThreadedActor):
                 )
             )
 
-    def settle_ambience(self) -> None:
-        while not self._stop_flag:
-            time.sleep(0.05)
-            _now = time.time()
-            if _now - self.last_change_time > self.computed_change_rate:
+            if _previous != (
+                self.ambient_vibration,
+                self.ambient_vibration_variance,
+                self.ambient_vibration_change_rate,
+                self.ambient_vibration_change_rate_variance
+            ):
+                self._params_changed = True
+                self._wake.set()
+
+    async def run(self) -> None:
+        """
+        Sleeps until the next ambient intensity is due, or the streak parameters change, then picks it.
+        """
+        try:
+            while True:
+                # Cleared before working out the wait, so a change from here on still cuts it short
+                self._wake.clear()
+                _now = clock().now()
+                _due = self.next_due(_now)
+                if _now < _due:
+                    await clock().wait(self._wake, _due - _now)
+                    continue
+
                 if not self.intensity_controller.is_running():
-                    prnt("Intensity controller thread is not running, cannot control ambience.")
+                    prnt("Intensity controller is not running, cannot control ambience.")
                     break
+                self.step(_now)
+        finally:
+            prnt("Exiting ambience control...")
 
-                with self._param_lock:
-                    _new_change_rate = uniform(
-                        max(0.33,
-                            self.ambient_vibration_change_rate - self.ambient_vibration_change_rate_variance
-                            ),
-                        self.ambient_vibration_change_rate + self.ambient_vibration_change_rate_variance
-                    )
-                    _new_ambient_intensity = uniform(
-                        max(0.0,
-                            self.ambient_vibration - self.ambient_vibration_variance,
-                            ),
-                        min(0.99,
-                            self.ambient_vibration + self.ambient_vibration_variance
-                            )
+    def next_due(self, now: float) -> float:
+        """
+        :return: the monotonic time the next ambient intensity is due, now if the streak parameters have
+            changed since the last one
+        """
+        if self._params_changed:
+            return now
+        return self.last_change_time + self.computed_change_rate
+
+    def step(self, now: float) -> None:
+        """
+        Start sliding to a new ambient intensity, if it is time to at the given monotonic time.
+        """
+        if now < self.next_due(now):
+            return
+
+        _rng = rng()
+        with self._param_lock:
+            self._params_changed = False
+            _new_change_rate = _rng.uniform(
+                max(0.33,
+                    self.ambient_vibration_change_rate - self.ambient_vibration_change_rate_variance
+                    ),
+                self.ambient_vibration_change_rate + self.ambient_vibration_change_rate_variance
+            )
+            _new_ambient_intensity = _rng.uniform(
+                max(0.0,
+                    self.ambient_vibration - self.ambient_vibration_variance,
+                    ),
+                min(0.99,
+                    self.ambient_vibration + self.ambient_vibration_variance
                     )
+            )
 
-                self.computed_change_rate = _new_change_rate
-                self.last_change_time = _now
-                _slider = ValueSlider(
-                    self.intensity_controller.get_ambient_intensity(),
-                    _new_ambient_intensity,
-                    self._slide_time,
-                    self.intensity_controller.set_ambient_intensity
-                )
-                self.intensity_controller.set_ambient_intensity_slider(_slider)
-        prnt("Exiting ambience control thread...")
+        self.computed_change_rate = _new_change_rate
+        self.last_change_time = now
+        _slider = ValueSlider(
+            self.intensity_controller.get_ambient_intensity(),
+            _new_ambient_intensity,
+            self._slide_time,
+            self.intensity_controller.set_ambient_intensity,
+            self._curve
+        )
+        self.intensity_controller.set_ambient_intensity_slider(_slider)
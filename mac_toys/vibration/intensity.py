@@ -1,21 +1,27 @@
-import time
-
-from threading import Thread
 from typing import Callable
-from asyncio import get_running_loop, set_event_loop, new_event_loop
 
-from mac_toys.interpolation import ValueSlider
-from mac_toys.thread_manager import ThreadedActor
+from mac_toys.clock import clock
+from mac_toys.curves import Curve
+from mac_toys.interpolation import ValueSlider, SlideScheduler
+from mac_toys.metrics import EventTrace
+from mac_toys.thread_manager import TaskActor
+from mac_toys.vibration.mixer import BlendMode, IntensityMixer
 
 
-class IntensityController(ThreadedActor):
+class IntensityController(TaskActor):
+    """
+    Mixes the ambient and instant intensities every tick, as a task on the event loop, and hands the result
+    straight to the applicator function.
+    """
+    task_name: str = "Intensity Controller"
     ambient_intensity_slider: ValueSlider = None
     _ambient_intensity: float = None
-    instant_intensity_slider: ValueSlider = None
+    # Every instant vibration still going, mixed over the ambience each tick
+    mixer: IntensityMixer = None
+    # What the instant vibrations made of the ambience on the last tick (negative if they turned it down)
     _instant_intensity: float = None
     _combined_intensity: float = None
     _applicator_func: Callable[[float], None] = None
-    _applicator_thread: Thread = None
     # how often the applicator function is called in ms (i.e. value 66.66 implies once every ~66.66ms)
     _applicator_regularity: float = None
     _running: bool = True
@@ -27,25 +33,25 @@ class IntensityController(ThreadedActor):
     ) -> None:
         self._ambient_intensity = 0.0
         self._instant_intensity = 0.0
+        self.mixer = IntensityMixer()
         self._applicator_regularity = (1000.0 / frequency)
         self._running = False
-        self._applicator_thread = Thread(
-            target=self.threaded_apply,
-            name="Intensity Controller Applicator Thread",
-            daemon=True
-        )
         self._applicator_func = applicator_function
 
     def start(self) -> None:
         self._running = True
-        self._applicator_thread.start()
-
-    def stop(self, *, timeout: float = 1.0) -> None:
-        self._running = False
-        self._applicator_thread.join(timeout)
+        super().start()
 
     def force_stop(self) -> None:
         self._running = False
+        super().force_stop()
+
+    @property
+    def interval(self) -> float:
+        """
+        :return: the time between ticks (s)
+        """
+        return self._applicator_regularity / 1000
 
     @property
     def combined_intensity(self) -> float:
@@ -53,73 +59,54 @@ class IntensityController(ThreadedActor):
         return self._combined_intensity
 
     def set_combined_intensity(self) -> None:
-        self._combined_intensity = min(1.0, max(0.0, self._ambient_intensity + self._instant_intensity))
+        _ambient = self._ambient_intensity
+        _mixed = self.mixer.mix(_ambient)
+        self._instant_intensity = _mixed - _ambient
+        self._combined_intensity = min(1.0, max(0.0, _mixed))
 
     def set_ambient_intensity_slider(self, slider: ValueSlider, *, inherit_starting: bool = True) -> None:
-        if self.ambient_intensity_slider is not None:
-            if self.ambient_intensity_slider.complete:
-                self.ambient_intensity_slider.join()
-            else:
-                self.ambient_intensity_slider.cancel()
-
         if inherit_starting:
             slider.starting_value = self._ambient_intensity
-        self.ambient_intensity_slider = slider
-        self.ambient_intensity_slider.start()
+        self.ambient_intensity_slider = SlideScheduler().replace(self.ambient_intensity_slider, slider)
 
-    def set_instant_intensity_slider(
+    def add_instant_intensity(
             self,
-            slider: ValueSlider, *,
-            inherit_starting: bool = True,
+            intensity: float,
+            duration: float,
+            curve: Curve = None,
+            blend: BlendMode = BlendMode.ADD,
+            priority: int = 0,
+            trace: EventTrace = None
     ) -> None:
-        _ending = 0.0
-        if self.instant_intensity_slider is not None:
-            if self.instant_intensity_slider.complete:
-                self.instant_intensity_slider.join()
-            else:
-                self.instant_intensity_slider.cancel()
-
-        if inherit_starting:
-            slider.starting_value = self._combined_intensity
-        else:
-            slider.starting_value += min(0.99, self._combined_intensity)
-
-        self.instant_intensity_slider = slider
-        self.instant_intensity_slider.start()
+        """
+        Start an instant vibration, sliding from the given intensity to 0 over the duration (ms). It is mixed
+        in alongside any others still going, rather than replacing them.
+        """
+        self.mixer.add(intensity, duration, curve, blend, priority, trace)
 
     def set_ambient_intensity(self, value: float) -> None:
         self._ambient_intensity = value
 
-    def set_instant_intensity(self, value: float) -> None:
-        self._instant_intensity = value
-
     def get_ambient_intensity(self) -> float:
         return self._ambient_intensity
 
     def get_instant_intensity(self) -> float:
         return self._instant_intensity
 
-    def threaded_apply(self) -> None:
-        _made_new: bool = False
+    async def run(self) -> None:
         try:
-            loop = get_running_loop()
-        except RuntimeError:
-            _made_new = True
-            loop = new_event_loop()
-            set_event_loop(loop)
-
-        while self._running:
-            loop.run_until_complete(self.apply())
-            time.sleep(self._applicator_regularity / 1000)
-        if _made_new:
-            loop.close()
-
-        if self.ambient_intensity_slider is not None:
-            self.ambient_intensity_slider.cancel()
-        if self.instant_intensity_slider is not None:
-            self.instant_intensity_slider.cancel()
-
-    async def apply(self) -> None:
+            while self._running:
+                self.tick()
+                await clock().sleep(self.interval)
+        finally:
+            self._running = False
+            SlideScheduler.cancel(self.ambient_intensity_slider)
+            self.mixer.clear()
+
+    def tick(self) -> None:
+        """
+        Mix the current intensity and hand it to the applicator function.
+        """
         self._applicator_func(self.combined_intensity)
 
     def is_running(self) -> bool:
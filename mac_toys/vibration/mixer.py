@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from array import array
+from enum import Enum, auto
+from threading import Lock
+from typing import Optional
+
+from mac_toys.clock import clock
+from mac_toys.curves import Curve
+from mac_toys.metrics import EventTrace, Stage
+
+
+class BlendMode(Enum):
+    """
+    How a layer combines with everything beneath it (the ambience, and any layers of lower priority).
+    """
+    # Adds its intensity on top
+    ADD = auto()
+    # Raises the intensity to its own, if it is higher
+    MAX = auto()
+    # Turns everything beneath it down by its intensity (i.e. 0.25 leaves 75%)
+    DUCK = auto()
+
+
+class IntensityMixer:
+    """
+    Mixes any number of overlapping instant vibrations (layers) over the ambient intensity.
+
+    Each layer starts at its peak and slides back to 0 over its duration along its curve, and is blended
+    over everything beneath it by its blend mode. Layers are kept in a table of parallel arrays ordered by
+    priority (then by when they were added), so each tick composites them all in one pass, dropping finished
+    ones as it goes. The table holds at most `capacity` layers, so a big fight costs no more per tick than
+    that: once full, the lowest priority, oldest layer makes way.
+
+    Layers are added from the event loop and mixed from the intensity controller's task.
+    """
+    # Most layers held at once
+    capacity: int = 32
+    # One entry per layer: when it started (monotonic, s), how long it lasts (s), its peak intensity, its
+    # priority and blend mode (the BlendMode's value), and its curve (None for a straight line)
+    _started: array = None
+    _durations: array = None
+    _peaks: array = None
+    _priorities: array = None
+    _blends: array = None
+    _curves: list[Optional[Curve]] = None
+    _table_lock: Lock = None
+
+    def __init__(self, capacity: int = None) -> None:
+        if capacity is not None:
+            self.capacity = capacity
+        self._started = array('d')
+        self._durations = array('d')
+        self._peaks = array('d')
+        self._priorities = array('i')
+        self._blends = array('b')
+        self._curves = []
+        self._table_lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._peaks)
+
+    def add(
+            self,
+            peak: float,
+            duration: float,
+            curve: Curve = None,
+            blend: BlendMode = BlendMode.ADD,
+            priority: int = 0,
+            trace: EventTrace = None,
+            now: float = None
+    ) -> bool:
+        """
+        Start a layer, sliding from its peak to 0.
+
+        :param duration: in ms
+        :param trace: of the event causing this, stamped as the layer starts
+        :return: whether the layer was added, False if the table is full of layers of higher priority
+        """
+        _now = clock().now() if now is None else now
+        with self._table_lock:
+            if len(self._peaks) >= self.capacity:
+                if priority < self._priorities[0]:
+                    return False
+                self._remove(0)
+            # After every layer of the same or lower priority
+            _row = len(self._priorities)
+            while _row > 0 and self._priorities[_row - 1] > priority:
+                _row -= 1
+            self._started.insert(_row, _now)
+            self._durations.insert(_row, duration / 1000)
+            self._peaks.insert(_row, peak)
+            self._priorities.insert(_row, priority)
+            self._blends.insert(_row, blend.value)
+            self._curves.insert(_row, curve)
+        if trace is not None:
+            trace.stamp(Stage.SLIDER, _now)
+        return True
+
+    def _remove(self, row: int) -> None:
+        del self._started[row]
+        del self._durations[row]
+        del self._peaks[row]
+        del self._priorities[row]
+        del self._blends[row]
+        del self._curves[row]
+
+    def clear(self) -> None:
+        with self._table_lock:
+            self._remove_from(0)
+
+    def _remove_from(self, row: int) -> None:
+        del self._started[row:]
+        del self._durations[row:]
+        del self._peaks[row:]
+        del self._priorities[row:]
+        del self._blends[row:]
+        del self._curves[row:]
+
+    def mix(self, base: float, now: float = None) -> float:
+        """
+        Blend every active layer over the base intensity, as they are at the given monotonic time.
+
+        :return: the mixed intensity, not yet clamped
+        """
+        _now = clock().now() if now is None else now
+        _add, _max, _duck = BlendMode.ADD.value, BlendMode.MAX.value, BlendMode.DUCK.value
+        _mixed = base
+        with self._table_lock:
+            _started, _durations, _peaks = self._started, self._durations, self._peaks
+            _blends, _curves = self._blends, self._curves
+            _kept = 0
+            for _row in range(len(_peaks)):
+                _duration = _durations[_row]
+                _progress = max(0.0, (_now - _started[_row]) / _duration) if _duration > 0 else 1.0
+                if _progress >= 1.0:
+                    continue
+                _curve = _curves[_row]
+                _value = _peaks[_row] * (1.0 - (_curve.sample(_progress) if _curve is not None else _progress))
+
+                _blend = _blends[_row]
+                if _blend == _add:
+                    _mixed += _value
+                elif _blend == _max:
+                    if _value > _mixed:
+                        _mixed = _value
+                elif _blend == _duck:
+                    _mixed *= 1.0 - min(1.0, _value)
+
+                # Compact the table over finished layers in the same pass
+                if _kept != _row:
+                    _started[_kept] = _started[_row]
+                    _durations[_kept] = _duration
+                    _peaks[_kept] = _peaks[_row]
+                    self._priorities[_kept] = self._priorities[_row]
+                    _blends[_kept] = _blend
+                    _curves[_kept] = _curve
+                _kept += 1
+            if _kept != len(_peaks):
+                self._remove_from(_kept)
+        return _mixed
@@ -3,248 +3,444 @@ from __future__ import annotations
 __version__ = "0.1.0a"
 
 import asyncio
-import queue
+import sys
 import time
 
-from asyncio import sleep, run, get_running_loop
+from asyncio import run, get_running_loop, AbstractEventLoop, Event
 from threading import Thread
-from queue import Queue
+from pathlib import Path
 from signal import signal, SIGINT
 from typing import Union, cast, Optional
 
-from buttplug import Client, WebsocketConnector, ProtocolSpec, Device, DisconnectedError
-from tqdm import tqdm
+from buttplug import ButtplugError
 
+from mac_toys.event_bus import Subscription
 from mac_toys.helpers import prnt
-from mac_toys.sse_listener import SSEListener, ChatEvent, KillEvent, Singleton
+from mac_toys.sse_listener import SSEListener, ChatEvent, KillEvent, MapChangeEvent
 from mac_toys.tracker import PlayerTracker, UpdateTypes
 from mac_toys.thread_manager import Agent
-from mac_toys.interpolation import ValueSlider
-from mac_toys.config import Config
+from mac_toys.config import Config, ConfigView, toy_filters
+from mac_toys.connection import DeviceConnection
+from mac_toys.curves import Curve
+from mac_toys.metrics import EventTrace, PipelineMetrics, Stage
+from mac_toys.device_group import DeviceGroup, DeviceOutput
+from mac_toys.device_process import ChannelSlot, DeviceProcess
+from mac_toys.recording import EventRecorder, ReplaySource
+from mac_toys.status import StatusDisplay, StatusSnapshot
 
 from mac_toys.vibration.ambience import AmbienceController
 from mac_toys.vibration.intensity import IntensityController
-
-
-class Vibrator(metaclass=Singleton):
-    client: Client = None
-    config: Config = None
-    connector: WebsocketConnector = None
-    # Cache the devices one layer up rather than having to reach into the client every time
-    devices: list[Device] = None
-    # This agent controls all the ThreadedActors that the Vibrator class instantiates
+from mac_toys.vibration.mixer import BlendMode
+
+
+class Vibrator:
+    """
+    Drives one player profile's toys, from that player's events.
+    """
+    config: ConfigView = None
+    # Where the intensity goes to reach the profile's toys
+    output: DeviceOutput = None
+    # The profile's name, shown alongside what it prints, or None when it is the only one
+    name: Optional[str] = None
+    # This agent controls all the actors that the Vibrator class instantiates
     agent: Agent = None
     # Current intensity value (inclusive of ambient and instant)
     current_vibration: float = None
-    # intensity status bar
-    pbar: tqdm = None
-
-    async def connect_and_scan(self) -> None:
-        assert self.connector is not None
-
-        # If this succeeds, we'll be connected. If not, we'll probably have some
-        # sort of exception thrown of type ButtplugError.
-        try:
-            await self.client.connect(self.connector)
-        except Exception as e:
-            prnt(f"Could not connect to server, exiting: {e}")
-            return
-
-        if len(self.client.devices) == 0:
-            prnt(f"Scanning for devices now, see you in 10s!")
-            await self.client.start_scanning()
-            await sleep(10)
-            await self.client.stop_scanning()
-            prnt(f"Done.")
-        else:
-            prnt(f"Found devices connected, assuming no scan needed.")
-
-        if len(self.client.devices) > 0:
-            prnt(f"Found {len(self.client.devices)} devices!")
-        else:
-            prnt(f"Found no devices :(")
-
-    def __init__(self, config: Config, ws_host: str = "127.0.0.1", port: int = 12345):
-        self.client = Client("MAC Toys Client", ProtocolSpec.v3)
-        self.connector = WebsocketConnector(f"ws://{ws_host}:{port}")
+    # Set by the intensity controller to wake the dispatch loop
+    _command_due: Event = None
+    # How long the dispatch loop may sleep without a new intensity before re-checking the connection and
+    # sending any keep-alives that are due (s)
+    _connection_check_interval: float = 1.0
+    # How long to hold off before trying again after failing to reach Intiface, doubling per failure up to the
+    # cap (s), and when the next try is due (monotonic, s), None while connected
+    _reconnect_cap: float = 30.0
+    _reconnect_delay: float = None
+    _reconnect_at: Optional[float] = None
+    # Traces of events waiting for their effect to reach the devices, and how long they may wait (s) before
+    # being written off (i.e. when the event didn't change the intensity)
+    _pending_traces: list[EventTrace] = None
+    _trace_timeout: float = 5.0
+
+    def __init__(self, config: ConfigView, output: DeviceOutput, name: str = None):
+        self.output = output
+        self.name = name
         self.agent = Agent()
         self.agent.add_agent(
-            "INTCON", IntensityController(self.set_combined_intensity)
+            "INTCON", IntensityController(self.set_combined_intensity, config.dispatch_controller_frequency())
         ).add_agent(
             "AMBINTCON", AmbienceController(cast(IntensityController, self.agent.get_agent('INTCON')), config)
         )
         self.config = config
+        self._command_due = Event()
+        self._pending_traces = []
 
     def start(self) -> None:
         prnt("Starting controllers...")
         self.agent.start_all()
-        self.pbar = tqdm(total=100, desc="Intensity", dynamic_ncols=True, bar_format='{l_bar}{bar}')
 
-    async def _apply_intensity(self) -> None:
-        futures = []
-        for dev in self.devices:
-            for r_act in dev.actuators:
-                futures.append(r_act.command(self.current_vibration))
-        try:
-            async with asyncio.timeout(0.5):
-                await asyncio.gather(*futures, return_exceptions=True)
-        except DisconnectedError:
-            prnt("Disconnected")
-        except TimeoutError:
-            prnt("Timed-out")
+    def _apply_intensity(self) -> None:
+        """
+        Post the current intensity to the toys, along with the traces of the events behind it.
+        """
+        self.output.post(self.current_vibration, self._take_traces())
+
+    def _take_traces(self) -> list[EventTrace]:
+        """
+        Take the traces of every event whose slide has started, as the next command carries their effect.
+        Traces that have waited too long are recorded as they are.
+        """
+        _now = time.monotonic()
+        _taken = []
+        _waiting = []
+        for _trace in self._pending_traces:
+            if _trace.reached(Stage.SLIDER):
+                _taken.append(_trace)
+            elif _now - _trace.at(Stage.RECEIVE) > self._trace_timeout:
+                PipelineMetrics().complete(_trace)
+            else:
+                _waiting.append(_trace)
+        self._pending_traces = _waiting
+        return _taken
 
-    def set_device(self):
-        self.devices = list(self.client.devices.values())
+    def status(self, player_tracker: PlayerTracker) -> StatusSnapshot:
+        """
+        Called from the status display thread, so only reads and copies.
+        """
+        _inten_controller = cast(IntensityController, self.agent.get_agent('INTCON'))
+        return StatusSnapshot(
+            name=self.name,
+            intensity=self.current_vibration or 0.0,
+            ambient=_inten_controller.get_ambient_intensity(),
+            instant=_inten_controller.get_instant_intensity(),
+            kill_streak=player_tracker.kill_streak,
+            death_streak=player_tracker.death_streak,
+            current_map=player_tracker.current_map,
+            devices=self.output.status()
+        )
 
     def set_combined_intensity(self, intensity: float) -> None:
+        """
+        Called from the intensity controller's task, wakes the dispatch loop only if the value changed.
+        """
+        if intensity == self.current_vibration:
+            return
+
         self.current_vibration = intensity
+        self._command_due.set()
 
     async def issue_command(self):
         """
         Sets all actuators in all devices to the given intensity
         """
-        if not self.client.connected:
+        if not self.output.connected:
             prnt("Tried to issue command while 'Not connected'!")
             return
 
         if self.current_vibration is not None:
-            _new_n = round(self.current_vibration * 100)
-            if _new_n != self.pbar.n:
-                self.pbar.update(int(_new_n - self.pbar.n))
-                self.pbar.display()
-
-            await self._apply_intensity()
-
-    def apply_instant_intensity(self, initial_intensity: float, duration: float) -> None:
-        _inten_controller = cast(IntensityController, self.agent.get_agent('INTCON'))
-        _slider = ValueSlider(
-            initial_intensity,
-            0,
-            duration,
-            _inten_controller.set_instant_intensity
+            self._apply_intensity()
+
+    def apply_instant_intensity(
+            self,
+            initial_intensity: float,
+            duration: float,
+            curve: Curve = None,
+            trace: EventTrace = None,
+            blend: BlendMode = BlendMode.ADD,
+            priority: int = 0
+    ) -> None:
+        """
+        :param blend: how it mixes with the ambience and any other instant vibrations still going
+        :param priority: instant vibrations of higher priority are mixed over those of lower priority
+        :param trace: of the event causing this, followed until the devices acknowledge the new intensity
+        """
+        if trace is not None and trace not in self._pending_traces:
+            self._pending_traces.append(trace)
+        cast(IntensityController, self.agent.get_agent('INTCON')).add_instant_intensity(
+            initial_intensity, duration, curve, blend, priority, trace
         )
-        _inten_controller.set_instant_intensity_slider(_slider, inherit_starting=False)
 
-    async def check_connection(self) -> None:
-        if not self.client.connected:
-            await self.client.connect(self.connector)
+    async def run_dispatch(self) -> None:
+        """
+        Sleeps until the intensity controller reports a new intensity, then hands it to the device workers.
+        Wakes up every so often regardless to keep the connection alive and send any keep-alive commands.
+        """
+        _interval = self._connection_check_interval
+        _keepalive = self.config.dispatch_keepalive()
+        if _keepalive > 0:
+            _interval = min(_interval, _keepalive)
+
+        while True:
+            try:
+                async with asyncio.timeout(_interval):
+                    await self._command_due.wait()
+            except TimeoutError:
+                if await self._check_connection() and _keepalive > 0:
+                    await self.issue_command()
+                continue
+
+            self._command_due.clear()
+            if await self._check_connection():
+                await self.issue_command()
+
+    async def _check_connection(self) -> bool:
+        """
+        Check on the connection to the toys, reconnecting if need be. After a failure, holds off trying again
+        for a while (backing off the longer it stays down) rather than on every new intensity.
+
+        :return: whether the toys can be sent commands
+        """
+        if self._reconnect_at is not None and time.monotonic() < self._reconnect_at:
+            return False
+        try:
+            await self.output.check_connection()
+        except (ButtplugError, OSError) as e:
+            if self._reconnect_at is None:
+                prnt(f"Lost the connection to the toys ({e}), retrying...")
+                self._reconnect_delay = self._connection_check_interval
+            else:
+                self._reconnect_delay = min(self._reconnect_cap, self._reconnect_delay * 2)
+            self._reconnect_at = time.monotonic() + self._reconnect_delay
+            # Nothing goes out until it is back, so the traces waiting on the next command never get there
+            for _trace in self._take_traces():
+                PipelineMetrics().complete(_trace)
+            return False
+
+        if self._reconnect_at is not None:
+            prnt("Reconnected to the toys.")
+            self._reconnect_at = None
+        return True
 
     async def stop_all(self) -> None:
-        self.pbar.close()
-        self.pbar.clear()
+        for _trace in self._pending_traces:
+            PipelineMetrics().complete(_trace)
+        self._pending_traces = []
+        await self.output.stop()
         self.agent.stop_all()
-        await self.client.disconnect()
+        await self.agent.wait_stopped()
 
 
 def abort(signum, frame):
     prnt("Received exit signal, ending...")
-    _vibe = Vibrator()
     loop = get_running_loop()
-    loop.create_task(_vibe.stop_all())
+    loop.create_task(DeviceConnection(Config()).disconnect())
     prnt("Killed vibrator component")
 
-    _inst = SSEListener(event_endpoint=None)
-    if _inst.t_subscriber is not None:
-        _inst.shutdown_flag = True
-        _inst.t_subscriber.join(timeout=2.0)
+    SSEListener(event_endpoint=None).stop()
     prnt("Killed SSE Listener...")
     exit(0)
 
 
-def interaction_pane(output_queue: Queue):
-    prnt("Type 'exit' at any time to exit program (the intensity bar will break, ignore it).\n")
-    while input().lower() != "exit":
+def interaction_pane(loop: AbstractEventLoop, stop_event: Event):
+    prnt("Type 'exit' at any time to exit program (what you type may be drawn over, keep typing).")
+    prnt("Type 'stats' to see how long events are taking to reach your toys.")
+    while (_command := input().lower()) != "exit":
         time.sleep(0.05)
-        prnt("Type 'exit' at any time to exit program (the intensity bar will break, ignore it).\n")
+        if _command == "stats":
+            prnt(PipelineMetrics().summary())
+            continue
+        prnt("Type 'exit' at any time to exit program (what you type may be drawn over, keep typing).")
+        prnt("Type 'stats' to see how long events are taking to reach your toys.")
 
     prnt("Exiting program...")
-    output_queue.put(True)
-
-
-async def main(config: Config):
-    _vibe = Vibrator(config, ws_host="localhost")
-    await _vibe.connect_and_scan()
-    _vibe.set_device()
-
-    _name = config.config()['in_game_name']
-    _steam_id = config.config()['steamid_64']
-    _player_tracker = PlayerTracker(_name, _steam_id, config)
-    _sse_listener = SSEListener.with_mac()
-
-    _last_time = time.time() * 1000
-    _time_elapsed: float = 0.0
+    loop.call_soon_threadsafe(stop_event.set)
+
+
+def handle_event(
+        event: Union[KillEvent, ChatEvent, MapChangeEvent, None],
+        vibe: Vibrator,
+        player_tracker: PlayerTracker,
+        config: ConfigView,
+        trace: EventTrace = None
+) -> bool:
+    """
+    :param trace: of the event, followed through to the devices if the event sets off a vibration
+    :return: whether it did, and so took the trace
+    """
+    _ks: Optional[int] = None
+    _ds: Optional[int] = None
+    _updates: list[UpdateTypes]
+    _say = prnt if vibe.name is None else (lambda x: prnt(f"[{vibe.name}] {x}"))
+    if isinstance(event, ChatEvent):
+        _updates = player_tracker.handle_chat_message(event)
+    elif isinstance(event, KillEvent):
+        _ks, _ds, _updates = player_tracker.add_kill_event(event)
+        cast(AmbienceController, vibe.agent.get_agent('AMBINTCON')).update_parameters(_ks, _ds)
+    elif isinstance(event, MapChangeEvent):
+        _updates = player_tracker.handle_map_change(event)
+    else:
+        _updates = []
+
+    if trace is not None:
+        trace.stamp(Stage.TRACKER)
+
+    _vibrated = False
+    for update in _updates:
+        if update is None:
+            continue
+
+        _inten = config.instant_intensity(update)
+        if update in player_tracker.chat_triggers:
+            _trigger_inten = config.instant_chat_trigger_intensity(player_tracker.chat_triggers[update])
+            if _trigger_inten is not None:
+                _inten = _trigger_inten
+        _duration = config.instant_times(update)
+        vibe.apply_instant_intensity(
+            _inten,
+            float(_duration),
+            config.instant_curve(update),
+            trace,
+            config.instant_blend(update),
+            config.instant_priority(update)
+        )
+        _vibrated = True
+
+        match update:
+            case UpdateTypes.CHAT_YOU_SAY:
+                _say("YOU SAID A FORBIDDEN WORD -> GET VIBED")
+            case UpdateTypes.CHAT_ANY_SAY:
+                _say("WHAT A NICE PERSON -> MMM BZZZZZZ")
+            case UpdateTypes.GOT_KILLED:
+                _say("OH NO, YOU DIED -> *VIBRATES IN YOU*")
+            case UpdateTypes.KILLED_ENEMY:
+                _say("GOOD GIRL/BOY/PUPPY/KITTY -> HAVE A REWARD")
+            case UpdateTypes.CRIT_KILLED_ENEMY:
+                _say("FAIR AND BALANCED, BITCH! -> *GIBS YOU*")
+            case UpdateTypes.GOT_CRIT_KILLED:
+                _say("LOL NOOB EZ -> *TOUCHES UR PROSTATE*")
+            case UpdateTypes.REMOVED_DOMINATION:
+                _say("WOW NICE WORK! Domination removed...")
+            case UpdateTypes.DOMINATED_ENEMY:
+                _say("YOUR SO HOT! Dominating enemy...")
+    return _vibrated
+
+
+async def consume_events(
+        events: Subscription[Union[KillEvent, ChatEvent, MapChangeEvent]],
+        players: list[tuple[Vibrator, PlayerTracker]]
+) -> None:
+    """
+    Hand each event, parsed once, to every player profile in turn.
+    """
+    while True:
+        event = await events.get()
+        _trace = event.trace
+        if _trace is not None:
+            _trace.stamp(Stage.DEQUEUE)
+        for _vibe, _player_tracker in players:
+            # The trace follows the event through the first profile it sets off
+            if handle_event(event, _vibe, _player_tracker, _vibe.config, _trace):
+                _trace = None
+        if _trace is not None:
+            # Nothing further to follow
+            PipelineMetrics().complete(_trace)
+
+
+async def main(
+        config: Config, *,
+        record: Path = None,
+        replay: Path = None,
+        replay_speed: float = 1.0,
+        sse_endpoint: str = None,
+        ws_host: str = "localhost",
+        ws_port: int = 12345,
+        stop_event: Event = None
+):
+    """
+    Run the app until the user types 'exit', or until stop_event is set if one is given (in which case
+    there is no interactive prompt).
+    """
+    _loop = get_running_loop()
+    # One player, or one per profile, all fed from the one event stream and sharing the one connection
+    _profiles = config.profiles()
+    _connection: Optional[DeviceConnection] = None
+    _device_process: Optional[DeviceProcess] = None
+    _outputs: list[DeviceOutput]
+    if config.dispatch_separate_process():
+        prnt("Starting the device process...")
+        _device_process = DeviceProcess(len(_profiles))
+        _names = await _device_process.start(config, ws_host, ws_port)
+        _outputs = [
+            ChannelSlot(_device_process, _slot, _names[_slot], PipelineMetrics().complete)
+            for _slot in range(len(_profiles))
+        ]
+    else:
+        _connection = DeviceConnection(config, ws_host=ws_host, port=ws_port)
+        await _connection.connect_and_scan()
+        _outputs = [
+            DeviceGroup(_profile, _connection, PipelineMetrics().complete, owns=_owns)
+            for _profile, _owns in zip(_profiles, toy_filters(_profiles))
+        ]
+
+    _players: list[tuple[Vibrator, PlayerTracker]] = []
+    for _profile, _output in zip(_profiles, _outputs):
+        _output.sync()
+        _vibe = Vibrator(_profile, _output, name=_profile.name() if len(_profiles) > 1 else None)
+        _missing = set(_profile.toys() or ()) - {x.name for x in _output.status()}
+        if _missing:
+            prnt(f"{_profile.name()} is missing {', '.join(sorted(_missing))}")
+        _player_tracker = PlayerTracker(_profile.config()['in_game_name'], _profile.config()['steamid_64'], _profile)
+        _players.append((_vibe, _player_tracker))
+    _sse_listener = SSEListener(sse_endpoint) if sse_endpoint is not None else SSEListener.with_mac()
+    if record is not None:
+        _sse_listener.recorder = EventRecorder(record)
+    if replay is not None:
+        _sse_listener.replay = ReplaySource(replay, replay_speed)
+    _bus = _sse_listener.start()
+    # Never drops anything, as the trackers' kill streaks and dominations are only right if they see every kill.
+    # The consumer only falls behind while the loop is stalled, and catches up once it isn't
+    _events = _bus.subscribe(KillEvent, ChatEvent, MapChangeEvent, name="Vibration", maxsize=None)
 
     prnt("Starting vibrator...")
-    _vibe.start()
-    _flag_q: Queue = Queue()
-    _stop_flag: bool = False
-    _thread = Thread(
-        target=interaction_pane,
-        name="IO Control thread",
-        args=(_flag_q,)
-    )
-    _thread.start()
-
-    while not _stop_flag:
-        await _vibe.check_connection()
-        if not _sse_listener.q_subscriber.empty():
-            event = cast(Union[KillEvent, ChatEvent], _sse_listener.q_subscriber.get())
-            _ks: Optional[int] = None
-            _ds: Optional[int] = None
-            _updates: list[UpdateTypes]
-            if isinstance(event, ChatEvent):
-                _updates = _player_tracker.handle_chat_message(event)
-            elif isinstance(event, KillEvent):
-                _ks, _ds, _updates = _player_tracker.add_kill_event(event)
-                cast(AmbienceController, _vibe.agent.get_agent('AMBINTCON')).update_parameters(_ks, _ds)
-            else:
-                _updates = []
-
-            for update in _updates:
-                if update is None:
-                    continue
-
-                _inten = config.instant_intensity(update)
-                _duration = config.instant_times(update)
-                _vibe.apply_instant_intensity(_inten, float(_duration))
-
-                match update:
-                    case UpdateTypes.CHAT_YOU_SAY:
-                        prnt("YOU SAID A FORBIDDEN WORD -> GET VIBED")
-                    case UpdateTypes.CHAT_ANY_SAY:
-                        prnt("WHAT A NICE PERSON -> MMM BZZZZZZ")
-                    case UpdateTypes.GOT_KILLED:
-                        prnt("OH NO, YOU DIED -> *VIBRATES IN YOU*")
-                    case UpdateTypes.KILLED_ENEMY:
-                        prnt("GOOD GIRL/BOY/PUPPY/KITTY -> HAVE A REWARD")
-                    case UpdateTypes.CRIT_KILLED_ENEMY:
-                        prnt("FAIR AND BALANCED, BITCH! -> *GIBS YOU*")
-                    case UpdateTypes.GOT_CRIT_KILLED:
-                        prnt("LOL NOOB EZ -> *TOUCHES UR PROSTATE*")
-                    case UpdateTypes.REMOVED_DOMINATION:
-                        prnt("WOW NICE WORK! Domination removed...")
-                    case UpdateTypes.DOMINATED_ENEMY:
-                        prnt("YOUR SO HOT! Dominating enemy...")
-
-        await _vibe.issue_command()
-        try:
-            _value = _flag_q.get(block=False)
-            if isinstance(_value, bool) and _value:
-                _stop_flag = _value
-        except queue.Empty:
-            pass
-
-    _thread.join()
+    for _vibe, _ in _players:
+        _vibe.start()
+    _thread: Optional[Thread] = None
+    _display: Optional[StatusDisplay] = None
+    if stop_event is None:
+        # Only draw the status for someone watching, not when output is piped or the run is headless
+        if sys.stdout.isatty():
+            _display = StatusDisplay(config, lambda: [x.status(y) for x, y in _players])
+            _display.start()
+            _display.follow(_bus.subscribe(KillEvent, ChatEvent, MapChangeEvent, name="Status display", maxsize=64))
+        _stop_event = Event()
+        _thread = Thread(
+            target=interaction_pane,
+            name="IO Control thread",
+            args=(_loop, _stop_event)
+        )
+        _thread.start()
+    else:
+        _stop_event = stop_event
+
+    # Nothing here polls but the config watcher, which checks the file once a second: the dispatcher sleeps
+    # until the controller has a new intensity, and the consumer sleeps until the SSE listener delivers an event.
+    _tasks = [
+        *(asyncio.create_task(x.run_dispatch(), name="Vibrator dispatch") for x, _ in _players),
+        asyncio.create_task(consume_events(_events, _players), name="SSE event consumer"),
+        asyncio.create_task(config.watch(), name="Config watcher"),
+    ]
+    await _stop_event.wait()
+    for _task in _tasks:
+        _task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+
+    if _thread is not None:
+        _thread.join()
+    if _display is not None:
+        _display.stop()
     prnt("Attempting stop of all vibrator components...")
-    asyncio.ensure_future(_vibe.stop_all(), loop=get_running_loop())
+    for _vibe, _ in _players:
+        await _vibe.stop_all()
+    if _connection is not None:
+        await _connection.disconnect()
+    if _device_process is not None:
+        await _device_process.stop()
     prnt("Killed vibrator component...")
 
     prnt("Awaiting soft exit of SSEListener (will force exit after 2s)...")
-    _inst = SSEListener(event_endpoint=None)
-    if _inst.t_subscriber is not None:
-        _inst.shutdown_flag = True
-        _inst.t_subscriber.join(timeout=2.0)
+    _sse_listener.stop()
+    await _sse_listener.wait_stopped(timeout=2.0)
     prnt("Killed SSE Listener...")
+    prnt(f"Event latencies this session:\n{PipelineMetrics().summary()}")
     prnt("Vibe Controller Exiting...")
 
 
@@ -0,0 +1,111 @@
+import copy
+import re
+from pathlib import Path
+
+import pytest
+import toml
+
+from mac_toys.config import ConfigError, validate
+
+_SHIPPED = Path(__file__).resolve().parents[1] / "config.toml"
+
+
+@pytest.fixture
+def values() -> dict:
+    return copy.deepcopy(toml.load(_SHIPPED))
+
+
+def test_shipped_config_is_valid(values):
+    validate(values)
+
+
+def test_profiles_are_valid(values):
+    values['profiles'] = [
+        {'name': "Alex", 'in_game_name': "alex", 'steamid_64': 1, 'toys': ["Hush"]},
+        {'name': "Sam", 'in_game_name': "sam", 'steamid_64': "2", 'instant': {'intensity': {'on_kill': 0.5}}},
+    ]
+    validate(values)
+
+
+def _delete(*path: str):
+    def _apply(values: dict) -> None:
+        for _key in path[:-1]:
+            values = values[_key]
+        del values[path[-1]]
+    return _apply
+
+
+def _set(value, *path: str):
+    def _apply(values: dict) -> None:
+        for _key in path[:-1]:
+            values = values[_key]
+        values[path[-1]] = value
+    return _apply
+
+
+@pytest.mark.parametrize(("change", "complaint"), [
+    (_delete('in_game_name'), "'in_game_name'"),
+    (_set(1.5, 'steamid_64'), "'steamid_64'"),
+    (_delete('instant', 'times'), "[instant.times] is missing"),
+    (_set("fast", 'instant', 'times', 'on_kill'), "'on_kill' in [instant.times]"),
+    (_set(True, 'instant', 'intensity', 'on_kill'), "'on_kill' in [instant.intensity]"),
+    (_set("multiply", 'instant', 'blend', 'on_kill'), "[instant.blend]"),
+    (_set("high", 'instant', 'priority', 'on_kill'), "[instant.priority]"),
+    (_set("uwu", 'instant', 'chat_messages', 'trigger_on_you_say'), "'trigger_on_you_say'"),
+    (_set(["uwu", 3], 'instant', 'chat_messages', 'trigger_on_any_say'), "'trigger_on_any_say'"),
+    (_delete('ambience', 'max_at_value'), "[ambience.max_at_value] is missing"),
+    (_set(None, 'ambience', 'intensity', 'killstreak_minimum'), "[ambience.intensity]"),
+    (_set("lots", 'tracking', 'max_opponents'), "[tracking]"),
+    (_set(5, 'devices', 'registry'), "'registry'"),
+    (_set("yes", 'dispatch', 'separate_process'), "'separate_process'"),
+    (_set("10", 'dispatch', 'max_rate'), "[dispatch]"),
+    (_set("10", 'display', 'fps'), "[display]"),
+    (_set("Alex", 'profiles'), "[[profiles]]"),
+])
+def test_rejects(values, change, complaint):
+    change(values)
+    with pytest.raises(ConfigError, match=re.escape(complaint)):
+        validate(values)
+
+
+def test_rejects_bad_profile_naming_it(values):
+    values['profiles'] = [
+        {'in_game_name': "alex", 'steamid_64': 1},
+        {'in_game_name': "sam", 'steamid_64': 2, 'instant': {'blend': {'on_kill': "multiply"}}},
+    ]
+    with pytest.raises(ConfigError, match=r"^In profile 2: .*\[instant\.blend\]"):
+        validate(values)
+
+
+def test_rejects_toy_in_two_profiles(values):
+    values['profiles'] = [
+        {'in_game_name': "alex", 'steamid_64': 1, 'toys': ["Hush"]},
+        {'in_game_name': "sam", 'steamid_64': 2, 'toys': ["Lush", "Hush"]},
+    ]
+    with pytest.raises(ConfigError, match="'Hush' is listed by more than one profile"):
+        validate(values)
+
+
+def test_rejects_two_profiles_without_toys(values):
+    values['profiles'] = [
+        {'in_game_name': "alex", 'steamid_64': 1},
+        {'in_game_name': "sam", 'steamid_64': 2, 'toys': ["Hush"]},
+        {'in_game_name': "kim", 'steamid_64': 3},
+    ]
+    with pytest.raises(ConfigError, match="Only one profile can leave out 'toys'"):
+        validate(values)
+
+
+def test_toys_at_the_top_count_for_every_profile(values):
+    values['toys'] = ["Hush"]
+    values['profiles'] = [
+        {'in_game_name': "alex", 'steamid_64': 1, 'toys': ["Lush"]},
+        {'in_game_name': "sam", 'steamid_64': 2},
+    ]
+    validate(values)
+
+
+def test_profile_inherits_whats_missing(values):
+    # Nothing but who the player is, everything else comes from the top of the file
+    values['profiles'] = [{'in_game_name': "alex", 'steamid_64': 1}]
+    validate(values)
@@ -0,0 +1,62 @@
+import pytest
+
+from mac_toys.device_process import IntensityChannel
+
+
+@pytest.fixture
+def channel() -> IntensityChannel:
+    _channel = IntensityChannel(3)
+    yield _channel
+    _channel.close()
+    _channel.unlink()
+
+
+def test_starts_zeroed(channel):
+    assert channel.read_targets() == (0, (0.0, 0.0, 0.0))
+    assert channel.read_ack(0) == (0, 0.0, 0.0)
+
+
+def test_target_round_trip(channel):
+    _first = channel.write_target(1, 0.25)
+    _second = channel.write_target(2, 0.75)
+    assert _second > _first
+    assert channel.read_targets() == (_second, (0.0, 0.25, 0.75))
+
+
+def test_counts_stay_even(channel):
+    for _slot in range(3):
+        assert channel.write_target(_slot, 0.5) % 2 == 0
+
+
+def test_seen_through_another_attachment(channel):
+    _other = IntensityChannel(channel.slots, channel.name)
+    try:
+        _count = channel.write_target(0, 0.5)
+        assert _other.read_targets() == (_count, (0.5, 0.0, 0.0))
+        _other.write_ack(0, _count, 10.0, 10.25)
+        assert channel.read_ack(0) == (_count, 10.0, 10.25)
+    finally:
+        _other.close()
+
+
+def test_ack_round_trip_per_slot(channel):
+    channel.write_ack(0, 2, 1.0, 1.5)
+    channel.write_ack(2, 4, 2.0, 2.5)
+    assert channel.read_ack(0) == (2, 1.0, 1.5)
+    assert channel.read_ack(1) == (0, 0.0, 0.0)
+    assert channel.read_ack(2) == (4, 2.0, 2.5)
+
+
+def test_read_mid_write_is_refused(channel):
+    channel.write_target(0, 0.5)
+    # As the writer leaves it between making the count odd and even again
+    _count = IntensityChannel._COUNT.unpack_from(channel.memory.buf, 0)[0]
+    IntensityChannel._COUNT.pack_into(channel.memory.buf, 0, _count + 1)
+    assert channel.read_targets() is None
+    IntensityChannel._COUNT.pack_into(channel.memory.buf, 0, _count + 2)
+    assert channel.read_targets() == (_count + 2, (0.5, 0.0, 0.0))
+
+
+def test_ack_read_mid_write_is_refused(channel):
+    IntensityChannel._COUNT.pack_into(channel.memory.buf, channel._acks_at, 1)
+    assert channel.read_ack(0) is None
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from mac_toys.event_bus import EventBus, Overflow, SubscriptionClosed
+
+
+def _drain(subscription) -> list:
+    _taken = []
+    while (_event := subscription.get_nowait()) is not None:
+        _taken.append(_event)
+    return _taken
+
+
+def test_drop_oldest():
+    _bus = EventBus()
+    _events = _bus.subscribe(int, maxsize=2, overflow=Overflow.DROP_OLDEST)
+    for _event in (1, 2, 3, 4):
+        _bus.publish(_event)
+    assert _drain(_events) == [3, 4]
+    assert _events.dropped == 2
+
+
+def test_drop_newest():
+    _bus = EventBus()
+    _events = _bus.subscribe(int, maxsize=2, overflow=Overflow.DROP_NEWEST)
+    for _event in (1, 2, 3, 4):
+        _bus.publish(_event)
+    assert _drain(_events) == [1, 2]
+    assert _events.dropped == 2
+
+
+def test_unsubscribe_keeps_whats_buffered():
+    _bus = EventBus()
+    _events = _bus.subscribe(int, maxsize=2, overflow=Overflow.UNSUBSCRIBE)
+    for _event in (1, 2, 3, 4):
+        _bus.publish(_event)
+    assert _events.closed
+    assert _drain(_events) == [1, 2]
+
+    async def _get():
+        return await _events.get()
+
+    with pytest.raises(SubscriptionClosed):
+        asyncio.run(_get())
+
+
+def test_unbounded_never_drops():
+    _bus = EventBus()
+    _events = _bus.subscribe(int, maxsize=None)
+    for _event in range(10_000):
+        _bus.publish(_event)
+    assert len(_events) == 10_000
+    assert _events.dropped == 0
+    assert _drain(_events) == list(range(10_000))
+
+
+def test_overflow_is_per_subscriber():
+    _bus = EventBus()
+    _slow = _bus.subscribe(int, maxsize=1, overflow=Overflow.DROP_NEWEST)
+    _fast = _bus.subscribe(int, maxsize=8)
+    for _event in (1, 2, 3):
+        _bus.publish(_event)
+    assert _drain(_slow) == [1]
+    assert _drain(_fast) == [1, 2, 3]
+
+
+def test_routes_by_type_including_subclasses():
+    _bus = EventBus()
+    _numbers = _bus.subscribe(int)
+    _text = _bus.subscribe(str)
+    for _event in (1, "a", True, 2.5):
+        _bus.publish(_event)
+    assert _drain(_numbers) == [1, True]
+    assert _drain(_text) == ["a"]
+
+
+def test_subscribing_later_only_sees_later_events():
+    _bus = EventBus()
+    _bus.publish(1)
+    _events = _bus.subscribe(int)
+    _bus.publish(2)
+    assert _drain(_events) == [2]
+
+
+def test_needs_room_for_an_event():
+    with pytest.raises(ValueError):
+        EventBus().subscribe(int, maxsize=0)
+
+
+def test_get_waits_for_an_event():
+    async def _run():
+        _bus = EventBus()
+        _events = _bus.subscribe(int)
+        _getting = asyncio.create_task(_events.get())
+        await asyncio.sleep(0)
+        assert not _getting.done()
+        _bus.publish(7)
+        return await asyncio.wait_for(_getting, 1.0)
+
+    assert asyncio.run(_run()) == 7
@@ -0,0 +1,52 @@
+from mac_toys.matching import TriggerMatcher
+
+
+def test_case_fold_reports_trigger_as_written():
+    _matcher = TriggerMatcher(["UwU", "cheater"])
+    assert _matcher.find("hey UWU there") == "UwU"
+    assert _matcher.find("CHEATER!!") == "cheater"
+
+
+def test_case_fold_off_is_exact():
+    _matcher = TriggerMatcher(["UwU"], case_fold=False)
+    assert _matcher.find("uwu") is None
+    assert _matcher.find("an UwU") == "UwU"
+
+
+def test_case_fold_is_full_casefold():
+    # 'ß' folds to 'ss', which lower() alone doesn't do
+    assert TriggerMatcher(["STRASSE"]).find("die straße") == "STRASSE"
+
+
+def test_substring_matches_without_word_boundary():
+    assert TriggerMatcher(["bot"]).find("robots") == "bot"
+
+
+def test_word_boundary():
+    _matcher = TriggerMatcher(["bot", "fuck you"], word_boundary=True)
+    assert _matcher.find("robots") is None
+    assert _matcher.find("bots") is None
+    assert _matcher.find("a bot!") == "bot"
+    assert _matcher.find("bot") == "bot"
+    assert _matcher.find("well fuck you.") == "fuck you"
+    assert _matcher.find("fuck your") is None
+
+
+def test_word_boundary_around_punctuation():
+    _matcher = TriggerMatcher(["*pets you*"], word_boundary=True)
+    assert _matcher.find("she *pets you* gently") == "*pets you*"
+    assert _matcher.find("x*pets you*") is None
+    assert _matcher.find("*pets you*x") is None
+
+
+def test_longest_trigger_wins_at_same_position():
+    assert TriggerMatcher(["fag", "faggot"]).find("you faggot") == "faggot"
+
+
+def test_first_trigger_in_message_wins():
+    assert TriggerMatcher(["wtf", "bot"]).find("bot wtf") == "bot"
+
+
+def test_no_triggers():
+    assert TriggerMatcher([]).find("anything") is None
+    assert TriggerMatcher([""]).find("anything") is None
@@ -0,0 +1,120 @@
+import pytest
+
+from mac_toys.curves import Curve
+from mac_toys.metrics import EventTrace, Stage
+from mac_toys.vibration.mixer import BlendMode, IntensityMixer
+
+
+def test_nothing_to_mix():
+    assert IntensityMixer().mix(0.3, now=0.0) == pytest.approx(0.3)
+
+
+def test_add_slides_to_nothing():
+    _mixer = IntensityMixer()
+    _mixer.add(0.5, 1000, blend=BlendMode.ADD, now=0.0)
+    assert _mixer.mix(0.2, now=0.0) == pytest.approx(0.7)
+    assert _mixer.mix(0.2, now=0.5) == pytest.approx(0.45)
+    assert _mixer.mix(0.2, now=1.0) == pytest.approx(0.2)
+    # Finished, so dropped
+    assert len(_mixer) == 0
+
+
+def test_add_isnt_clamped():
+    _mixer = IntensityMixer()
+    _mixer.add(0.8, 1000, now=0.0)
+    _mixer.add(0.8, 1000, now=0.0)
+    assert _mixer.mix(0.2, now=0.0) == pytest.approx(1.8)
+
+
+def test_max_only_ever_raises():
+    _mixer = IntensityMixer()
+    _mixer.add(0.5, 1000, blend=BlendMode.MAX, now=0.0)
+    assert _mixer.mix(0.3, now=0.0) == pytest.approx(0.5)
+    # Slid down to 0.25 by now, under the base
+    assert _mixer.mix(0.3, now=0.5) == pytest.approx(0.3)
+
+
+def test_duck_turns_down():
+    _mixer = IntensityMixer()
+    _mixer.add(0.25, 1000, blend=BlendMode.DUCK, now=0.0)
+    assert _mixer.mix(0.8, now=0.0) == pytest.approx(0.6)
+    # Never below nothing
+    _mixer.add(3.0, 1000, blend=BlendMode.DUCK, now=0.0)
+    assert _mixer.mix(0.8, now=0.0) == pytest.approx(0.0)
+
+
+def test_higher_priority_blends_over_lower():
+    _over = IntensityMixer()
+    _over.add(0.4, 1000, blend=BlendMode.ADD, priority=0, now=0.0)
+    _over.add(0.5, 1000, blend=BlendMode.DUCK, priority=1, now=0.0)
+    assert _over.mix(0.4, now=0.0) == pytest.approx((0.4 + 0.4) * 0.5)
+
+    _under = IntensityMixer()
+    _under.add(0.4, 1000, blend=BlendMode.ADD, priority=0, now=0.0)
+    _under.add(0.5, 1000, blend=BlendMode.DUCK, priority=-1, now=0.0)
+    assert _under.mix(0.4, now=0.0) == pytest.approx(0.4 * 0.5 + 0.4)
+
+
+def test_same_priority_blends_in_order_added():
+    _mixer = IntensityMixer()
+    _mixer.add(0.9, 1000, blend=BlendMode.MAX, now=0.0)
+    _mixer.add(0.1, 1000, blend=BlendMode.ADD, now=0.0)
+    assert _mixer.mix(0.0, now=0.0) == pytest.approx(1.0)
+
+
+def test_layer_not_started_yet_is_at_its_peak():
+    _mixer = IntensityMixer()
+    _mixer.add(0.5, 1000, now=1.0)
+    assert _mixer.mix(0.0, now=0.5) == pytest.approx(0.5)
+
+
+def test_zero_duration_is_already_finished():
+    _mixer = IntensityMixer()
+    _mixer.add(0.5, 0, now=0.0)
+    assert _mixer.mix(0.1, now=0.0) == pytest.approx(0.1)
+    assert len(_mixer) == 0
+
+
+def test_curve_shapes_the_slide():
+    # Covers most of the way in the first half
+    _curve = Curve.from_points("punchy", [0.0, 0.8, 1.0])
+    _mixer = IntensityMixer()
+    _mixer.add(1.0, 1000, curve=_curve, now=0.0)
+    assert _mixer.mix(0.0, now=0.5) == pytest.approx(1.0 - _curve.sample(0.5))
+    assert _mixer.mix(0.0, now=0.5) < 0.5
+
+
+def test_finished_layers_are_compacted_out():
+    _mixer = IntensityMixer()
+    _mixer.add(0.1, 500, now=0.0)
+    _mixer.add(0.2, 2000, now=0.0)
+    _mixer.add(0.3, 500, now=0.0)
+    _mixer.add(0.4, 2000, now=0.0)
+    assert _mixer.mix(0.0, now=1.0) == pytest.approx(0.2 * 0.5 + 0.4 * 0.5)
+    assert len(_mixer) == 2
+    assert _mixer.mix(0.0, now=1.5) == pytest.approx(0.2 * 0.25 + 0.4 * 0.25)
+
+
+def test_full_table_makes_way_for_higher_priority():
+    _mixer = IntensityMixer(capacity=2)
+    assert _mixer.add(0.1, 1000, priority=1, now=0.0)
+    assert _mixer.add(0.2, 1000, priority=1, now=0.0)
+    assert not _mixer.add(0.3, 1000, priority=0, now=0.0)
+    assert _mixer.add(0.4, 1000, priority=2, now=0.0)
+    assert len(_mixer) == 2
+    # The oldest of the lowest priority made way
+    assert _mixer.mix(0.0, now=0.0) == pytest.approx(0.2 + 0.4)
+
+
+def test_clear():
+    _mixer = IntensityMixer()
+    _mixer.add(0.5, 1000, now=0.0)
+    _mixer.clear()
+    assert len(_mixer) == 0
+    assert _mixer.mix(0.1, now=0.0) == pytest.approx(0.1)
+
+
+def test_trace_stamped_as_layer_starts():
+    _trace = EventTrace()
+    IntensityMixer().add(0.5, 1000, trace=_trace, now=12.5)
+    assert _trace.at(Stage.SLIDER) == 12.5
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from mac_toys.sse_listener import SSEListener, SSEMessage
+
+_RESPONSE = b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n\r\n"
+
+
+class _Writer:
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def listener(monkeypatch) -> SSEListener:
+    _listener = SSEListener("http://127.0.0.1:3621/mac/game/events/v1")
+    monkeypatch.setattr(_listener, 'last_event_id', None)
+    monkeypatch.setattr(_listener, 'reconnect_base', SSEListener.reconnect_base)
+    return _listener
+
+
+def _stream(listener: SSEListener, monkeypatch, chunks: list[bytes], response: bytes = _RESPONSE) -> list[SSEMessage]:
+    """
+    :return: every message the listener parses from the body, arriving in the given chunks
+    """
+    async def _connect():
+        _reader = asyncio.StreamReader()
+        _reader.feed_data(response)
+        return _reader, _Writer()
+
+    async def _body(reader, headers):
+        for _chunk in chunks:
+            yield _chunk
+
+    monkeypatch.setattr(listener, '_connect', _connect)
+    monkeypatch.setattr(listener, '_body', _body)
+
+    async def _collect():
+        return [x async for x in listener._stream()]
+
+    return asyncio.run(_collect())
+
+
+def test_crlf_split_between_chunks_is_one_line_ending(listener, monkeypatch):
+    _messages = _stream(listener, monkeypatch, [b"data: a\r", b"\ndata: b\r", b"\n\r", b"\n"])
+    assert [x.data for x in _messages] == ["a\nb"]
+
+
+def test_lone_cr_and_lf_line_endings(listener, monkeypatch):
+    _messages = _stream(
+        listener, monkeypatch, [b"data: x\rdata: y\r\r", b"data: z\n", b"\n", b"data: w\r\n\r\n"]
+    )
+    assert [x.data for x in _messages] == ["x\ny", "z", "w"]
+
+
+def test_field_split_mid_line(listener, monkeypatch):
+    _messages = _stream(listener, monkeypatch, [b"ev", b"ent: kill\nda", b"ta: {}", b"\n\n"])
+    assert _messages == [SSEMessage("{}", "kill", None)]
+
+
+def test_fields(listener, monkeypatch):
+    _messages = _stream(
+        listener, monkeypatch, [b": keep-alive\nevent: kill\nid: 7\nretry: 2500\ndata:no-space\ndata:  two\n\n"]
+    )
+    assert _messages == [SSEMessage("no-space\n two", "kill", "7")]
+    assert listener.last_event_id == "7"
+    assert listener.reconnect_base == pytest.approx(2.5)
+
+
+def test_event_type_and_id_carry_over_correctly(listener, monkeypatch):
+    _messages = _stream(listener, monkeypatch, [b"event: kill\nid: 1\ndata: a\n\ndata: b\n\n"])
+    assert _messages == [SSEMessage("a", "kill", "1"), SSEMessage("b", "message", "1")]
+
+
+def test_event_without_data_is_not_dispatched(listener, monkeypatch):
+    assert _stream(listener, monkeypatch, [b"event: kill\n\n", b"id: 2\n\n"]) == []
+    assert listener.last_event_id == "2"
+
+
+def test_id_with_null_is_ignored(listener, monkeypatch):
+    _stream(listener, monkeypatch, [b"id: 3\n\nid: 4\0\n\n"])
+    assert listener.last_event_id == "3"
+
+
+def test_retry_is_floored(listener, monkeypatch):
+    _stream(listener, monkeypatch, [b"retry: 0\n\n"])
+    assert listener.reconnect_base == listener.reconnect_floor
+
+
+def test_retry_must_be_digits(listener, monkeypatch):
+    _stream(listener, monkeypatch, [b"retry: soon\n\nretry: -5\n\n"])
+    assert listener.reconnect_base == SSEListener.reconnect_base
+
+
+def test_silent_server_times_out_before_headers(listener, monkeypatch):
+    monkeypatch.setattr(listener, 'connect_timeout', 0.05)
+    with pytest.raises(TimeoutError):
+        _stream(listener, monkeypatch, [], response=b"")
@@ -0,0 +1,153 @@
+import pytest
+
+from mac_toys.clock import VirtualClock, clock, use
+from mac_toys.sse_listener import KillEvent, MapChangeEvent
+from mac_toys.tracker import PlayerTracker, UpdateTypes
+
+_PLAYER = "76561198000000000"
+
+
+class _TrackingConfig:
+    """
+    Just the settings the tracker looks up.
+    """
+
+    def __init__(self, max_opponents: int = 256, idle_minutes: float = 30.0) -> None:
+        self.max_opponents = max_opponents
+        self.idle_minutes = idle_minutes
+
+    def tracking_max_opponents(self) -> int:
+        return self.max_opponents
+
+    def tracking_opponent_idle_minutes(self) -> float:
+        return self.idle_minutes
+
+    def instant_chat_messages(self, key: str) -> list[str]:
+        return []
+
+    def instant_chat_matching(self, key: str) -> bool:
+        return False
+
+    def add_listener(self, listener) -> None:
+        pass
+
+
+@pytest.fixture
+def virtual_clock() -> VirtualClock:
+    _previous = clock()
+    _clock = VirtualClock()
+    use(_clock)
+    yield _clock
+    use(_previous)
+
+
+def _new_tracker(**config) -> PlayerTracker:
+    return PlayerTracker("me", _PLAYER, _TrackingConfig(**config))
+
+
+def _kill(tracker: PlayerTracker, victim: str) -> list[UpdateTypes]:
+    return tracker.add_kill_event(KillEvent(("me", _PLAYER), (victim, victim), "scattergun", False))[2]
+
+
+def _killed_by(tracker: PlayerTracker, killer: str) -> list[UpdateTypes]:
+    return tracker.add_kill_event(KillEvent((killer, killer), ("me", _PLAYER), "scattergun", False))[2]
+
+
+def test_dominating_after_three_kills_in_a_row(virtual_clock):
+    _tracker = _new_tracker()
+    assert UpdateTypes.DOMINATED_ENEMY not in _kill(_tracker, "a")
+    assert UpdateTypes.DOMINATED_ENEMY not in _kill(_tracker, "a")
+    assert UpdateTypes.DOMINATED_ENEMY in _kill(_tracker, "a")
+    assert _tracker.dominating == {"a"}
+    # Only the once
+    assert UpdateTypes.DOMINATED_ENEMY not in _kill(_tracker, "a")
+
+    assert UpdateTypes.LOST_DOMINATION in _killed_by(_tracker, "a")
+    assert _tracker.dominating == set()
+    assert _tracker.opponents["a"].kills_in_a_row == 0
+
+
+def test_kills_on_others_dont_break_a_run(virtual_clock):
+    _tracker = _new_tracker()
+    _kill(_tracker, "a")
+    _kill(_tracker, "b")
+    _kill(_tracker, "a")
+    _killed_by(_tracker, "b")
+    assert UpdateTypes.DOMINATED_ENEMY in _kill(_tracker, "a")
+
+
+def test_dominated_after_three_deaths_in_a_row(virtual_clock):
+    _tracker = _new_tracker()
+    _killed_by(_tracker, "a")
+    _killed_by(_tracker, "a")
+    assert UpdateTypes.GOT_DOMINATED in _killed_by(_tracker, "a")
+    assert _tracker.dominated_by == {"a"}
+
+    assert UpdateTypes.REMOVED_DOMINATION in _kill(_tracker, "a")
+    assert _tracker.dominated_by == set()
+
+
+def test_streaks(virtual_clock):
+    _tracker = _new_tracker()
+    _kill(_tracker, "a")
+    _kill(_tracker, "b")
+    assert (_tracker.kill_streak, _tracker.death_streak) == (2, 0)
+    _killed_by(_tracker, "a")
+    _killed_by(_tracker, "b")
+    assert (_tracker.kill_streak, _tracker.death_streak) == (0, 1)
+    _killed_by(_tracker, "c")
+    assert (_tracker.kill_streak, _tracker.death_streak) == (0, 2)
+
+
+def test_least_recently_seen_opponent_is_evicted(virtual_clock):
+    _tracker = _new_tracker(max_opponents=2)
+    _kill(_tracker, "a")
+    _kill(_tracker, "b")
+    # Seeing 'a' again makes 'b' the least recently seen
+    _kill(_tracker, "a")
+    _kill(_tracker, "c")
+    assert list(_tracker.opponents) == ["a", "c"]
+
+
+def test_evicted_opponent_takes_domination_with_it(virtual_clock):
+    _tracker = _new_tracker(max_opponents=2)
+    for _ in range(3):
+        _kill(_tracker, "a")
+    _killed_by(_tracker, "b")
+    _killed_by(_tracker, "b")
+    _killed_by(_tracker, "b")
+    assert _tracker.dominating == {"a"} and _tracker.dominated_by == {"b"}
+
+    _kill(_tracker, "c")
+    assert "a" not in _tracker.opponents
+    assert _tracker.dominating == set()
+    assert _tracker.dominated_by == {"b"}
+
+
+def test_idle_opponents_are_evicted(virtual_clock):
+    _tracker = _new_tracker(idle_minutes=1.0)
+    _kill(_tracker, "a")
+    _kill(_tracker, "a")
+    virtual_clock.advance_to(30.0)
+    _kill(_tracker, "b")
+    assert list(_tracker.opponents) == ["a", "b"]
+
+    virtual_clock.advance_to(61.0)
+    _kill(_tracker, "b")
+    assert list(_tracker.opponents) == ["b"]
+    # Starting over on 'a'
+    _kill(_tracker, "a")
+    assert _tracker.opponents["a"].kills_in_a_row == 1
+
+
+def test_map_change_forgets_everyone(virtual_clock):
+    _tracker = _new_tracker()
+    for _ in range(3):
+        _kill(_tracker, "a")
+    _tracker.handle_map_change(MapChangeEvent("pl_upward"))
+    assert _tracker.current_map == "pl_upward"
+    assert not _tracker.opponents and not _tracker.dominating
+    # Not on the same map again
+    _kill(_tracker, "b")
+    _tracker.handle_map_change(MapChangeEvent("pl_upward"))
+    assert list(_tracker.opponents) == ["b"]